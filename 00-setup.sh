@@ -16,6 +16,12 @@ mkdir -p in
 mkdir -p tmp
 mkdir -p out
 
+if [ "${STREAM_INPUT:-0}" = "1" ]; then
+  # pyosmium/run-challenges.py --url downloads and processes the extract at once
+  echo "=== Download left to the streaming run ==="
+  exit 0
+fi
+
 echo "=== Download France OSM extract with aria2 ==="
 aria2c \
   --max-connection-per-server=16 \
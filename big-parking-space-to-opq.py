@@ -6,130 +6,61 @@ Stats for planet-220808.osm.pbf
 -Total of ways: 682118
 -Program ended in 00:47:25.52
 """
-from io import TextIOWrapper
+import os
 import osmium
 import sys
 import getopt
 import time
-import shapely.wkb as wkblib
 
-wkbfab = osmium.geom.WKBFactory()
+# shared helpers live next to the pyosmium detectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyosmium"))
+import measure  # noqa: E402
+from blobindex import apply_handler, load_index  # noqa: E402
+from challenges import get_rules  # noqa: E402
+from locations import CandidateLocations  # noqa: E402
+from overpass import DEFAULT_BATCH_SIZE, OverpassSink, rule_filter  # noqa: E402
+from progress import Progress  # noqa: E402
 
 
 class BigParkingSpaceHandler(osmium.SimpleHandler):
-    # output file
-    out: TextIOWrapper
     # total ways for stats
     nbWay: int = 0
-    # write in file or print in console
-    withFile = True
 
-    def __init__(self, withFile, outFileName):
+    def __init__(self, rule, withProgress=True):
         super(BigParkingSpaceHandler, self).__init__()
-        self.withFile = withFile
-        if self.withFile:
-            self.out = open(outFileName, "w")
-
-        self.printHeader()
-
-    def __del__(self):
-        self.printFooter()
-        if self.withFile:
-            self.out.close()
-
-    def write(self, txt):
-        if self.withFile:
-            self.out.write("%s\n" % txt)
-            self.out.flush()
-        else:
-            print(txt)
-
-    # create and init output file
-    def printHeader(self):
-        self.write("[out:json];")
-        self.write("// Start of Overpass query")
-        self.write("(")
-
-    # close output file
-    def printFooter(self):
-        self.write(");")
-        self.write("")
-        self.write("// Just reapply filter to ignore updated objects")
-        self.write("way._")
-        self.write("  [amenity=parking_space]")
-        self.write("  [!capacity]")
-        self.write("  (if: length() > 100);")
-        self.write("// End of Overpass query")
-        self.write("// Total of ways: %i" % self.nbWay)
-        self.write("out meta geom;")
-        if self.withFile:
-            print("")
-            print("Total of ways: %i" % self.nbWay, flush=True)
-
-    def write_area(self, id, val):
-        try:
-            if val > 0:
-                self.write("  way(%s); // len=%s" % (id, val))
-            else:
-                self.write("  way(%s);" % id)
-            if self.withFile:
-                sys.stdout.write("\rWays found: %i" % self.nbWay)
-                sys.stdout.flush()
-        except:
-            self.write("  way(%s);" % id)
-            if self.withFile:
-                print("Warning: can not print length of way %s" % id)
-                print("Ways found: %i" % self.nbWay, flush=True)
-
-    def getlen(self, w):
-        length = 0
-        try:
-            wkb = wkbfab.create_linestring(
-                w, use_nodes=osmium.geom.use_nodes.UNIQUE)
-            line = wkblib.loads(wkb, hex=True)
-            length = line.length
-        except Exception:
-            length = -1
-
-        if length != -1:
-            return length
-
-        try:
-            length = osmium.geom.haversine_distance(w.nodes)
-        except osmium.InvalidLocationError:
-            length = -2
-
-        return length
+        self.rule = rule  # big-parking-space rule, see pyosmium/challenges.py
+        self.candidates = CandidateLocations()  # node refs of the matching ways
+        self.ways = []  # (way id, start, end) of the matching ways
+        self.progress = Progress(enabled=withProgress, text=lambda: "Ways found: %i" % self.nbWay)
 
     # osmium way handler
-
     def way(self, w):
-        osmium.make_simple_handler
-        if w.tags.get('amenity') == 'parking_space':
-            if 'capacity' not in w.tags:
-                self.nbWay += 1  # increment counter
-                self.write_area(w.id, -1)
-
-    # osmium area handler
-    def old_area(self, a):
-        osmium.make_simple_handler
-        if a.tags.get('amenity') == 'parking_space':
-            if 'capacity' not in a.tags:
-                try:
-                    wkb = wkbfab.create_multipolygon(a)
-                    poly = wkblib.loads(wkb, hex=True)
-                    len = poly.length * 100000
-                except:
-                    len = -1
-                if poly.length > 100:
-                    self.nbWay += 1  # increment counter
-                    self.write_area(a.orig_id(), len)
-
-
-def main(input, withFile, output):
-    osmium.make_simple_handler()
-    handler = BigParkingSpaceHandler(withFile, output)
-    handler.apply_file(input, locations=False)
+        if self.rule.match(w):
+            self.nbWay += 1  # increment counter
+            start, end = self.candidates.add_way(w)
+            self.ways.append((w.id, start, end))
+            self.progress.update()
+
+
+def main(input, output, batchSize=DEFAULT_BATCH_SIZE, maxIds=None):
+    rule = get_rules(["big-parking-space"])[0]
+    # the footer reapplies the tag conditions and the length bound of the rule
+    sink = OverpassSink(output, footer=rule_filter(rule), batch_size=batchSize, max_ids=maxIds)
+    handler = BigParkingSpaceHandler(rule)
+    # only amenity=parking_space ways reach the Python callback, nodes are skipped
+    # when the input has a blob index (see pyosmium/index-pbf.py)
+    apply_handler(handler, input, 'w',
+                  filters=[osmium.filter.TagFilter(('amenity', 'parking_space'))])
+    handler.progress.finish()
+
+    # area in m² of the matching ways, from the locations of their nodes only
+    handler.candidates.resolve(input, index=load_index(input))
+    keep = measure.within_bounds(rule, handler.candidates, [(s, e) for _, s, e in handler.ways])
+    for (way_id, _, _), ok in zip(handler.ways, keep):
+        if ok:
+            sink.add_id('w', way_id)
+    sink.close()
+    print("Total of ways: %i (%i candidates)" % (sink.total, handler.nbWay), flush=True)
     return 0
 
 
@@ -137,32 +68,40 @@ def print_help():
     print("Usage: python %s -i <osmfile> -o <output filename.opq>" %
           sys.argv[0])
     print("")
-    print("Read the <osmfile> in input. Find the parking space that are too big.")
+    print("Read the <osmfile> in input. Find the parking space that are too big (area > 500 m²).")
     print("Write an Overpass query in the <output filename.opq> that get osm elements (opq stands for Overpass Query")
     print("Use this query to create a MapRoulette challenge or in JOSM to create a QuickFix challenge with mr-cli util")
     print("")
     print("  -i <input osm file> such as planet.osm.pbf. All file supported by osmium should work")
     print("  -o <output filename.opq>. A file to write the Overpass query inside")
+    print("  -b <batch size>. Number of ids per way(id:...) statement (default %i)" % DEFAULT_BATCH_SIZE)
+    print("  -m <max ids>. Split the query into files of at most <max ids> ways")
     print("", flush=True)
 
 
 if __name__ == '__main__':
     nbArgs = len(sys.argv)
-    if nbArgs != 3 and nbArgs != 5:
+    if nbArgs not in (3, 5, 7, 9):
         print_help()
         sys.exit(-1)
 
     # default arguments values
     input = ""
     output = "big-parking-space.opq"
+    batchSize = DEFAULT_BATCH_SIZE
+    maxIds = None
 
     # parse arguments
-    opts, args = getopt.getopt(sys.argv[1:], "i:o", ["input =", "output ="])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:b:m:", ["input =", "output =", "batch =", "max ="])
     for k, v in opts:
         if k == "-i":
             input = v
         if k == "-o":
             output = v
+        if k == "-b":
+            batchSize = int(v)
+        if k == "-m":
+            maxIds = int(v)
 
     print("Args: input=%s ; output=%s" % (input, output), flush=True)
 
@@ -175,9 +114,8 @@ if __name__ == '__main__':
         sys.exit(-1)
 
     print("Start reading osmfile...", flush=True)
-    withFile = True
     start = time.time()
-    ret = main(input, withFile, output)
+    ret = main(input, output, batchSize, maxIds)
     end = time.time()
     hours, rem = divmod(end-start, 3600)
     minutes, seconds = divmod(rem, 60)
@@ -10,6 +10,12 @@ Stats for planet-221010.osm.pbf
 -Ways found: 33121
 -Program ended in 01:11:30.79
 
+The ways written are the matches of the big-parking-space rule of
+pyosmium/challenges.py, the reference shared with run-challenges.py and
+big-parking-space-to-opq.py: amenity=parking_space ways with more than 5
+nodes, none of the ignored tags and an area over 500 m², measured from the
+locations of their nodes in a second pass.
+
 Once python script id completed:
 1. Open the OSM file in JOSM
 2. In "File" menu, click "Update the data" to download all nodes and refresh data
@@ -18,7 +24,8 @@ Once python script id completed:
 5. Do "Merge selection" in the new layer (Ctrl+Maj+M). It allows us to ignore ways/nodes deleted on server
 6. Ctrl+F in mode "select" with filter:
         type:way amenity=parking_space -aeroway -bicycle -bus -capacity -disabled -emergency -footway -hgv -hov
-7. Ctrl+F in mode "remove" with filter (it will select all parking_space with area > 500m²):
+7. Ctrl+F in mode "remove" with filter (it will select all parking_space with area > 500m²,
+   in case they were edited since the extract):
         areasize:-500
 8. Edit those object replace amenity value from parking_space to parking
 9. Save in a new osm file
@@ -31,14 +38,27 @@ import sys
 import getopt
 import time
 
+# shared helpers live next to the pyosmium detectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyosmium"))
+import measure  # noqa: E402
+from blobindex import apply_handler, load_index  # noqa: E402
+from challenges import get_rules  # noqa: E402
+from locations import CandidateLocations  # noqa: E402
+from progress import Progress  # noqa: E402
+from snapshot import Snapshot  # noqa: E402
+
 
 class BigParkingSpaceHandler(osmium.SimpleHandler):
 
-    def __init__(self, writer):
+    def __init__(self, rule):
         super(BigParkingSpaceHandler, self).__init__()
-        self.writer = writer  # osmium writer
         self.nbWay = 0  # counter ways
         self.firstWayRead = False
+        self.progress = Progress(text=lambda: "Ways found: %i" % self.nbWay)
+        # compiled tag conditions, each key is looked up at most once
+        self.match = rule.match
+        self.candidates = CandidateLocations()  # node refs of the matching ways
+        self.ways = []  # (copy of the way, start, end) of the matching ways
 
     # osmium way handler
     def way(self, w):
@@ -46,60 +66,22 @@ class BigParkingSpaceHandler(osmium.SimpleHandler):
             print("First way read!")
             self.firstWayRead = True
 
-        # search only for parking_space
-        if w.tags.get('amenity') != 'parking_space':
-            return
-
-        # ignore parking_space with less than 5 nodes
-        if w.nodes.__len__() <= 5:
-            return
-
-        # ignore aeroway
-        if 'aeroway' in w.tags:
-            return
-
-        # ignore bicycle
-        if 'bicycle' in w.tags:
-            return
-
-        # ignore bus
-        if 'bus' in w.tags:
-            return
-
-        # ignore parking_space with capacity
-        if 'capacity' in w.tags:
-            return
-
-        # ignore capacity:disabled
-        if 'capacity:disabled' in w.tags:
-            return
-
-        # ignore parking_space with tag 'disabled'
-        if 'disabled' in w.tags:
-            return
-
-        # ignore parking_space with tag 'disabled'
-        if 'emergency' in w.tags:
-            return
-
-        # ignore disabled patking_space
-        if w.tags.get('parking_space') == 'disabled':
-            return
-
-        if 'wheelchair' in w.tags:
+        # amenity=parking_space with more than 5 nodes and none of the
+        # ignored tags, see the big-parking-space rule in pyosmium/challenges.py
+        if not self.match(w):
             return
 
-        # all filter passed, adding the parking_space to osm file
+        # tag filters passed, the area is checked once the node locations are known
         self.nbWay += 1  # increment counter
-        self.writer.add_way(w)
-        sys.stdout.write("\rWays found: %i" % self.nbWay)
-        sys.stdout.flush()
+        start, end = self.candidates.add_way(w)
+        self.ways.append((Snapshot(w), start, end))
+        self.progress.update()
 
 
 def print_help():
     print("Usage: python %s -i <osmfile> -o <output.osm>" % sys.argv[0])
     print("")
-    print("Read the <osmfile> in input. Find the parking space that are too big.")
+    print("Read the <osmfile> in input. Find the parking space that are too big (area > 500 m²).")
     print("Write an Overpass query in the <output.osm> that get osm elements (opq stands for Overpass Query")
     print("Use this query to create a MapRoulette challenge or in JOSM to create a QuickFix challenge with mr-cli util")
     print("")
@@ -110,28 +92,36 @@ def print_help():
 
 
 def main(input, output):
-    try:
-        start = time.time()
-        if os.path.exists(output):
-            print("Delete file %s" % output)
-            os.remove(output)
-        print("Initialize writer", flush=True)
-        writer = osmium.SimpleWriter(output)
-        print("Initialize handler", flush=True)
-        handler = BigParkingSpaceHandler(writer)
-        print("Start handler...", flush=True)
-        handler.apply_file(input, locations=False)
-        writer.close()
-        del handler
-        del writer
-        print()
-        end = time.time()
-        hours, rem = divmod(end-start, 3600)
-        minutes, seconds = divmod(rem, 60)
-        print("Program ended in {:0>2}:{:0>2}:{:05.2f}".format(
-            int(hours), int(minutes), seconds), flush=True)
-    except Exception as e:
-        print("%s" % e)
+    start = time.time()
+    if os.path.exists(output):
+        print("Delete file %s" % output)
+        os.remove(output)
+    rule = get_rules(["big-parking-space"])[0]
+    print("Initialize handler", flush=True)
+    handler = BigParkingSpaceHandler(rule)
+    print("Start handler...", flush=True)
+    # only amenity=parking_space ways reach the Python callback, nodes are skipped
+    # when the input has a blob index (see pyosmium/index-pbf.py)
+    apply_handler(handler, input, 'w',
+                  filters=[osmium.filter.TagFilter(('amenity', 'parking_space'))])
+    handler.progress.finish()
+
+    # area in m² of the matching ways, from the locations of their nodes only
+    print("Measure the %i candidates..." % handler.nbWay, flush=True)
+    handler.candidates.resolve(input, index=load_index(input))
+    keep = measure.within_bounds(rule, handler.candidates, [(s, e) for _, s, e in handler.ways])
+    print("Initialize writer", flush=True)
+    writer = osmium.SimpleWriter(output)
+    for (way, _, _), ok in zip(handler.ways, keep):
+        if ok:
+            writer.add_way(way)
+    writer.close()
+    print("Ways over %i m²: %i" % (rule.min_area, int(keep.sum())), flush=True)
+    end = time.time()
+    hours, rem = divmod(end-start, 3600)
+    minutes, seconds = divmod(rem, 60)
+    print("Program ended in {:0>2}:{:0>2}:{:05.2f}".format(
+        int(hours), int(minutes), seconds), flush=True)
 
 
 if __name__ == '__main__':
@@ -144,7 +134,7 @@ if __name__ == '__main__':
     output = "big-parking-space.osm"
 
     # parse arguments
-    opts, args = getopt.getopt(sys.argv[1:], "i:o", ["input =", "output ="])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:", ["input =", "output ="])
     for k, v in opts:
         if k == "-i":
             input = v
@@ -1,6 +1,10 @@
 """
 Return a list of parking without surface
 
+The objects written are the matches of the parking-surface rule of
+pyosmium/challenges.py, shared with run-challenges.py: amenity=parking ways
+with more than 10 nodes and relations, without parking=* and not private.
+
 Stats for planet-220815.osm.pbf
 -Ways found: 8332
 -Program ended in 01:02:44.54
@@ -21,6 +25,12 @@ import sys
 import getopt
 import time
 
+# shared helpers live next to the pyosmium detectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyosmium"))
+from blobindex import apply_handler  # noqa: E402
+from challenges import get_rules  # noqa: E402
+from progress import Progress  # noqa: E402
+
 
 class ParkingSurfaceHandler(osmium.SimpleHandler):
 
@@ -29,21 +39,28 @@ class ParkingSurfaceHandler(osmium.SimpleHandler):
         self.writer = writer  # osmium writer
         self.nbWay = 0  # counter ways
         self.firstWayRead = False
-        self.ignoreAccess = ['private', 'no']
+        self.progress = Progress(text=lambda: "Ways found: %i" % self.nbWay)
+        # compiled tag conditions, each key is looked up at most once
+        self.match = get_rules(["parking-surface"])[0].match
 
     # osmium way handler
     def way(self, w):
         if self.firstWayRead == False:
             print("First way read!")
             self.firstWayRead = True
-        if w.tags.get('amenity') == 'parking':
-            if 'parking' not in w.tags:
-                if w.tags.get('access') not in self.ignoreAccess:
-                    if w.nodes.__len__() > 10:
-                        self.nbWay += 1  # increment counter
-                        self.writer.add_way(w)
-                        sys.stdout.write("\rWays found: %i" % self.nbWay)
-                        sys.stdout.flush()
+        # amenity=parking without parking=*, not private and with more than
+        # 10 nodes, see the parking-surface rule in pyosmium/challenges.py
+        if self.match(w):
+            self.nbWay += 1  # increment counter
+            self.writer.add_way(w)
+            self.progress.update()
+
+    # osmium relation handler
+    def relation(self, r):
+        if self.match(r):
+            self.nbWay += 1  # increment counter
+            self.writer.add_relation(r)
+            self.progress.update()
 
 
 def print_help():
@@ -60,28 +77,26 @@ def print_help():
 
 
 def main(input, output):
-    try:
-        start = time.time()
-        if os.path.exists(output):
-            print("Delete file %s" % output)
-            os.remove(output)
-        print("Initialize writer", flush=True)
-        writer = osmium.SimpleWriter(output)
-        print("Initialize handler", flush=True)
-        handler = ParkingSurfaceHandler(writer)
-        print("Start handler...", flush=True)
-        handler.apply_file(input, locations=False)
-        writer.close()
-        del handler
-        del writer
-        print()
-        end = time.time()
-        hours, rem = divmod(end-start, 3600)
-        minutes, seconds = divmod(rem, 60)
-        print("Program ended in {:0>2}:{:0>2}:{:05.2f}".format(
-            int(hours), int(minutes), seconds), flush=True)
-    except Exception as e:
-        print("%s" % e)
+    start = time.time()
+    if os.path.exists(output):
+        print("Delete file %s" % output)
+        os.remove(output)
+    print("Initialize writer", flush=True)
+    writer = osmium.SimpleWriter(output)
+    print("Initialize handler", flush=True)
+    handler = ParkingSurfaceHandler(writer)
+    print("Start handler...", flush=True)
+    # only amenity=parking ways and relations reach the Python callbacks, nodes
+    # are skipped when the input has a blob index (see pyosmium/index-pbf.py)
+    apply_handler(handler, input, 'w',
+                  filters=[osmium.filter.TagFilter(('amenity', 'parking'))])
+    writer.close()
+    handler.progress.finish()
+    end = time.time()
+    hours, rem = divmod(end-start, 3600)
+    minutes, seconds = divmod(rem, 60)
+    print("Program ended in {:0>2}:{:0>2}:{:05.2f}".format(
+        int(hours), int(minutes), seconds), flush=True)
 
 
 if __name__ == '__main__':
@@ -94,7 +109,7 @@ if __name__ == '__main__':
     output = "parking-surface.osm"
 
     # parse arguments
-    opts, args = getopt.getopt(sys.argv[1:], "i:o", ["input =", "output ="])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:", ["input =", "output ="])
     for k, v in opts:
         if k == "-i":
             input = v
@@ -0,0 +1,125 @@
+"""
+Multipolygon areas of matching relations only.
+
+Assembling the areas of a whole extract with osmium's area manager keeps
+the members of every multipolygon in memory, plus a location index of all
+nodes. Challenges only need the relations whose tags matched a rule, so:
+
+1. while reading, matching multipolygon relations are kept as snapshots
+   and the ids of their member ways recorded;
+2. the member ways are read again with an osmium IdFilter, and their node
+   refs added to the CandidateLocations (see locations.py), resolved in
+   the same node pass as the candidate ways;
+3. the relations, member ways and located nodes are written to a small
+   temporary PBF, from which osmium's area manager assembles the areas.
+
+Memory is proportional to the members of the matching relations.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from array import array
+
+import numpy as np
+import osmium
+from osmium.osm import mutable
+
+from locations import COORDINATE_PRECISION, INVALID
+from snapshot import Snapshot
+
+
+AREA_TYPES = ("multipolygon", "boundary")
+
+
+def _outer_point(area):
+    ring = [n.location for n in next(iter(area.outer_rings()))]
+    return (sum(loc.lon for loc in ring) / len(ring), sum(loc.lat for loc in ring) / len(ring))
+
+
+class RelationAreas:
+    """Areas of the multipolygon relations handed to `add_relation`."""
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self.relations = {}
+        self.way_ids = array("q")
+        self.ways = {}
+        self.geometries = {}
+        self.points = {}
+        self.elapsed = 0.0
+
+    def add_relation(self, relation):
+        """Record a relation, return False when it can not become an area."""
+        if relation.tags.get("type") not in AREA_TYPES:
+            return False
+        if relation.id not in self.relations:
+            self.relations[relation.id] = Snapshot(relation)
+            self.way_ids.extend(m.ref for m in relation.members if m.type == "w")
+        return True
+
+    def collect_ways(self, source, thread_pool=None, index=None):
+        """Read the member ways; must run before the candidates are resolved.
+
+        With a BlobIndex of `source`, only the blobs that may hold them are read.
+        """
+        t0 = time.time()
+        ids = np.unique(np.frombuffer(self.way_ids, dtype=np.int64))
+        if len(ids):
+            sources = [source] if index is None else index.buffers(index.blobs_for("w", ids))
+            for src in sources:
+                processor = osmium.FileProcessor(src, osmium.osm.WAY, thread_pool=thread_pool)
+                processor.with_filter(osmium.filter.IdFilter(ids))
+                for way in processor:
+                    self.ways[way.id] = Snapshot(way)
+                    self.candidates.add_way(way)
+        self.elapsed += time.time() - t0
+        logging.info(f"Read {len(self.ways):,} member ways of {len(self.relations):,} relations")
+
+    def assemble(self):
+        """Build the GeoJSON geometries of the relations with osmium's area manager."""
+        t0 = time.time()
+        if self.relations:
+            tmp = tempfile.mkdtemp(prefix="areas-")
+            try:
+                members = os.path.join(tmp, "members.osm.pbf")
+                self._write_members(members)
+                factory = osmium.geom.GeoJSONFactory()
+                processor = osmium.FileProcessor(members).with_areas()
+                processor.with_filter(osmium.filter.EntityFilter(osmium.osm.AREA))
+                for area in processor:
+                    if not area.from_way():
+                        try:
+                            self.geometries[area.orig_id()] = factory.create_multipolygon(area)
+                            self.points[area.orig_id()] = _outer_point(area)
+                        except (RuntimeError, StopIteration):
+                            pass  # invalid multipolygon
+            finally:
+                shutil.rmtree(tmp)
+        self.elapsed += time.time() - t0
+        logging.info(f"Assembled {len(self.geometries):,} of {len(self.relations):,} "
+                     f"relation areas in {self.elapsed:.2f}s")
+
+    def _write_members(self, filename):
+        cand = self.candidates
+        writer = osmium.SimpleWriter(filename)
+        try:
+            for node_id, x, y in zip(cand.ids.tolist(), cand.x.tolist(), cand.y.tolist()):
+                if x != INVALID:
+                    writer.add_node(mutable.Node(id=node_id, version=1, location=(
+                        x / COORDINATE_PRECISION, y / COORDINATE_PRECISION)))
+            for way_id in sorted(self.ways):
+                writer.add_way(self.ways[way_id])
+            for rel_id in sorted(self.relations):
+                writer.add_relation(self.relations[rel_id])
+        finally:
+            writer.close()
+
+    def geometry(self, relation_id):
+        return self.geometries.get(relation_id)
+
+    def point(self, relation_id):
+        """Centroid of the vertices of the first outer ring, for region lookups."""
+        return self.points.get(relation_id)
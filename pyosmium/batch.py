@@ -0,0 +1,146 @@
+"""
+Columnar batch evaluation of the rules.
+
+In the default mode, every candidate let through by the prefilter is
+handed to each rule interested in its type, one `match` call per rule and
+object. On real extracts most candidates do not match: millions of
+oneway=yes ways reach the oneway rule, whose prefilter can only select
+on the key. In batch mode, a chunk of blobs is read in two passes instead:
+
+1. the candidates are reduced to columns: their ids, the values of the
+   keys required by the rules of their type (each read once, whatever the
+   number of rules), and, only when these values can lead to a match, the
+   forbidden keys and node counts the rules still need. Which extra
+   values to read is decided once per distinct combination of required
+   values (a "plan"), not per object. Every rule then runs as a vectorized
+   predicate over the whole chunk (Rule.match_columns).
+2. the chunk is read again with osmium id filters letting through the
+   matches only, which are handed to the sinks.
+
+The second pass costs a decompression of the chunks holding matches,
+which is why batch mode reads smaller chunks and pays off when matches
+are a small share of the candidates.
+"""
+
+import time
+
+import numpy as np
+import osmium
+from osmium.filter import IdFilter
+
+from rules import matches_value
+
+
+TYPE_BITS = {"n": osmium.osm.NODE, "w": osmium.osm.WAY, "r": osmium.osm.RELATION}
+
+# smaller than the default chunks, so that the second pass reads fewer blobs again
+BATCH_CHUNK_SIZE = 1024 * 1024
+
+
+class _Rows:
+    """Candidates of one entity type in a batch."""
+
+    __slots__ = ("rows", "extra", "nodes")
+
+    def __init__(self):
+        # (id, value of each primary key) per candidate
+        self.rows = []
+        # key -> ([row], [value]) of the values read on demand
+        self.extra = {}
+        # ([row], [node count]) of the ways whose node count is needed
+        self.nodes = ([], [])
+
+
+class BatchMatcher:
+    """Evaluate the rules of an engine over chunks of candidates as NumPy columns."""
+
+    def __init__(self, dispatch):
+        self.dispatch = dispatch
+        # keys required by the rules of a type: read for every candidate
+        self.primary = {t: sorted({k for rule in rules for k in rule.tags})
+                        for t, rules in dispatch.items()}
+        self.plans = {t: {} for t in dispatch}
+
+    def _plan(self, obj_type, values):
+        """Extra keys to read, and whether the node count is needed, for these primary values."""
+        values = dict(zip(self.primary[obj_type], values))
+        keys = set()
+        nodes = False
+        for rule in self.dispatch[obj_type]:
+            if all(matches_value(values[k], v) for k, v in rule.tags.items()):
+                keys.update(k for k in rule.without if k not in values)
+                nodes |= obj_type == "w" and rule.checks_nodes
+        plan = (sorted(keys), nodes)
+        self.plans[obj_type][tuple(values.values())] = plan
+        return plan
+
+    def collect(self, processor):
+        """First pass: reduce the objects of `processor` to rows, return ({type: _Rows}, count)."""
+        batch = {t: _Rows() for t in self.dispatch}
+        primary = self.primary
+        plans = self.plans
+        count = 0
+        for obj in processor:
+            count += 1
+            obj_type = obj.type_str()
+            get = obj.tags.get
+            values = tuple([get(k) for k in primary[obj_type]])
+            part = batch[obj_type]
+            row = len(part.rows)
+            plan = plans[obj_type].get(values)
+            if plan is None:
+                plan = self._plan(obj_type, values)
+            keys, nodes = plan
+            for key in keys:
+                val = get(key)
+                if val is not None:
+                    extra = part.extra.get(key)
+                    if extra is None:
+                        extra = part.extra[key] = ([], [])
+                    extra[0].append(row)
+                    extra[1].append(val)
+            if nodes:
+                part.nodes[0].append(row)
+                part.nodes[1].append(len(obj.nodes))
+            part.rows.append((obj.id,) + values)
+        return batch, count
+
+    def evaluate(self, batch, rule_time=None):
+        """Run the rules over the columns of a batch, return {(type, id): [rule]}.
+
+        With `rule_time`, the time spent in each rule is added to it.
+        """
+        clock = time.perf_counter
+        matches = {}
+        for obj_type, part in batch.items():
+            if not part.rows:
+                continue
+            size = len(part.rows)
+            table = np.array(part.rows, dtype=object)
+            ids = table[:, 0].astype(np.int64)
+            columns = {k: table[:, i + 1] for i, k in enumerate(self.primary[obj_type])}
+            for key, (rows, values) in part.extra.items():
+                column = np.full(size, None, dtype=object)
+                column[rows] = values
+                columns[key] = column
+            nodes = None
+            if part.nodes[0]:
+                nodes = np.zeros(size, dtype=np.int64)
+                nodes[part.nodes[0]] = part.nodes[1]
+            for rule in self.dispatch[obj_type]:
+                if rule_time is not None:
+                    t0 = clock()
+                mask = rule.match_columns(size, columns, nodes if obj_type == "w" else None)
+                if rule_time is not None:
+                    rule_time[rule.name] += clock() - t0
+                for obj_id in ids[mask].tolist():
+                    matches.setdefault((obj_type, obj_id), []).append(rule)
+        return matches
+
+
+def match_filters(matches):
+    """osmium filters letting through the matched objects of a batch only."""
+    ids = {t: [] for t in TYPE_BITS}
+    for obj_type, obj_id in matches:
+        ids[obj_type].append(obj_id)
+    return [IdFilter(ids[t]).enable_for(bits) for t, bits in TYPE_BITS.items()]
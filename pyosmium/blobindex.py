@@ -0,0 +1,322 @@
+"""
+Sidecar index of the blobs of a PBF file.
+
+A PBF sorted by type then id holds all its nodes first, then the ways,
+then the relations. Recording the type and id of the first object of
+every blob, once per input, is enough to know the id range of every blob:
+it ends where the next blob starts. Readers then start directly at the
+first way blob when no rule looks at nodes, or only fetch the blobs that
+hold a set of requested ids (the candidate nodes of locations.py).
+
+The first object is found by decompressing only the beginning of each
+blob (the string table and the start of the first group), so building the
+index costs a small fraction of a full read. A blob without any object has
+no first id: it is kept in the index (as type None) but left out of the
+lookups, which go from the non-empty blob before it to the next one. The
+index is stored next to the input as <input>.idx.npz and ignored once the
+input changes or when written by another version of this module.
+"""
+
+import logging
+import os
+import struct
+import zlib
+
+import numpy as np
+import osmium
+
+from pbf import Blob, PbfFile, _varint
+
+
+TYPE_CODES = {"n": 0, "w": 1, "r": 2}
+
+# type code of an empty blob in the sidecar
+EMPTY_CODE = -1
+
+# bumped when the sidecar format changes, older sidecars are ignored
+INDEX_VERSION = 2
+
+# key = type << TYPE_SHIFT + id keeps (type, id) order in an int64
+TYPE_SHIFT = 61
+
+# bytes read at the start of a blob, usually enough to reach its first object
+HEAD_SIZE = 64 * 1024
+
+# PrimitiveGroup field -> object type
+GROUP_TYPES = {1: "n", 2: "n", 3: "w", 4: "r"}
+
+
+def _key(obj_type, obj_id):
+    return (TYPE_CODES[obj_type] << TYPE_SHIFT) + obj_id
+
+
+def _signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _fields(buf, pos, end):
+    """Yield (field, wire type, value or (start, end) of length-delimited data)."""
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+            yield field, wire, value
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            yield field, wire, (pos, pos + length)
+            pos += length
+        elif wire == 5:
+            pos += 4
+        elif wire == 1:
+            pos += 8
+        else:
+            raise ValueError(f"Unexpected wire type {wire}")
+
+
+class UnsupportedBlob(Exception):
+    """Blob compressed otherwise than with zlib: read whole by osmium instead."""
+
+
+class _Stream:
+    """Lazily decompressed blob data."""
+
+    def __init__(self, blob_message):
+        self.data = b""
+        self.raw = None
+        self.zlib = None
+        for field, _, value in _fields(blob_message, 0, len(blob_message)):
+            if field == 1:
+                self.data = blob_message[value[0]:value[1]]
+            elif field == 3:
+                self.raw = blob_message[value[0]:value[1]]
+                self.zlib = zlib.decompressobj()
+            elif field in (4, 5, 6, 7):
+                raise UnsupportedBlob("only raw and zlib blobs can be read partially")
+
+    def ensure(self, size):
+        """Make at least `size` bytes available, return False at the end of the data."""
+        while len(self.data) < size and self.zlib is not None:
+            chunk = self.zlib.decompress(self.raw, max(size - len(self.data), 16384))
+            self.raw = self.zlib.unconsumed_tail
+            self.data += chunk
+            if not self.raw:
+                self.data += self.zlib.flush()
+                self.zlib = None
+        return len(self.data) >= size
+
+
+def _first_object(stream):
+    """(type, id) of the first object of a PrimitiveBlock stream."""
+    pos = 0
+    while stream.ensure(pos + 20) or pos < len(stream.data):
+        key, pos = _varint(stream.data, pos)
+        field, wire = key >> 3, key & 7
+        if wire != 2:
+            raise ValueError("Unexpected PrimitiveBlock field")
+        length, pos = _varint(stream.data, pos)
+        if field != 2:  # string table and such
+            pos += length
+            continue
+        # first PrimitiveGroup: its first object message, then that object's id
+        stream.ensure(pos + min(length, 64))
+        gkey, gpos = _varint(stream.data, pos)
+        obj_type = GROUP_TYPES.get(gkey >> 3)
+        if obj_type is None:
+            pos += length
+            continue
+        _, gpos = _varint(stream.data, gpos)
+        okey, opos = _varint(stream.data, gpos)
+        if okey >> 3 != 1:
+            raise ValueError("Object without id first")
+        if okey & 7 == 2:  # DenseNodes: packed sint64 deltas, the first one is the id
+            _, opos = _varint(stream.data, opos)
+        value, _ = _varint(stream.data, opos)
+        if gkey >> 3 in (1, 2):  # node ids are sint64 (zigzag)
+            return obj_type, (value >> 1) ^ -(value & 1)
+        return obj_type, _signed(value)
+    return None
+
+
+def _first_object_osmium(header, data):
+    """Slow path for blobs compressed otherwise than with zlib."""
+    for obj in osmium.FileProcessor(osmium.io.FileBuffer(header + data, "pbf")):
+        return obj.type_str(), obj.id
+    return None
+
+
+def _parse_first_object(data, header):
+    """(type, id) of the first object of a whole blob, length prefix included."""
+    header_size = struct.unpack(">I", data[:4])[0]
+    try:
+        return _first_object(_Stream(data[4 + header_size:]))
+    except UnsupportedBlob:
+        return _first_object_osmium(header, data)
+
+
+def _read_first_object(f, blob, header):
+    f.seek(blob.offset)
+    data = f.read(min(blob.size, HEAD_SIZE))
+    if len(data) < blob.size:
+        header_size = struct.unpack(">I", data[:4])[0]
+        try:
+            first = _first_object(_Stream(data[4 + header_size:]))
+            if first is not None:
+                return first
+        except (IndexError, UnsupportedBlob):
+            pass
+        # first object beyond HEAD_SIZE, or another compression
+        data += f.read(blob.size - len(data))
+    return _parse_first_object(data, header)
+
+
+def _append_first(types, first_ids, first):
+    # an empty blob has no first object: type None, left out of the lookups
+    obj_type, obj_id = first or (None, 0)
+    types.append(obj_type)
+    first_ids.append(obj_id)
+
+
+class BlobIndex:
+    """Type and first id of the data blobs of a PBF file."""
+
+    def __init__(self, pbf_file, types, first_ids):
+        self.pbf_file = pbf_file
+        self.types = types
+        self.first_ids = first_ids
+        # data blobs holding objects, and the (type, id) key of their first one
+        self.positions = np.array([i for i, t in enumerate(types) if t is not None],
+                                  dtype=np.int64)
+        self.keys = np.array([_key(types[i], first_ids[i]) for i in self.positions.tolist()],
+                             dtype=np.int64)
+        self.sorted = bool(len(self.keys) < 2 or (self.keys[1:] >= self.keys[:-1]).all())
+
+    @staticmethod
+    def sidecar(filename):
+        return filename + ".idx.npz"
+
+    @classmethod
+    def build(cls, pbf_file):
+        types = []
+        first_ids = []
+        header = pbf_file.header_bytes()
+        with open(pbf_file.filename, "rb") as f:
+            for blob in pbf_file.data_blobs:
+                _append_first(types, first_ids, _read_first_object(f, blob, header))
+        return cls(pbf_file, types, first_ids)
+
+    def save(self, filename=None):
+        filename = filename or self.sidecar(self.pbf_file.filename)
+        stat = os.stat(self.pbf_file.filename)
+        blobs = self.pbf_file.data_blobs
+        with open(filename + ".tmp", "wb") as f:
+            np.savez(f,
+                     version=np.array(INDEX_VERSION, dtype=np.int64),
+                     source=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+                     header=np.array(self.pbf_file.header_blob[:2], dtype=np.int64),
+                     offsets=np.array([b.offset for b in blobs], dtype=np.int64),
+                     sizes=np.array([b.size for b in blobs], dtype=np.int64),
+                     types=np.array([TYPE_CODES[t] if t is not None else EMPTY_CODE
+                                     for t in self.types], dtype=np.int8),
+                     first_ids=np.array(self.first_ids, dtype=np.int64))
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Index of a PBF file from its sidecar, None when missing or out of date."""
+        sidecar = cls.sidecar(filename)
+        if not os.path.exists(sidecar):
+            return None
+        stat = os.stat(filename)
+        with np.load(sidecar) as data:
+            if "version" not in data or int(data["version"]) != INDEX_VERSION:
+                logging.info(f"Ignoring blob index {sidecar} of another version")
+                return None
+            if data["source"].tolist() != [stat.st_size, stat.st_mtime_ns]:
+                logging.info(f"Ignoring out of date blob index {sidecar}")
+                return None
+            names = {code: t for t, code in TYPE_CODES.items()}
+            names[EMPTY_CODE] = None
+            blobs = [Blob(*data["header"].tolist(), "OSMHeader")]
+            blobs += [Blob(o, s, "OSMData") for o, s in zip(data["offsets"].tolist(),
+                                                             data["sizes"].tolist())]
+            types = [names[c] for c in data["types"].tolist()]
+            first_ids = data["first_ids"].tolist()
+        return cls(PbfFile(filename, blobs), types, first_ids)
+
+    def blobs_from(self, obj_type):
+        """Data blobs from the one holding the first object of `obj_type` to the end."""
+        if not self.sorted:
+            return self.pbf_file.data_blobs
+        start = int(np.searchsorted(self.keys, _key(obj_type, -(1 << 60)), side="left"))
+        # the previous blob may end with objects of that type
+        first = int(self.positions[start - 1]) if start > 0 else 0
+        return self.pbf_file.data_blobs[first:]
+
+    def blobs_for(self, obj_type, ids):
+        """Data blobs that may hold any of the sorted `ids` of `obj_type`."""
+        if not self.sorted:
+            return self.pbf_file.data_blobs
+        keys = np.asarray(ids, dtype=np.int64) + (TYPE_CODES[obj_type] << TYPE_SHIFT)
+        idx = np.unique(np.searchsorted(self.keys, keys, side="right") - 1)
+        blobs = self.pbf_file.data_blobs
+        return [blobs[i] for i in self.positions[idx[idx >= 0]].tolist()]
+
+    def buffers(self, blobs):
+        """FileBuffers covering `blobs`, to be read by osmium."""
+        for _, buf in self.pbf_file.iter_buffers(blobs):
+            yield buf
+
+
+class IndexBuilder:
+    """Build the BlobIndex of a PBF file from its blobs as they are read (see stream.py)."""
+
+    def __init__(self):
+        self.blobs = []
+        self.types = []
+        self.first_ids = []
+        self.header = None
+
+    def add(self, blob, data):
+        self.blobs.append(blob)
+        if blob.type == "OSMHeader":
+            self.header = data
+        elif blob.type == "OSMData":
+            _append_first(self.types, self.first_ids, _parse_first_object(data, self.header))
+
+    def save(self, filename):
+        """Write the sidecar of the now complete `filename`, return the index."""
+        index = BlobIndex(PbfFile(filename, self.blobs), self.types, self.first_ids)
+        index.save()
+        return index
+
+
+def load_index(filename):
+    """BlobIndex of a .pbf input if it has an up to date sidecar, else None."""
+    if not filename.endswith(".pbf"):
+        return None
+    index = BlobIndex.load(filename)
+    if index is not None and not index.sorted:
+        logging.info(f"{filename} is not sorted by type and id, blob index not used")
+        return None
+    return index
+
+
+def first_type(entities):
+    """First object type ("n", "w" or "r") among osmium entity bits."""
+    for obj_type, bits in (("n", osmium.osm.NODE), ("w", osmium.osm.WAY), ("r", osmium.osm.RELATION)):
+        if entities & bits:
+            return obj_type
+    return "r"
+
+
+def apply_handler(handler, filename, obj_type, filters=()):
+    """Apply an osmium handler from the first blob of `obj_type` on, when the input is indexed."""
+    index = load_index(filename)
+    if index is None:
+        handler.apply_file(filename, filters=list(filters))
+        return
+    blobs = index.blobs_from(obj_type)
+    logging.info(f"Reading {len(blobs):,} of {len(index.pbf_file.data_blobs):,} blobs")
+    for buf in index.buffers(blobs):
+        handler.apply_file(buf, filters=list(filters))
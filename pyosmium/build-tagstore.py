@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Build the tag store of an extract, written next to it as <input>.tags.
+
+The store keeps every object carrying one of the selection keys, with the
+values of the stored keys, as memory-mapped arrays (see tagstore.py).
+Build it once per downloaded extract, then try rules out against it with
+query-tagstore.py in seconds instead of scanning the extract again.
+
+    python pyosmium/build-tagstore.py -i in/latest.osm.pbf
+    python pyosmium/build-tagstore.py -i in/latest.osm.pbf -k shop,craft --with-keys name --centroids
+"""
+
+import argparse
+import logging
+import time
+
+from progress import Metrics, Progress
+from tagstore import TagStore, default_keys, sidecar
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def build_tagstore(input_file, output=None, selection=None, stored=None, centroids=False,
+                   show_progress=True):
+    start = time.time()
+
+    rule_selection, rule_stored = default_keys()
+    selection = selection or rule_selection
+    stored = rule_stored + [k for k in stored or () if k not in rule_stored]
+    output = output or sidecar(input_file)
+    logging.info(f"Selection keys: {', '.join(selection)}")
+    logging.info(f"Other stored keys: {', '.join(stored)}")
+
+    metrics = Metrics(input_file)
+    progress = Progress(metrics, enabled=show_progress)
+    store = TagStore.build(input_file, selection, stored, centroids, metrics, progress)
+    progress.finish()
+    store.save(output, source=input_file)
+    logging.info(f"{len(store):,} objects and {len(store.tag_rows):,} tags written to {output}")
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build a columnar store of the tags of interesting objects of an OSM file."
+    )
+    parser.add_argument("-i", "--input", required=True, help="Input OSM/PBF file")
+    parser.add_argument("-o", "--output", help="Store directory (default: <input>.tags)")
+    parser.add_argument("-k", "--keys", default="",
+                        help="Comma separated keys selecting the objects to store (default: the "
+                             "keys required by the registered rules)")
+    parser.add_argument("--with-keys", default="",
+                        help="Comma separated keys stored besides the selection keys and the "
+                             "forbidden keys of the registered rules")
+    parser.add_argument("--centroids", action="store_true",
+                        help="Also store the centroid of every object (reads the nodes of the "
+                             "selected ways again)")
+    parser.add_argument("--no-progress", action="store_true",
+                        help="Disable progress display")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"Input: {args.input}")
+    build_tagstore(args.input, args.output, [k for k in args.keys.split(",") if k],
+                   [k for k in args.with_keys.split(",") if k], args.centroids,
+                   show_progress=not args.no_progress)
+
+
+if __name__ == "__main__":
+    main()
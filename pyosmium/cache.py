@@ -0,0 +1,155 @@
+"""
+Content-addressed cache of per-rule outputs.
+
+A rule's output only depends on the input file, on the rule itself (its
+definition, conf/*.conf and boundary files), on the run options shaping
+the output and on the code writing it. `rule_key` hashes all of them, and
+`ResultCache` stores the finished outputs of a rule under that key, so a
+run dispatched again on the same extract, or restarted after a failure,
+restores unchanged challenges in seconds and only recomputes the rules
+whose code or configuration changed.
+
+The input is fingerprinted without reading it whole: its OSM header
+(replication timestamp and sequence), its size and a hash of a few
+sampled blocks. An input streamed from a URL is fingerprinted before it is
+downloaded, from its HTTP validators (`url_fingerprint`): servers such as
+download.geofabrik.de give a file a new ETag and Last-Modified date
+whenever it is replaced.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import osmium
+
+
+# modules whose code shapes the outputs: writing them, or choosing which
+# objects of the input are read and in which order they are merged
+OUTPUT_MODULES = ["areas.py", "batch.py", "blobindex.py", "checkpoint.py", "engine.py",
+                  "geojson.py", "locations.py", "measure.py", "overpass.py", "parallel.py",
+                  "pbf.py", "regions.py", "rules.py", "snapshot.py", "stream.py"]
+
+SAMPLE_SIZE = 1024 * 1024
+SAMPLES = 8
+
+
+def _file_digest(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(SAMPLE_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint(input_file):
+    """Digest of the input file from its header, size and sampled blocks."""
+    size = os.path.getsize(input_file)
+    h = hashlib.sha256()
+    with osmium.io.Reader(input_file, osmium.osm.NOTHING) as reader:
+        header = reader.header()
+    for key in ("osmosis_replication_timestamp", "osmosis_replication_sequence_number",
+                "timestamp"):
+        h.update(f"{key}={header.get(key, '')}\n".encode())
+    h.update(f"size={size}\n".encode())
+    with open(input_file, "rb") as f:
+        # first and last blocks, and evenly spaced ones in between
+        for i in range(SAMPLES):
+            f.seek(max(0, size - SAMPLE_SIZE) * i // (SAMPLES - 1))
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def url_fingerprint(url, headers):
+    """Digest of a remote input from its HTTP response headers, None without ETag or Last-Modified."""
+    validators = [headers.get("ETag"), headers.get("Last-Modified")]
+    if not any(validators):
+        return None
+    h = hashlib.sha256()
+    for key, value in zip(("url", "etag", "last-modified"), [url] + validators):
+        h.update(f"{key}={value or ''}\n".encode())
+    return h.hexdigest()
+
+
+def code_digest():
+    here = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for name in OUTPUT_MODULES:
+        h.update(name.encode())
+        h.update(_file_digest(os.path.join(here, name)).encode())
+    return h.hexdigest()
+
+
+def rule_key(rule, input_digest, options, regions=None, code=None):
+    """Cache key of the outputs of `rule` over the input fingerprinted as `input_digest`.
+
+    `regions` are the boundary files the rule's output is split with.
+    """
+    data = {
+        "input": input_digest,
+        "rule": rule.definition(),
+        "conf": _file_digest(rule.conf) if rule.conf else None,
+        "regions": [_file_digest(f) for f in regions or []],
+        "options": options,
+        "code": code or code_digest(),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """Outputs of rules stored in <directory>/<key[:2]>/<key>/."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), "manifest.json"))
+
+    def put(self, key, output_dir, names):
+        """Store the files or directories `names` of `output_dir` under `key`."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=key + ".", dir=os.path.dirname(path))
+        try:
+            stored = []
+            for name in names:
+                src = os.path.join(output_dir, name)
+                if os.path.isdir(src):
+                    shutil.copytree(src, os.path.join(tmp, name))
+                elif os.path.exists(src):
+                    shutil.copy2(src, os.path.join(tmp, name))
+                else:
+                    continue
+                stored.append(name)
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump({"files": stored}, f)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def restore(self, key, output_dir):
+        """Copy the files stored under `key` into `output_dir`, return their names."""
+        path = self._path(key)
+        with open(os.path.join(path, "manifest.json")) as f:
+            names = json.load(f)["files"]
+        for name in names:
+            src = os.path.join(path, name)
+            dst = os.path.join(output_dir, name)
+            if os.path.isdir(src):
+                if os.path.exists(dst):
+                    shutil.rmtree(dst)
+                shutil.copytree(src, dst)
+            else:
+                shutil.copy2(src, dst)
+        logging.info(f"Restored {', '.join(names)} from cache")
+        return names
@@ -0,0 +1,71 @@
+"""
+Registry of the MapRoulette challenges run by the one-pass engine.
+
+The selection logic mirrors the shell scripts (01- to 05-) and the
+standalone detectors (pyosmium/*.py, *-to-osm.py).
+"""
+
+import os
+
+from rules import Rule
+
+
+CONF_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "conf")
+
+ONEWAY_OK = ["yes", "no", "-1", "reversible", "alternating"]
+
+BIG_PARKING_SPACE_IGNORED = ["aeroway", "bicycle", "bus", "capacity", "capacity:disabled",
+                             "disabled", "emergency", "wheelchair"]
+
+PARKING_IGNORED_ACCESS = ["private", "no"]
+
+
+RULES = [
+    Rule("museum-no-fee", "nw",
+         tags={"tourism": "museum"},
+         without={"fee": None},
+         conf=os.path.join(CONF_DIR, "museum.conf")),
+    Rule("museum-no-website", "nw",
+         tags={"tourism": "museum"},
+         without={"website": None, "contact:website": None},
+         conf=os.path.join(CONF_DIR, "museum.conf")),
+    Rule("oneway-discouraged-values", "w",
+         tags={"oneway": None},
+         without={"oneway": ONEWAY_OK},
+         conf=os.path.join(CONF_DIR, "oneway.conf")),
+    Rule("place_of_worship-no-religion", "nwr",
+         tags={"amenity": "place_of_worship"},
+         without={"religion": None},
+         conf=os.path.join(CONF_DIR, "place-of-worship.conf")),
+    Rule("shop-no-category", "n",
+         tags={"shop": "yes"},
+         conf=os.path.join(CONF_DIR, "shop.conf")),
+    Rule("big-parking-space", "w",
+         tags={"amenity": "parking_space"},
+         without=dict({k: None for k in BIG_PARKING_SPACE_IGNORED}, parking_space="disabled"),
+         min_nodes=6, min_area=500),
+    Rule("parking-surface", "wr",
+         tags={"amenity": "parking"},
+         without={"parking": None, "access": PARKING_IGNORED_ACCESS},
+         min_nodes=11),
+]
+
+# MapRoulette challenge of each rule (see push-challenges.py)
+CHALLENGE_IDS = {
+    "museum-no-fee": 53974,
+    "museum-no-website": 53990,
+    "oneway-discouraged-values": 53991,
+    "place_of_worship-no-religion": 53992,
+    "shop-no-category": 54047,
+}
+
+
+def get_rules(names=None):
+    """Return the registered rules, optionally restricted to `names`."""
+    if not names:
+        return list(RULES)
+    by_name = {rule.name: rule for rule in RULES}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise KeyError(f"Unknown rule(s): {', '.join(unknown)}")
+    return [by_name[n] for n in names]
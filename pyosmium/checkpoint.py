@@ -0,0 +1,153 @@
+"""
+Checkpoints of long runs of the challenge engine.
+
+A planet scan takes hours; a crash, an OOM kill or a runner timeout used to
+throw all of it away. With a checkpoint directory, the matches are spooled
+into one OPL file per rule and checkpoint interval (as parallel.py does per
+range) while the data blobs are read in file order. Every `interval`
+seconds the spools are closed and synced, and checkpoint.json records the
+end offset of the last fully processed blob and how many spool parts are
+complete, written to a temporary file and renamed so a checkpoint is
+either entirely there or not at all.
+
+A resumed run checks that the checkpoint was made for the same input and
+rules, drops the spools written after it and carries on at the recorded
+offset, so a killed run loses at most one interval of work. Once every
+blob is read, the spools are merged in type/id order into the real sinks
+and the rest of the run (locations, areas, measures) proceeds as usual.
+"""
+
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+
+from cache import fingerprint
+from engine import ChallengeEngine, OsmFileSink
+from parallel import merge_spools
+
+
+DEFAULT_INTERVAL = 600
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def _part_name(directory, rule_name, part):
+    return os.path.join(directory, f"{rule_name}.{part:05d}.opl")
+
+
+def _sync(filename):
+    with open(filename, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def load_checkpoint(directory):
+    """Return the last checkpoint saved in `directory`, or None."""
+    filename = os.path.join(directory, CHECKPOINT_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def remove_checkpoint(directory):
+    """Delete a checkpoint directory once the run it belongs to has completed."""
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class Checkpointer:
+    """Spool the matches of an engine, saving a checkpoint every `interval` seconds."""
+
+    def __init__(self, engine, input_file, directory, interval=DEFAULT_INTERVAL, resume=False):
+        self.engine = engine
+        self.directory = directory
+        self.interval = interval
+        self.key = {"input": fingerprint(input_file), "rules": [r.name for r in engine.rules]}
+        os.makedirs(directory, exist_ok=True)
+
+        state = load_checkpoint(directory) if resume else None
+        if state is not None and state["key"] != self.key:
+            raise ValueError(f"Checkpoint in {directory} was made for another input file "
+                             f"or set of rules")
+        if state is None:
+            if resume:
+                logging.info(f"No checkpoint in {directory}, starting from the beginning")
+            state = {"key": self.key, "offset": 0, "parts": 0, "objects": 0, "bytes_read": 0,
+                     "matches": {}}
+        else:
+            logging.info(f"Resuming from checkpoint at offset {state['offset']:,} "
+                         f"({state['parts']} part(s) spooled)")
+        self.state = state
+        # spools written after the checkpoint are incomplete
+        for filename in glob.glob(os.path.join(directory, "*.opl")):
+            if int(filename.rsplit(".", 2)[1]) >= state["parts"]:
+                os.remove(filename)
+
+        # matches are counted again when the spools are merged into the real sinks
+        self.spool = ChallengeEngine(thread_pool=engine.thread_pool, metrics=engine.metrics,
+                                     progress=engine.progress, batch=engine.batch)
+        for rule in engine.rules:
+            self.spool.add_rule(rule, None)
+        metrics = engine.metrics
+        metrics.objects += state["objects"]
+        metrics.bytes_read += state["bytes_read"]
+        for name, count in state["matches"].items():
+            metrics.matches[name] += count
+        self.offset = state["offset"]
+        self._open_parts()
+
+    def _open_parts(self):
+        part = self.state["parts"]
+        self.spool.sinks = {rule.name: OsmFileSink(_part_name(self.directory, rule.name, part))
+                            for rule in self.spool.rules}
+        self.last_save = time.monotonic()
+
+    def remaining(self, blobs):
+        """Data blobs still to read: those after the checkpoint."""
+        return [b for b in blobs if b.offset >= self.offset]
+
+    def on_chunk(self, chunk):
+        """Called after every chunk of blobs: checkpoint when the interval is over."""
+        self.offset = chunk[-1].offset + chunk[-1].size
+        if time.monotonic() - self.last_save >= self.interval:
+            self.save()
+            self._open_parts()
+
+    def save(self):
+        """Close the current spools and record them in checkpoint.json."""
+        self.spool.close()
+        for sink in self.spool.sinks.values():
+            _sync(sink.filename)
+        metrics = self.engine.metrics
+        self.state.update(offset=self.offset, parts=self.state["parts"] + 1,
+                          objects=metrics.objects, bytes_read=metrics.bytes_read,
+                          matches=dict(metrics.matches))
+        filename = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(filename + ".tmp", filename)
+        logging.debug(f"Checkpoint saved at offset {self.offset:,}")
+
+    def finish(self):
+        """Save the last checkpoint and merge all the spools into the engine's sinks."""
+        self.save()
+        for name in self.engine.matches:
+            self.engine.matches[name] = 0
+        for rule in self.engine.rules:
+            parts = [_part_name(self.directory, rule.name, i) for i in range(self.state["parts"])]
+            for obj in merge_spools(parts):
+                self.engine.emit(rule, obj)
+
+
+def apply_blobs_checkpointed(engine, pbf_file, input_file, directory, blobs=None,
+                             interval=DEFAULT_INTERVAL, resume=False):
+    """Run `engine` over the data blobs of a PbfFile, saving checkpoints in `directory`."""
+    checkpointer = Checkpointer(engine, input_file, directory, interval, resume)
+    remaining = checkpointer.remaining(pbf_file.data_blobs if blobs is None else blobs)
+    logging.info(f"Checkpoints every {interval}s in {directory}, {len(remaining):,} blobs to read")
+    checkpointer.spool.apply_blobs(pbf_file, remaining, on_chunk=checkpointer.on_chunk)
+    checkpointer.finish()
@@ -0,0 +1,155 @@
+"""
+Month-over-month delta of challenge outputs.
+
+Each GeoJSON output is loaded as a sorted NumPy array of feature keys
+(OSM type, id, and whether the feature is the area of a closed way) plus a
+64 bit hash of the serialized feature. The keys being sorted, the new,
+resolved and modified tasks fall out of a binary search of the old keys in
+the new ones: only those need to be pushed to MapRoulette instead of
+rebuilding whole challenges.
+
+The outputs must carry the @type and @id attributes (see conf/*.conf).
+Files written by GeoJsonSink (one feature per line, compressed or not, as
+a FeatureCollection or a .geojsonseq) are read line by line without
+parsing the features; other GeoJSON files are parsed and serialized again.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from geojson import FeatureFile, is_sequence, open_input
+
+
+TYPE_CODES = {"node": 0, "way": 1, "relation": 2}
+
+# key = type << TYPE_SHIFT | id << 1 | area
+TYPE_SHIFT = 50
+
+HEADER = '{"type":"FeatureCollection","features":['
+FEATURE_START = '{"type":"Feature","geometry":{"type":"'
+
+TYPE_RE = re.compile(r'"@type":"(node|way|relation)"')
+ID_RE = re.compile(r'"@id":(-?\d+)')
+
+
+def _feature_key(text):
+    osm_type = TYPE_RE.search(text)
+    osm_id = ID_RE.search(text)
+    if osm_type is None or osm_id is None:
+        raise ValueError("Features need @type and @id properties to be compared")
+    code = TYPE_CODES[osm_type.group(1)]
+    area = code == 1 and text.startswith("MultiPolygon", len(FEATURE_START))
+    return code << TYPE_SHIFT | int(osm_id.group(1)) << 1 | area
+
+
+def _feature_hash(text):
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _serialize(feature):
+    return json.dumps({"type": "Feature", "geometry": feature["geometry"],
+                       "properties": feature["properties"]},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def iter_features(filename):
+    """Yield the serialized features of a GeoJSON file.
+
+    Files written by GeoJsonSink and GeoJSON sequences are read line by
+    line, other files are parsed whole.
+    """
+    with open_input(filename) as f:
+        if is_sequence(filename):
+            for line in f:
+                # RFC 8142 sequences start each feature with a record separator
+                line = line.lstrip("\x1e").rstrip("\n")
+                if line.startswith(FEATURE_START):
+                    yield line
+                elif line.strip():
+                    yield _serialize(json.loads(line))
+            return
+        if f.readline().rstrip("\n") == HEADER:
+            for line in f:
+                if line.startswith(FEATURE_START):
+                    yield line.rstrip("\n").rstrip(",")
+            return
+    with open_input(filename) as f:
+        features = json.load(f)["features"]
+    for feature in features:
+        yield _serialize(feature)
+
+
+def read_features(filename):
+    """Serialized features of a GeoJSON file."""
+    return list(iter_features(filename))
+
+
+class FeatureSet:
+    """Serialized features sorted by key, with their hashes."""
+
+    def __init__(self, features):
+        keys = np.fromiter((_feature_key(f) for f in features), dtype=np.int64, count=len(features))
+        hashes = np.fromiter((_feature_hash(f) for f in features), dtype=np.int64,
+                             count=len(features))
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.hashes = hashes[order]
+        self.features = [features[i] for i in order]
+        if len(self.keys) > 1 and (self.keys[1:] == self.keys[:-1]).any():
+            raise ValueError("Duplicate features")
+
+    @classmethod
+    def load(cls, filename):
+        """FeatureSet of a GeoJSON file, empty if there is no such file."""
+        if filename is None or not os.path.exists(filename):
+            return cls([])
+        return cls(read_features(filename))
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def diff(old, new):
+    """Indices of the new features (in `new`), resolved ones (in `old`) and modified ones (in `new`)."""
+    # both key arrays are sorted and unique: each old key is looked up by binary search
+    pos = np.searchsorted(new.keys, old.keys)
+    found = np.zeros(len(old), dtype=bool)
+    if len(new):
+        found = new.keys[np.minimum(pos, len(new) - 1)] == old.keys
+    old_idx = np.flatnonzero(found)
+    new_idx = pos[found]
+    added = np.ones(len(new), dtype=bool)
+    added[new_idx] = False
+    resolved = np.ones(len(old), dtype=bool)
+    resolved[old_idx] = False
+    changed = old.hashes[old_idx] != new.hashes[new_idx]
+    return np.flatnonzero(added), np.flatnonzero(resolved), np.sort(new_idx[changed])
+
+
+def _write(filename, features, indices):
+    out = FeatureFile(filename)
+    for i in indices:
+        out.write_feature(features[i])
+    out.close()
+
+
+def write_delta(old_file, new_file, output_dir, name):
+    """Write <name>.new/.resolved/.modified.geojson in `output_dir`, return the counts."""
+    old = FeatureSet.load(old_file)
+    new = FeatureSet.load(new_file)
+    added, resolved, modified = diff(old, new)
+    _write(os.path.join(output_dir, f"{name}.new.geojson"), new.features, added)
+    _write(os.path.join(output_dir, f"{name}.resolved.geojson"), old.features, resolved)
+    _write(os.path.join(output_dir, f"{name}.modified.geojson"), new.features, modified)
+    return {
+        "previous": len(old),
+        "current": len(new),
+        "new": len(added),
+        "resolved": len(resolved),
+        "modified": len(modified),
+    }
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Compute the task delta between two runs of the challenges.
+
+For each <rule>.geojson of the current run (or .geojsonseq, compressed or
+not), compares it with the previous output and writes to the output directory:
+
+- <rule>.new.geojson: tasks that did not exist before
+- <rule>.resolved.geojson: tasks that disappeared (fixed in OSM)
+- <rule>.modified.geojson: tasks whose geometry or tags changed
+- delta.json: the counts of every rule
+
+Only these need to be pushed to MapRoulette instead of rebuilding every
+challenge from its full GeoJSON.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from challenges import get_rules
+from delta import write_delta
+from geojson import find_output
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def diff_challenges(previous_dir, current_dir, output_dir, rule_names=None):
+    start = time.time()
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {}
+    for rule in get_rules(rule_names):
+        current = find_output(current_dir, rule.name)
+        if current is None:
+            continue
+        previous = find_output(previous_dir, rule.name)
+        counts = write_delta(previous, current, output_dir, rule.name)
+        summary[rule.name] = counts
+        logging.info(f"{rule.name}: {counts['current']:,} tasks, +{counts['new']:,} "
+                     f"-{counts['resolved']:,} ~{counts['modified']:,}")
+
+    with open(os.path.join(output_dir, "delta.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+        f.write("\n")
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compute new, resolved and modified tasks between two runs of the challenges."
+    )
+    parser.add_argument("-p", "--previous", required=True,
+                        help="Directory holding the GeoJSON outputs of the previous run")
+    parser.add_argument("-c", "--current", required=True,
+                        help="Directory holding the GeoJSON outputs of the current run")
+    parser.add_argument("-d", "--output-dir", default="tmp/delta",
+                        help="Directory receiving the delta files")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of rules to compare (default: all)")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"Previous:   {args.previous}")
+    logging.info(f"Current:    {args.current}")
+    logging.info(f"Output dir: {args.output_dir}")
+
+    rule_names = [r for r in args.rules.split(",") if r]
+    diff_challenges(args.previous, args.current, args.output_dir, rule_names)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,51 +6,32 @@ Execution take 4m50 on france.osm.pbf (4.5GB)
 import osmium as o
 import sys
 
+from blobindex import apply_handler
+from challenges import get_rules
+from overpass import OverpassSink, rule_filter
+
 
 class DiscouragedOnewayValuesHandler(o.SimpleHandler):
-    def __init__(self):
+    def __init__(self, sink):
         super(DiscouragedOnewayValuesHandler, self).__init__()
-        self.print_overpass_header()
-
-    def __del__(self):
-        self.print_overpass_footer()
-
-    def print_overpass_header(self):
-        print("[out:json];")
-        print("// Start of Overpass query")
-        print("(", flush=True)
-
-    def print_overpass_footer(self):
-        print(");")
-        print("")
-        print("// Just reapply filter to ignore updated objects")
-        print("way._")
-        print("  [oneway]")
-        print("  [oneway!=yes]")
-        print("  [oneway!=no]")
-        print("  [oneway!=-1]")
-        print("  [oneway!=reversible]")
-        print("  [oneway!=alternating];")
-        print("// End of Overpass query")
-        print("out meta geom;", flush=True)
-
-    def print_way(self, id, val):
-        try:
-            print("  way(%s); // oneway=%s" % (id, val), flush=True)
-        except:
-            print("  way(%s);" % id, flush=True)
+        self.sink = sink  # Overpass query, way ids are written in batches
 
     def way(self, w):
         if 'oneway' in w.tags:
             val = w.tags.get('oneway')
             ok = ["yes", "no", "-1", "reversible", "alternating"]
             if val not in ok:
-                self.print_way(w.id, val)
+                self.sink.add_id('w', w.id)
 
 
 def main(osmfile):
-    handler = DiscouragedOnewayValuesHandler()
-    handler.apply_file(osmfile)
+    # quoted tag conditions of the oneway-discouraged-values rule
+    sink = OverpassSink(footer=rule_filter(get_rules(["oneway-discouraged-values"])[0]))
+    handler = DiscouragedOnewayValuesHandler(sink)
+    # only ways with a oneway tag reach the Python callback, nodes are
+    # skipped when the input has a blob index (see index-pbf.py)
+    apply_handler(handler, osmfile, 'w', filters=[o.filter.KeyFilter('oneway')])
+    sink.close()
     return 0
 
 
@@ -0,0 +1,240 @@
+"""
+One-pass engine for MapRoulette challenges.
+
+Every challenge used to re-read the whole input file on its own. The engine
+holds a set of rules, reads the input once and hands each object to every
+rule interested in its type. Each rule writes its matches to its own sink.
+Candidates are pre-selected by libosmium with the union of the rules'
+tag filters (see rules.py).
+
+Matches of rules with area/length bounds are held back as snapshots until
+the node locations of the candidates are resolved; `apply_measures` then
+measures them in one batch and forwards those within bounds.
+
+With `batch`, the rules are evaluated over chunks of candidates as NumPy
+columns instead of one call per rule and object (see batch.py).
+"""
+
+import logging
+import os
+import time
+import osmium
+
+import measure
+from batch import BATCH_CHUNK_SIZE, BatchMatcher, match_filters
+from memory import create_location_map
+from pbf import DEFAULT_CHUNK_SIZE
+from progress import Metrics
+from rules import entity_bits, prefilter
+from snapshot import Snapshot
+
+
+# ---------------------------------------------------------------------------
+# Sinks
+# ---------------------------------------------------------------------------
+
+class OsmFileSink:
+    """Write matching objects into an OSM file (format from the extension)."""
+
+    def __init__(self, filename):
+        if os.path.exists(filename):
+            logging.info(f"Deleting existing file: {filename}")
+            os.remove(filename)
+        self.filename = filename
+        self.writer = osmium.SimpleWriter(filename)
+
+    def add(self, obj):
+        self.writer.add(obj)
+
+    def close(self):
+        self.writer.close()
+
+
+class TeeSink:
+    """Forward matching objects to several sinks."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def add(self, obj):
+        for sink in self.sinks:
+            sink.add(obj)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+
+class ChallengeEngine:
+    """Run a set of rules over a single read of an OSM file."""
+
+    def __init__(self, thread_pool=None, metrics=None, progress=None, locations=None,
+                 candidates=None, area_method="numpy", batch=False):
+        if batch and locations:
+            raise ValueError("Batch mode can not be combined with a full node location index")
+        self.thread_pool = thread_pool
+        # node location index type (see osmium.index.map_types()), for geometries
+        self.locations = locations
+        self.location_store = None
+        # CandidateLocations for the rules with area/length bounds
+        self.candidates = candidates
+        self.area_method = area_method
+        self.deferred = {}
+        self.metrics = metrics or Metrics()
+        self.progress = progress
+        self.rules = []
+        self.sinks = {}
+        self.matches = self.metrics.matches
+        self._dispatch = {"n": [], "w": [], "r": []}
+        self.batch = batch
+        self._batch = None
+        self.chunk_size = BATCH_CHUNK_SIZE if batch else DEFAULT_CHUNK_SIZE
+
+    def add_rule(self, rule, sink):
+        if rule.name in self.sinks:
+            raise ValueError(f"Rule {rule.name} registered twice")
+        self.rules.append(rule)
+        self.sinks[rule.name] = sink
+        self.metrics.add_rule(rule.name)
+        self.deferred[rule.name] = []
+        for t in rule.entities:
+            self._dispatch[t].append(rule)
+
+    def entities(self):
+        bits = osmium.osm.NOTHING
+        for rule in self.rules:
+            bits |= entity_bits(rule.entities)
+        if self.locations:
+            bits |= osmium.osm.NODE
+        return bits
+
+    def apply_file(self, input_file):
+        """Read `input_file` once and feed every rule."""
+        self._process(input_file)
+        if isinstance(input_file, (str, os.PathLike)):
+            self.metrics.bytes_read += os.path.getsize(input_file)
+
+    def apply_blobs(self, pbf_file, blobs=None, on_chunk=None):
+        """Feed every rule with a range of blobs of a PbfFile (default: all).
+
+        `on_chunk(blobs)` is called after every chunk, e.g. to save a
+        checkpoint (see checkpoint.py).
+        """
+        for chunk, buf in pbf_file.iter_buffers(blobs, self.chunk_size):
+            self._process(buf)
+            self.metrics.bytes_read += pbf_file.size(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+    def apply_stream(self, chunks):
+        """Feed every rule with the (size, FileBuffer) chunks of a PBF being downloaded."""
+        for size, buf in chunks:
+            self._process(buf)
+            self.metrics.bytes_read += size
+
+    def _process(self, source):
+        if self.batch:
+            self._run_batch(source)
+            return
+        processor = osmium.FileProcessor(source, self.entities(), thread_pool=self.thread_pool)
+        if self.locations:
+            # one store for the whole run: blob chunks share the node locations
+            if self.location_store is None:
+                self.location_store = create_location_map(self.locations)
+            processor.with_locations(self.location_store)
+        processor.with_filter(prefilter(self.rules))
+
+        if self.progress is None:
+            self._run(processor)
+        else:
+            self._run_with_progress(processor)
+
+    def _run(self, processor):
+        dispatch = self._dispatch
+        emit = self.emit
+        objects = 0
+
+        for obj in processor:
+            objects += 1
+            for rule in dispatch[obj.type_str()]:
+                if rule.match(obj):
+                    emit(rule, obj)
+
+        self.metrics.objects += objects
+
+    def _run_with_progress(self, processor):
+        dispatch = self._dispatch
+        emit = self.emit
+        metrics = self.metrics
+        rule_time = metrics.rule_time
+        update = self.progress.update
+        clock = time.perf_counter
+
+        for obj in processor:
+            metrics.objects += 1
+            for rule in dispatch[obj.type_str()]:
+                t0 = clock()
+                found = rule.match(obj)
+                rule_time[rule.name] += clock() - t0
+                if found:
+                    emit(rule, obj)
+            update()
+
+    def _run_batch(self, source):
+        """Evaluate the rules over the candidates of `source` at once, then read the matches."""
+        if self._batch is None:
+            self._batch = BatchMatcher(self._dispatch)
+        entities = self.entities()
+        processor = osmium.FileProcessor(source, entities, thread_pool=self.thread_pool)
+        processor.with_filter(prefilter(self.rules))
+        batch, objects = self._batch.collect(processor)
+        self.metrics.objects += objects
+        if self.progress is None:
+            matches = self._batch.evaluate(batch)
+        else:
+            matches = self._batch.evaluate(batch, self.metrics.rule_time)
+            self.progress.update()
+        if not matches:
+            return
+
+        processor = osmium.FileProcessor(source, entities, thread_pool=self.thread_pool)
+        for id_filter in match_filters(matches):
+            processor.with_filter(id_filter)
+        emit = self.emit
+        for obj in processor:
+            for rule in matches.get((obj.type_str(), obj.id), ()):
+                emit(rule, obj)
+
+    def emit(self, rule, obj):
+        """Hand a match to its sink, or hold it back until it is measured."""
+        if rule.measured and self.candidates is not None:
+            start, end = self.candidates.add_way(obj)
+            self.deferred[rule.name].append((Snapshot(obj), start, end))
+            return
+        self.matches[rule.name] += 1
+        self.sinks[rule.name].add(obj)
+
+    def apply_measures(self):
+        """Measure the held back matches (candidates must be resolved) and forward them."""
+        for rule in self.rules:
+            pending = self.deferred[rule.name]
+            if not pending:
+                continue
+            keep = measure.within_bounds(rule, self.candidates, [(s, e) for _, s, e in pending],
+                                         self.area_method)
+            sink = self.sinks[rule.name]
+            for (snapshot, _, _), ok in zip(pending, keep):
+                if ok:
+                    self.matches[rule.name] += 1
+                    sink.add(snapshot)
+            logging.info(f"{rule.name}: {int(keep.sum()):,} of {len(pending):,} candidates within "
+                         f"area/length bounds")
+            self.deferred[rule.name] = []
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
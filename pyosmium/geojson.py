@@ -0,0 +1,366 @@
+"""
+Streaming GeoJSON export of challenge matches.
+
+Writes MapRoulette-ready GeoJSON while the input is read, instead of
+writing an .osm file and converting it with `osmium export`. The
+conf/*.conf files are honoured the same way osmium export does:
+
+- `attributes` adds @type, @id, @version... to the properties
+- `include_tags` / `exclude_tags` select the tags written as properties
+- `linear_tags` makes ways LineStrings, `area_tags` makes closed ways
+  MultiPolygons (both when both match, like osmium export)
+
+Geometries of ways are built either from the node locations attached to
+the ways (the reader runs with a node location index), or, with a
+CandidateLocations (see locations.py), once the locations of the candidate
+nodes have been resolved in a second pass: way features are then written
+when the sink is closed. Likewise, with a RelationAreas (see areas.py),
+multipolygon relations are written as MultiPolygons once assembled.
+
+With a RegionIndex (see regions.py), every feature is also written to
+<region_dir>/<region>.geojson (in the format of the output) for the
+region containing it.
+
+The format follows the extension of the output file: a FeatureCollection
+for .geojson, one feature per line (newline-delimited GeoJSON, as
+MapRoulette's line-by-line upload takes it) for .geojsonseq. Either can
+be compressed while it is written with a .gz or .zst suffix (the latter
+needs the zstandard package). Features go through a write buffer of
+WRITE_BUFFER_SIZE bytes, so memory does not grow with the number of tasks.
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+
+import osmium
+
+from locations import COORDINATE_PRECISION, format_coordinate
+from snapshot import Snapshot
+
+
+ATTRIBUTES = ["type", "id", "version", "changeset", "timestamp", "uid", "user", "way_nodes"]
+
+TYPE_NAMES = {"n": "node", "w": "way", "r": "relation"}
+
+GEOJSON_EXTENSIONS = [".geojson", ".geojsonseq"]
+
+COMPRESSIONS = [".gz", ".zst"]
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+DEFAULT_CONF = {
+    "attributes": {"type": True, "id": True},
+    "linear_tags": True,
+    "area_tags": True,
+    "exclude_tags": [],
+    "include_tags": [],
+}
+
+
+def load_conf(filename):
+    """Read an osmium export config file (None gives the default config)."""
+    if filename is None:
+        return dict(DEFAULT_CONF)
+    with open(filename) as f:
+        conf = json.load(f)
+    return dict(DEFAULT_CONF, **conf)
+
+
+def split_compression(filename):
+    """(file name without compression suffix, compression suffix or "")."""
+    for suffix in COMPRESSIONS:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)], suffix
+    return filename, ""
+
+
+def geojson_suffix(filename):
+    """GeoJSON extension and compression suffix of `filename`, None if it is not GeoJSON."""
+    base, compression = split_compression(filename)
+    for extension in GEOJSON_EXTENSIONS:
+        if base.endswith(extension):
+            return extension + compression
+    return None
+
+
+def is_geojson(filename):
+    return geojson_suffix(filename) is not None
+
+
+def is_sequence(filename):
+    """True for newline-delimited GeoJSON (.geojsonseq) files."""
+    return split_compression(filename)[0].endswith(".geojsonseq")
+
+
+def find_output(directory, name):
+    """Existing GeoJSON output `name` of a directory, whatever its format, or None."""
+    for extension in GEOJSON_EXTENSIONS:
+        for compression in [""] + COMPRESSIONS:
+            filename = os.path.join(directory, name + extension + compression)
+            if os.path.exists(filename):
+                return filename
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Compressing to or reading .zst files needs the zstandard package") \
+            from None
+    return zstandard
+
+
+def open_output(filename, buffer_size=WRITE_BUFFER_SIZE):
+    """Text stream writing `filename`, compressed according to its suffix."""
+    compression = split_compression(filename)[1]
+    if compression == ".gz":
+        stream = io.BufferedWriter(gzip.GzipFile(filename, "wb", compresslevel=6), buffer_size)
+    elif compression == ".zst":
+        writer = _zstandard().ZstdCompressor().stream_writer(open(filename, "wb"))
+        stream = io.BufferedWriter(writer, buffer_size)
+    else:
+        stream = open(filename, "wb", buffering=buffer_size)
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="\n")
+
+
+def open_input(filename):
+    """Text stream reading `filename`, decompressed according to its suffix."""
+    compression = split_compression(filename)[1]
+    if compression == ".gz":
+        return gzip.open(filename, "rt", encoding="utf-8")
+    if compression == ".zst":
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(filename, "rb"))
+        return io.TextIOWrapper(io.BufferedReader(reader), encoding="utf-8")
+    return open(filename, encoding="utf-8")
+
+
+def _tag_matcher(setting):
+    """osmium export `linear_tags`/`area_tags`: a bool or a list of "key[=value]"."""
+    if isinstance(setting, bool):
+        return lambda tags: setting
+    conditions = [item.split("=", 1) for item in setting]
+
+    def matcher(tags):
+        for cond in conditions:
+            val = tags.get(cond[0])
+            if val is not None and (len(cond) == 1 or val == cond[1]):
+                return True
+        return False
+
+    return matcher
+
+
+def _snapshot_coordinates(way):
+    """GeoJSON coordinates of a Snapshot way, like GeoJSONFactory.create_linestring."""
+    points = []
+    last = None
+    for n in way.nodes:
+        loc = n.location
+        if not loc.valid():
+            raise osmium.InvalidLocationError(f"Invalid location of node {n.ref}")
+        if (loc.x, loc.y) != last:
+            last = (loc.x, loc.y)
+            points.append(f"[{format_coordinate(loc.x)},{format_coordinate(loc.y)}]")
+    if len(points) < 2:
+        raise RuntimeError(f"Way {way.id} has less than 2 distinct locations")
+    return "[" + ",".join(points) + "]"
+
+
+class FeatureFile:
+    """GeoJSON FeatureCollection, or sequence for .geojsonseq, written feature by feature."""
+
+    def __init__(self, filename):
+        if os.path.exists(filename):
+            logging.info(f"Deleting existing file: {filename}")
+            os.remove(filename)
+        self.filename = filename
+        self.features = 0
+        self.sequence = is_sequence(filename)
+        self.out = open_output(filename)
+        if not self.sequence:
+            self.out.write('{"type":"FeatureCollection","features":[\n')
+
+    def write(self, geometry, props):
+        self.write_feature('{"type":"Feature","geometry":' + geometry + ',"properties":' + props + '}')
+
+    def write_feature(self, text):
+        """Write an already serialized feature."""
+        if self.sequence:
+            self.out.write(text + "\n")
+        else:
+            if self.features:
+                self.out.write(",\n")
+            self.out.write(text)
+        self.features += 1
+
+    def close(self):
+        if not self.sequence:
+            self.out.write("\n]}\n")
+        self.out.close()
+
+
+def _mean_point(locations):
+    lon = [loc.lon for loc in locations]
+    lat = [loc.lat for loc in locations]
+    return sum(lon) / len(lon), sum(lat) / len(lat)
+
+
+class GeoJsonSink:
+    """Write matching objects as features of a GeoJSON FeatureCollection.
+
+    Also usable in place of an osmium.SimpleWriter (add_node, add_way...).
+    """
+
+    def __init__(self, filename, conf=None, locations=None, areas=None,
+                 regions=None, region_dir=None):
+        if isinstance(conf, (str, os.PathLike)) or conf is None:
+            conf = load_conf(conf)
+        self.filename = filename
+        self.attributes = [a for a in ATTRIBUTES if conf["attributes"].get(a)]
+        self.include_tags = set(conf.get("include_tags") or [])
+        self.exclude_tags = set(conf.get("exclude_tags") or [])
+        self.is_linear = _tag_matcher(conf.get("linear_tags", True))
+        self.is_area = _tag_matcher(conf.get("area_tags", True))
+        self.factory = osmium.geom.GeoJSONFactory()
+        self.locations = locations
+        self.areas = areas
+        self.pending = []
+        self.pending_relations = []
+        self.skipped = 0
+        self.file = FeatureFile(filename)
+        self.regions = regions
+        self.region_dir = region_dir
+        self.region_files = {}
+        if regions is not None:
+            os.makedirs(region_dir, exist_ok=True)
+
+    @property
+    def features(self):
+        return self.file.features
+
+    def add(self, obj):
+        obj_type = obj.type_str()
+        try:
+            if obj_type == "n":
+                loc = obj.location
+                self._write(self.factory.create_point(obj), self._properties_json(obj, True),
+                            (loc.lon, loc.lat))
+            elif obj_type == "w":
+                self._add_way(obj)
+            elif self.areas is not None and self.areas.add_relation(obj):
+                # geometry once the relation areas are assembled, see close()
+                self.pending_relations.append((obj.id, self._properties_json(obj, False)))
+            else:
+                self.skipped += 1  # relations need area assembly
+        except (osmium.InvalidLocationError, RuntimeError):
+            self.skipped += 1
+
+    add_node = add
+    add_way = add
+    add_relation = add
+
+    def _add_way(self, way):
+        tags = way.tags
+        linear = self.is_linear(tags)
+        area = way.is_closed() and len(way.nodes) >= 4 and self.is_area(tags)
+        if not linear and not area:
+            self.skipped += 1
+            return
+        if self.locations is not None:
+            # geometry once the candidate locations are resolved, see close()
+            start, end = self.locations.add_way(way)
+            self.pending.append((self._properties_json(way, True) if linear else None,
+                                 self._properties_json(way, False) if area else None,
+                                 start, end))
+            return
+        if isinstance(way, Snapshot):
+            coords = _snapshot_coordinates(way)
+        else:
+            line = self.factory.create_linestring(way)
+            coords = line[line.index('"coordinates":') + 14:-1]
+        point = _mean_point([n.location for n in way.nodes]) if self.regions is not None else None
+        self._write_way(coords, self._properties_json(way, True) if linear else None,
+                        self._properties_json(way, False) if area else None, point)
+
+    def _write_way(self, coords, linear_props, area_props, point=None):
+        if linear_props is not None:
+            self._write('{"type":"LineString","coordinates":' + coords + '}', linear_props, point)
+        if area_props is not None:
+            self._write('{"type":"MultiPolygon","coordinates":[[' + coords + ']]}', area_props, point)
+
+    def _write_pending(self):
+        for linear_props, area_props, start, end in self.pending:
+            xy = self.locations.coordinates(start, end)
+            if xy is None or len(xy[0]) < 2:
+                self.skipped += 1
+                continue
+            coords = ",".join(f"[{format_coordinate(x)},{format_coordinate(y)}]" for x, y in zip(*xy))
+            point = (xy[0].mean() / COORDINATE_PRECISION, xy[1].mean() / COORDINATE_PRECISION)
+            self._write_way("[" + coords + "]", linear_props, area_props, point)
+        self.pending = []
+
+    def _write_pending_relations(self):
+        for relation_id, props in self.pending_relations:
+            geometry = self.areas.geometry(relation_id)
+            if geometry is None:
+                self.skipped += 1
+                continue
+            self._write(geometry, props, self.areas.point(relation_id))
+        self.pending_relations = []
+
+    def properties(self, obj, with_way_nodes=True):
+        props = {}
+        for attr in self.attributes:
+            if attr == "type":
+                props["@type"] = TYPE_NAMES[obj.type_str()]
+            elif attr == "way_nodes":
+                if with_way_nodes and obj.type_str() == "w":
+                    props["@way_nodes"] = [n.ref for n in obj.nodes]
+            elif attr == "timestamp":
+                props["@timestamp"] = obj.timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+            else:
+                props["@" + attr] = getattr(obj, attr)
+        include = self.include_tags
+        exclude = self.exclude_tags
+        for tag in obj.tags:
+            if (not include or tag.k in include) and tag.k not in exclude:
+                props[tag.k] = tag.v
+        return props
+
+    def _properties_json(self, obj, with_way_nodes):
+        return json.dumps(self.properties(obj, with_way_nodes), ensure_ascii=False,
+                          separators=(",", ":"))
+
+    def _write(self, geometry, props, point=None):
+        self.file.write(geometry, props)
+        if self.regions is not None and point is not None:
+            name = self.regions.lookup(*point)
+            if name is not None:
+                region_file = self.region_files.get(name)
+                if region_file is None:
+                    region_file = FeatureFile(os.path.join(self.region_dir,
+                                                           name + geojson_suffix(self.filename)))
+                    self.region_files[name] = region_file
+                region_file.write(geometry, props)
+
+    def close(self):
+        if self.pending:
+            self._write_pending()
+        if self.pending_relations:
+            self._write_pending_relations()
+        self.file.close()
+        for region_file in self.region_files.values():
+            region_file.close()
+        if self.skipped:
+            logging.info(f"{self.filename}: {self.skipped:,} objects without geometry skipped")
+
+
+def open_writer(filename, conf=None):
+    """GeoJsonSink for GeoJSON files, osmium.SimpleWriter for other OSM formats."""
+    if is_geojson(filename):
+        return GeoJsonSink(filename, conf)
+    return osmium.SimpleWriter(filename)
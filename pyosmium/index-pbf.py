@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Build the blob index of a PBF file, written next to it as <input>.idx.npz.
+
+The index records the type and first id of every data blob (see
+blobindex.py). Run it once per downloaded extract: run-challenges.py and
+the way-only detectors then skip the node section of the file, and only
+read the blobs holding the nodes they need. An index older than its
+input is ignored.
+
+    python pyosmium/index-pbf.py -i tmp/europe-latest.osm.pbf
+"""
+
+import argparse
+import logging
+import time
+
+from blobindex import BlobIndex
+from pbf import PbfFile
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def index_pbf(input_file):
+    start = time.time()
+
+    index = BlobIndex.build(PbfFile(input_file))
+    if not index.sorted:
+        logging.warning(f"{input_file} is not sorted by type and id, the index will not be used")
+    index.save()
+    counts = {t: index.types.count(t) for t in ("n", "w", "r", None)}
+    logging.info(f"{len(index.types):,} blobs: {counts['n']:,} node, {counts['w']:,} way, "
+                 f"{counts['r']:,} relation blobs")
+    if counts[None]:
+        logging.info(f"{counts[None]:,} empty blobs, left out of the lookups")
+    logging.info(f"Index written to {BlobIndex.sidecar(input_file)}")
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build the blob index of a PBF file so readers can skip what they do not need."
+    )
+    parser.add_argument("-i", "--input", required=True, help="Input OSM PBF file")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"Input: {args.input}")
+    index_pbf(args.input)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Two-pass, candidate-only node location resolution.
+
+Building way geometries normally needs a location index holding every node
+of the file, which for Europe or the planet means billions of entries.
+Challenges only need the geometry of their candidates, so instead:
+
+1. while reading, the node refs of the candidate ways are appended to a
+   flat buffer (the ways themselves are written out later);
+2. the refs are turned into a sorted NumPy array of unique node ids, and
+   the file is read again for nodes only, with an osmium IdFilter so that
+   only the needed nodes reach Python;
+3. the found locations are placed with a vectorized searchsorted.
+
+Memory is proportional to the nodes of the candidates (tens of thousands
+of ways), not to the size of the file. Under memory pressure (a
+MemoryMonitor over its budget, see memory.py), the refs are spilled to a
+temporary file as they grow and memory-mapped once the reading is over.
+"""
+
+import logging
+import tempfile
+from array import array
+
+import numpy as np
+import osmium
+
+
+# osmium stores coordinates as 32 bit integers of 1e-7 degree
+INVALID = np.iinfo(np.int32).max
+COORDINATE_PRECISION = 10000000
+
+# refs kept in memory before a spill, and refs sorted at once when spilled
+SPILL_MIN_REFS = 1 << 20
+UNIQUE_CHUNK = 1 << 24
+
+
+def format_coordinate(value):
+    """Format a fixed-point coordinate the way libosmium does (7 decimals, no trailing zeros)."""
+    sign = "-" if value < 0 else ""
+    whole, frac = divmod(abs(int(value)), COORDINATE_PRECISION)
+    frac = str(frac).rjust(7, "0").rstrip("0")
+    return f"{sign}{whole}.{frac}" if frac else f"{sign}{whole}"
+
+
+class CandidateLocations:
+    """Node locations of candidate ways only.
+
+    With a MemoryMonitor, the recorded refs go to a temporary file in
+    `spill_dir` while the monitor reports memory pressure.
+    """
+
+    def __init__(self, monitor=None, spill_dir=None):
+        self.refs = array("q")
+        self.ids = None
+        self.x = None
+        self.y = None
+        self.missing = 0
+        self.monitor = monitor
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self.spilled = 0
+        self._all_refs = None
+
+    def add_way(self, way):
+        """Record the node refs of a way, return their (start, end) slice."""
+        if self.monitor is not None and self.monitor.pressure and len(self.refs) >= SPILL_MIN_REFS:
+            self.spill()
+        # ways recorded after resolve() (matches forwarded by apply_measures) extend the mapping
+        self._all_refs = None
+        start = self.spilled + len(self.refs)
+        self.refs.extend(n.ref for n in way.nodes)
+        return start, self.spilled + len(self.refs)
+
+    def spill(self):
+        """Move the refs recorded so far to the spill file."""
+        if self.spill_file is None:
+            self.spill_file = tempfile.NamedTemporaryFile(prefix="candidates-", suffix=".refs",
+                                                          dir=self.spill_dir)
+            logging.info(f"Memory pressure: spilling candidate node refs to {self.spill_file.name}")
+        self.refs.tofile(self.spill_file)
+        self.spilled += len(self.refs)
+        self.refs = array("q")
+
+    def all_refs(self):
+        """Every recorded ref, memory-mapped from the spill file if any."""
+        if self._all_refs is not None:
+            return self._all_refs
+        if self.spill_file is None:
+            return np.frombuffer(self.refs, dtype=np.int64)
+        if self.refs:
+            self.spill()
+        self.spill_file.flush()
+        self._all_refs = np.memmap(self.spill_file.name, dtype=np.int64, mode="r")
+        return self._all_refs
+
+    def _unique_refs(self):
+        refs = self.all_refs()
+        if self.spill_file is None:
+            return np.unique(refs)
+        # sorting a copy of every spilled ref at once is what spilling avoids
+        parts = [np.unique(refs[i:i + UNIQUE_CHUNK]) for i in range(0, len(refs), UNIQUE_CHUNK)]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def resolve(self, source, thread_pool=None, index=None):
+        """Read the nodes of `source` and keep the locations of the recorded refs.
+
+        With a BlobIndex of `source` (see blobindex.py), only the blobs that
+        may hold one of the refs are read.
+        """
+        self.ids = self._unique_refs()
+        self.x = np.full(len(self.ids), INVALID, dtype=np.int32)
+        self.y = np.full(len(self.ids), INVALID, dtype=np.int32)
+        if not len(self.ids):
+            return
+
+        sources = [source] if index is None else index.buffers(index.blobs_for("n", self.ids))
+        found = sum(self._place(src, thread_pool) for src in sources)
+        logging.info(f"Resolved {found:,} of {len(self.ids):,} candidate node locations")
+
+    def overlay(self, source, thread_pool=None):
+        """Replace the resolved locations by those of the nodes of `source`, e.g. a change file."""
+        if self.ids is not None and len(self.ids):
+            self._place(source, thread_pool)
+
+    def _place(self, source, thread_pool=None):
+        """Store the locations of the recorded refs found in `source`, return how many."""
+        found = array("q")
+        xs = array("i")
+        ys = array("i")
+        processor = osmium.FileProcessor(source, osmium.osm.NODE, thread_pool=thread_pool)
+        processor.with_filter(osmium.filter.IdFilter(self.ids))
+        for node in processor:
+            loc = node.location
+            if not loc.valid():
+                continue  # deleted node of a change file
+            found.append(node.id)
+            xs.append(loc.x)
+            ys.append(loc.y)
+
+        idx = np.searchsorted(self.ids, np.frombuffer(found, dtype=np.int64))
+        self.x[idx] = np.frombuffer(xs, dtype=np.int32)
+        self.y[idx] = np.frombuffer(ys, dtype=np.int32)
+        self.missing = int(np.count_nonzero(self.x == INVALID))
+        return len(found)
+
+    def ragged(self, slices):
+        """Flat lon/lat buffers in degrees of several recorded ways, for measure.py.
+
+        Returns (lon, lat, offsets, valid): way i spans offsets[i]:offsets[i + 1]
+        and valid[i] is False when one of its nodes was not found.
+        """
+        starts = np.array([start for start, _ in slices], dtype=np.int64)
+        counts = np.array([end - start for start, end in slices], dtype=np.int64)
+        offsets = np.zeros(len(slices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        refs = self.all_refs()[index]
+        pos = np.searchsorted(self.ids, refs)
+        x = self.x[pos]
+        y = self.y[pos]
+        missing = np.repeat(np.arange(len(slices)), counts)[x == INVALID]
+        valid = np.bincount(missing, minlength=len(slices)) == 0
+        return x / COORDINATE_PRECISION, y / COORDINATE_PRECISION, offsets, valid
+
+    def coordinates(self, start, end):
+        """Fixed-point (x, y) arrays of a recorded way, None if a node is missing.
+
+        Consecutive duplicate locations are removed, like osmium's use_nodes.UNIQUE.
+        """
+        idx = np.searchsorted(self.ids, self.all_refs()[start:end])
+        x = self.x[idx]
+        y = self.y[idx]
+        if (x == INVALID).any():
+            return None
+        keep = np.ones(len(x), dtype=bool)
+        keep[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+        return x[keep], y[keep]
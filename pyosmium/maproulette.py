@@ -0,0 +1,162 @@
+"""
+Asynchronous MapRoulette API client.
+
+All requests share one aiohttp session, whose connector keeps at most
+`concurrency` connections open to the server, so several challenges are
+rebuilt or filled at the same time without opening a connection per
+request. Failed requests (connection errors, 429 and 5xx answers) are
+retried with an exponential backoff, honouring Retry-After. Adding tasks
+is not idempotent: a chunk that may have reached the server (a timeout, a
+connection lost after sending it, or a 500, 502 or 504 answer, which can
+come after a partial write) is not sent again, which would duplicate its
+tasks; only failures to connect and 429/503 answers are retried.
+
+Tasks are pushed from the GeoJSON outputs in chunks of `chunk_size`
+features, each chunk sent as a small FeatureCollection. Features are
+streamed from disk (see delta.iter_features) and a chunk is only read
+when a request slot is free, so at most `concurrency` chunks are in memory.
+Once a chunk has failed for good, the rest of the file is not read.
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+
+from delta import iter_features
+
+
+DEFAULT_URL = "https://maproulette.org"
+
+DEFAULT_CONCURRENCY = 4
+
+DEFAULT_CHUNK_SIZE = 1000
+
+DEFAULT_RETRIES = 5
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# answers telling that the request was refused before being processed
+REFUSED_STATUSES = {429, 503}
+
+
+class MapRouletteError(Exception):
+    pass
+
+
+def _chunks(features, size):
+    chunk = []
+    for feature in features:
+        chunk.append(feature)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MapRouletteClient:
+    """MapRoulette API v2 client, to be used as an async context manager."""
+
+    def __init__(self, api_key, url=DEFAULT_URL, concurrency=DEFAULT_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, backoff=1.0, timeout=300):
+        self.api_key = api_key
+        self.url = url.rstrip("/")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = None
+        self.slots = None
+        self.requests = 0
+
+    async def __aenter__(self):
+        # chunks in flight, over all the challenges being filled
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"apiKey": self.api_key, "accept": "*/*"})
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, method, path, params=None, data=None, idempotent=True):
+        """Send a request, retrying failures; return the response body as text.
+
+        A request that is not `idempotent` is only retried when it did not
+        reach the server (connection refused) or was refused (429, 503).
+        """
+        retry_statuses = RETRY_STATUSES if idempotent else REFUSED_STATUSES
+        url = f"{self.url}/api/v2/{path}"
+        headers = {"Content-Type": "application/json"} if data is not None else None
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                async with self.session.request(method, url, params=params, data=data,
+                                                headers=headers) as response:
+                    self.requests += 1
+                    text = await response.text()
+                    if response.status < 400:
+                        return text
+                    if response.status not in retry_statuses:
+                        note = (", not retried as the server may have applied it"
+                                if response.status in RETRY_STATUSES else "")
+                        raise MapRouletteError(f"{method} {url}: {response.status} "
+                                               f"{text[:200]}{note}")
+                    error = f"{response.status} {text[:200]}"
+                    retry_after = response.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        delay = int(retry_after)
+            except aiohttp.ClientConnectorError as e:
+                # no connection: nothing was sent
+                error = f"{type(e).__name__}: {e}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                if not idempotent:
+                    raise MapRouletteError(f"{method} {url}: {error}, not retried as the server "
+                                           f"may have applied it") from e
+            if attempt == self.retries:
+                raise MapRouletteError(f"{method} {url}: {error}, giving up after "
+                                       f"{self.retries + 1} attempts")
+            logging.warning(f"{method} {url}: {error}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+    async def rebuild(self, challenge_id, remove_unmatched=True, skip_snapshot=False):
+        """Have MapRoulette rebuild a challenge from its remote GeoJSON source."""
+        params = {"removeUnmatched": str(remove_unmatched).lower(),
+                  "skipSnapshot": str(skip_snapshot).lower()}
+        await self.request("PUT", f"challenge/{challenge_id}/rebuild", params=params)
+
+    async def _push(self, challenge_id, chunk, errors):
+        try:
+            body = '{"type":"FeatureCollection","features":[' + ",".join(chunk) + "]}"
+            await self.request("PUT", f"challenge/{challenge_id}/addTasks",
+                               data=body.encode("utf-8"), idempotent=False)
+        except Exception as e:
+            # recorded before the slot is released, so that no further chunk is read
+            errors.append(e)
+            raise
+        finally:
+            self.slots.release()
+
+    async def add_tasks(self, challenge_id, filename, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Push the features of a GeoJSON file as tasks, return how many were sent."""
+        sent = 0
+        pushes = []
+        errors = []
+        chunks = _chunks(iter_features(filename), chunk_size)
+        while True:
+            # the next chunk is only read once a request slot is free
+            await self.slots.acquire()
+            chunk = None if errors else next(chunks, None)
+            if chunk is None:
+                self.slots.release()
+                break
+            pushes.append(asyncio.create_task(self._push(challenge_id, chunk, errors)))
+            sent += len(chunk)
+        for result in await asyncio.gather(*pushes, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+        return sent
@@ -0,0 +1,92 @@
+"""
+Batched geodesic measurement of way geometries.
+
+Candidate geometries are gathered into flat coordinate buffers (one
+offsets array marking where each way starts) and measured all at once with
+NumPy: haversine lengths in metres and spherical polygon areas in square
+metres. This replaces per-way WKB + Shapely parsing, which also measured
+in degrees (`poly.length * 100000`). With method="shapely", areas are
+computed by Shapely 2 vectorized functions on an equal-area projection.
+"""
+
+import numpy as np
+
+
+# radius of the sphere with the same surface as the WGS84 ellipsoid
+EARTH_RADIUS = 6371007.2
+
+
+def _point_way(offsets):
+    """Index of the way each point belongs to."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _segments(offsets):
+    """Start indices of the segments lying within a single way, and their way."""
+    way = _point_way(offsets)
+    starts = np.flatnonzero(way[:-1] == way[1:])
+    return starts, way[starts]
+
+
+def lengths(lon, lat, offsets):
+    """Haversine length in metres of each polyline of the flat buffers."""
+    nb = len(offsets) - 1
+    if not len(lon):
+        return np.zeros(nb)
+    starts, way = _segments(offsets)
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    dphi = phi[starts + 1] - phi[starts]
+    dlam = lam[starts + 1] - lam[starts]
+    h = np.sin(dphi / 2) ** 2 + np.cos(phi[starts]) * np.cos(phi[starts + 1]) * np.sin(dlam / 2) ** 2
+    dist = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+    return np.bincount(way, weights=dist, minlength=nb)
+
+
+def areas(lon, lat, offsets, method="numpy"):
+    """Area in square metres of each closed ring of the flat buffers.
+
+    Rings that are not closed (first point != last point) get an area of 0.
+    """
+    nb = len(offsets) - 1
+    if not len(lon):
+        return np.zeros(nb)
+    first = offsets[:-1]
+    last = offsets[1:] - 1
+    closed = (np.diff(offsets) >= 4) & (lon[first] == lon[last]) & (lat[first] == lat[last])
+    if method == "shapely":
+        result = _areas_shapely(lon, lat, offsets)
+    else:
+        starts, way = _segments(offsets)
+        lam = np.radians(lon)
+        sin_phi = np.sin(np.radians(lat))
+        term = (lam[starts + 1] - lam[starts]) * (2 + sin_phi[starts] + sin_phi[starts + 1])
+        result = np.abs(np.bincount(way, weights=term, minlength=nb)) * EARTH_RADIUS ** 2 / 2
+    return np.where(closed, result, 0.0)
+
+
+def _areas_shapely(lon, lat, offsets):
+    import shapely
+
+    # Lambert cylindrical equal-area projection, standard parallel at each ring's mean latitude
+    way = _point_way(offsets)
+    counts = np.diff(offsets)
+    phi0 = np.radians(np.bincount(way, weights=lat, minlength=len(counts)) / np.maximum(counts, 1))
+    cos0 = np.cos(phi0)[way]
+    x = EARTH_RADIUS * np.radians(lon) * cos0
+    y = EARTH_RADIUS * np.sin(np.radians(lat)) / cos0
+    polygons = shapely.from_ragged_array(
+        shapely.GeometryType.POLYGON, np.column_stack([x, y]),
+        (np.asarray(offsets), np.arange(len(offsets))))
+    return shapely.area(polygons)
+
+
+def within_bounds(rule, candidates, slices, method="numpy"):
+    """Mask of the recorded ways within the area/length bounds of `rule`.
+
+    `slices` are the (start, end) slices returned by CandidateLocations.add_way;
+    ways with a node whose location was not found are out of bounds.
+    """
+    lon, lat, offsets, valid = candidates.ragged(slices)
+    return valid & rule.check_measures(areas(lon, lat, offsets, method),
+                                       lengths(lon, lat, offsets))
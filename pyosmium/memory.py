@@ -0,0 +1,207 @@
+"""
+Memory budget of a run.
+
+A GitHub runner has about 7 GB of RAM, and past it the OOM killer ends the
+run with nothing written. With a budget (`--memory-budget`):
+
+- the node location index of the runs needing one for the whole file is
+  chosen from the size of the input (`choose_location_index`): in memory
+  (sparse_mem_array, 16 bytes per node) when the estimated number of nodes
+  fits in half of the budget, file-backed (sparse_file_array in the
+  temporary directory, paged in and out by the kernel) otherwise. The
+  file is unlinked as soon as osmium has opened it (`create_location_map`),
+  so a killed run does not leave it behind
+- a MemoryMonitor thread samples the resident memory of the process every
+  SAMPLE_INTERVAL seconds (and the memory allocated by Python, with
+  tracemalloc, when asked to), recording the peak of each stage of the run
+  (read, locations, areas, measures, output)
+- over SPILL_RATIO of the budget, the monitor raises its `pressure` flag:
+  CandidateLocations then spills the node refs of the candidate ways to a
+  temporary file as they grow (see locations.py)
+
+The peaks of each stage end up in the run report, to tell which part of
+a run to look at when it outgrows the runner.
+"""
+
+import contextlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import tracemalloc
+
+import osmium
+
+from progress import peak_rss
+
+
+SAMPLE_INTERVAL = 0.5
+
+SPILL_RATIO = 0.8
+
+# nodes per byte of input, from planet and Geofabrik extracts
+NODES_PER_BYTE = {".pbf": 0.125, ".osm": 0.01}
+
+SPARSE_BYTES_PER_NODE = 16
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text):
+    """Bytes of a size such as "6G", "512M" or "1500000000"."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", text, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+def format_size(nb):
+    return f"{nb / 1024 ** 2:,.0f} MB"
+
+
+def current_rss():
+    """Resident memory in bytes of this process (its peak where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def total_memory():
+    """Physical memory of the machine in bytes."""
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def estimated_nodes(input_file):
+    ratio = NODES_PER_BYTE[".pbf" if input_file.endswith(".pbf") else ".osm"]
+    return int(os.path.getsize(input_file) * ratio)
+
+
+def choose_location_index(input_file, budget, tmp_dir=None):
+    """osmium location index type to read `input_file` with, under `budget` bytes."""
+    needed = estimated_nodes(input_file) * SPARSE_BYTES_PER_NODE
+    if needed <= budget / 2:
+        logging.info(f"Node locations in memory (about {format_size(needed)})")
+        return "sparse_mem_array"
+    fd, filename = tempfile.mkstemp(prefix="locations-", suffix=".idx", dir=tmp_dir)
+    os.close(fd)
+    logging.info(f"Node locations in {filename} (about {format_size(needed)}, "
+                 f"over half of the {format_size(budget)} budget)")
+    return f"sparse_file_array,{filename}"
+
+
+def _index_file(idx):
+    kind, _, filename = idx.partition(",")
+    return filename if kind.endswith("_file_array") and filename else None
+
+
+def create_location_map(idx):
+    """osmium.index.create_map, unlinking the file of a file-backed index once opened."""
+    location_map = osmium.index.create_map(idx)
+    filename = _index_file(idx)
+    if filename is not None and os.path.exists(filename):
+        os.remove(filename)
+    return location_map
+
+
+@contextlib.contextmanager
+def location_index(input_file, budget=None, tmp_dir=None):
+    """Yield the location index type of `apply_file(..., idx=...)` for `input_file`.
+
+    Without a budget, osmium's default (flex_mem). The file of a
+    file-backed index is deleted on exit.
+    """
+    if budget is None:
+        yield "flex_mem"
+        return
+    idx = choose_location_index(input_file, budget, tmp_dir)
+    try:
+        yield idx
+    finally:
+        filename = _index_file(idx)
+        if filename is not None and os.path.exists(filename):
+            os.remove(filename)
+
+
+class MemoryMonitor:
+    """Sample the memory of the process in a thread, keeping the peak of each stage."""
+
+    def __init__(self, budget=None, trace_malloc=False, interval=SAMPLE_INTERVAL):
+        self.budget = budget
+        self.trace_malloc = trace_malloc
+        self.interval = interval
+        self.current = None
+        # stage -> [peak resident bytes, peak Python allocated bytes]
+        self.peaks = {}
+        self.pressure = False
+        self._warned = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.trace_malloc:
+            tracemalloc.start()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        if self.trace_malloc:
+            tracemalloc.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = current_rss()
+        traced = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        if self.current is not None:
+            peak = self.peaks.setdefault(self.current, [0, 0])
+            peak[0] = max(peak[0], rss)
+            peak[1] = max(peak[1], traced)
+        if self.budget is not None:
+            self.pressure = rss >= self.budget * SPILL_RATIO
+            if rss > self.budget and not self._warned:
+                self._warned = True
+                where = f" in stage {self.current}" if self.current else ""
+                logging.warning(f"Resident memory ({format_size(rss)}) over the budget "
+                                f"of {format_size(self.budget)}{where}")
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Attribute the memory sampled inside the block to stage `name`."""
+        previous = self.current
+        self.sample()
+        self.current = name
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.sample()
+            self.current = previous
+
+    def record(self, metrics):
+        """Add the peaks of every stage to a Metrics report."""
+        for name, (rss, traced) in self.peaks.items():
+            metrics.add_stage_memory(name, rss, traced if self.trace_malloc else None)
+
+    def log_report(self):
+        logging.info("Peak memory per stage:")
+        for name, (rss, traced) in self.peaks.items():
+            text = f"  {name:<10} {format_size(rss):>12} resident"
+            if self.trace_malloc:
+                text += f", {format_size(traced):>10} allocated by Python"
+            logging.info(text)
@@ -0,0 +1,138 @@
+"""
+Museum detectors shared by museum-without-fee.py and museum-without-website.py.
+
+Both scripts extract the nodes and ways tagged tourism=museum that lack a
+tag; only that tag (the forbidden keys), the default output and the texts
+differ, so the handler, the extraction and the command line live here and
+each script only declares its keys.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import time
+import osmium
+
+from geojson import is_geojson, open_writer
+from memory import MemoryMonitor, location_index, parse_size
+from profiling import PROFILE_MODES, profile_apply
+from progress import Progress
+
+
+DEFAULT_CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "conf", "museum.conf")
+
+
+# ---------------------------------------------------------------------------
+# Handler
+# ---------------------------------------------------------------------------
+
+class MuseumHandler(osmium.SimpleHandler):
+    """Extract nodes and ways tagged tourism=museum without any of the `forbidden` keys."""
+
+    def __init__(self, writer, forbidden, show_progress=True):
+        super().__init__()
+        self.writer = writer
+        self.forbidden = tuple(forbidden)
+        self.nb_nodes = 0
+        self.nb_ways = 0
+        self.progress = Progress(enabled=show_progress,
+                                 text=lambda: f"Nodes: {self.nb_nodes:,}  Ways: {self.nb_ways:,}")
+
+    def is_concerned(self, obj):
+        tags = obj.tags
+        return tags.get("tourism") == "museum" and not any(key in tags for key in self.forbidden)
+
+    def node(self, n):
+        if self.is_concerned(n):
+            self.nb_nodes += 1
+            self.writer.add_node(n)
+            self.progress.update()
+
+    def way(self, w):
+        if self.is_concerned(w):
+            self.nb_ways += 1
+            self.writer.add_way(w)
+            self.progress.update()
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def extract_museums(input_file, output_file, forbidden, show_progress=True, conf=None,
+                    profile=None, memory_budget=None):
+    start = time.time()
+
+    if os.path.exists(output_file):
+        logging.info(f"Deleting existing file: {output_file}")
+        os.remove(output_file)
+
+    logging.info("Initializing writer")
+    writer = open_writer(output_file, conf)
+
+    logging.info("Initializing handler")
+    handler = MuseumHandler(writer, forbidden, show_progress=show_progress)
+
+    logging.info("Processing input file...")
+    # only tourism=museum objects reach the Python callbacks
+    # GeoJSON geometries of ways need the node locations
+    locations = is_geojson(output_file)
+    filters = [osmium.filter.TagFilter(("tourism", "museum"))]
+    # with a budget, node locations may go to a file-backed index and the
+    # memory is sampled for the report (see memory.py)
+    monitor = MemoryMonitor(memory_budget) if memory_budget else None
+    stage = monitor.stage("read") if monitor is not None else contextlib.nullcontext()
+    with location_index(input_file, memory_budget if locations else None) as idx, \
+            monitor or contextlib.nullcontext(), stage:
+        if profile:
+            profile_apply(handler, input_file, profile, ["is_concerned"], locations, filters, idx)
+        else:
+            handler.apply_file(input_file, locations=locations, idx=idx, filters=filters)
+
+    writer.close()
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+
+    handler.progress.finish()
+    logging.info(f"Nodes found: {handler.nb_nodes:,}")
+    logging.info(f"Ways found:  {handler.nb_ways:,}")
+    if monitor is not None:
+        monitor.log_report()
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args(description, default_output):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-i", "--input", required=True, help="Input OSM/PBF file")
+    parser.add_argument("-o", "--output", default=default_output,
+                        help="Output OSM file, or .geojson/.geojsonseq (optionally .gz/.zst) "
+                             "for MapRoulette")
+    parser.add_argument("-c", "--conf", default=DEFAULT_CONF,
+                        help="osmium export config used for GeoJSON output")
+    parser.add_argument("--memory-budget", type=parse_size,
+                        help="Memory the run should fit in, e.g. 6G: picks an in-memory or "
+                             "file-backed node location index and reports the peak memory")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="Report where the processing time goes; 'cprofile' and 'sample' "
+                             "also list the hottest functions (see profiling.py)")
+    parser.add_argument("--no-progress", action="store_true",
+                        help="Disable progress display")
+    return parser.parse_args()
+
+
+def main(forbidden, description, default_output):
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args(description, default_output)
+
+    logging.info(f"Input:  {args.input}")
+    logging.info(f"Output: {args.output}")
+
+    extract_museums(args.input, args.output, forbidden, show_progress=not args.no_progress,
+                    conf=args.conf, profile=args.profile, memory_budget=args.memory_budget)
@@ -0,0 +1,172 @@
+"""
+Overpass queries selecting the matches of a challenge by id.
+
+Instead of one `way(id);` statement per match, ids are buffered and
+written as `way(id:1,2,3,...);` statements of `batch_size` ids, which
+keeps the queries small and fast to run on the Overpass side. With
+`max_ids`, the query is split into several files (<name>.001.opq,
+<name>.002.opq...) of at most that many ids each, to stay under the
+Overpass query size limits. The sink has to be closed explicitly.
+"""
+
+import logging
+import math
+import os
+import sys
+
+
+TYPE_NAMES = {"n": "node", "w": "way", "r": "relation"}
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+# characters with a meaning in the POSIX extended regular expressions of Overpass
+REGEX_SPECIAL = set(".^$*+?()[]{}|\\")
+
+
+def _quote(text):
+    """Overpass QL string literal: keys such as contact:website are invalid unquoted."""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _regex(value):
+    return "".join("\\" + c if c in REGEX_SPECIAL else c for c in value)
+
+
+def _condition(key, values, negate):
+    key = _quote(key)
+    if values is None:
+        return f"[!{key}]" if negate else f"[{key}]"
+    if negate:
+        return "".join(f"[{key}!={_quote(v)}]" for v in sorted(values))
+    if len(values) == 1:
+        return f"[{key}={_quote(next(iter(values)))}]"
+    return f"[{key}~{_quote('^(' + '|'.join(_regex(v) for v in sorted(values)) + ')$')}]"
+
+
+def _geometry_condition(rule):
+    """Overpass `(if: ...)` filter of the area/length bounds of a rule, None without bounds.
+
+    Overpass QL has no area evaluator: a minimum area becomes the minimum
+    perimeter of a ring of that area, sqrt(4 * pi * area) (a circle), which
+    no match can be under. A maximum area is left to the extract run.
+    """
+    tests = []
+    if rule.min_area is not None:
+        tests.append(f"length() >= {math.floor(math.sqrt(4 * math.pi * rule.min_area) * 10) / 10:g}")
+    if rule.min_length is not None:
+        tests.append(f"length() >= {rule.min_length:g}")
+    if rule.max_length is not None:
+        tests.append(f"length() <= {rule.max_length:g}")
+    return f"(if: {' && '.join(tests)})" if tests else None
+
+
+def rule_filter(rule):
+    """Overpass statements applying the tag conditions (and length bounds) of a rule to the result set."""
+    lines = []
+    geometry = _geometry_condition(rule)
+    for entity in rule.entities:
+        lines.append(f"{TYPE_NAMES[entity]}._")
+        for key, values in rule.tags.items():
+            lines.append("  " + _condition(key, values, False))
+        for key, values in rule.without.items():
+            lines.append("  " + _condition(key, values, True))
+        if geometry is not None:
+            lines.append("  " + geometry)
+        lines[-1] += ";"
+    if len(rule.entities) > 1:
+        lines = ["("] + ["  " + line for line in lines] + [");"]
+    return lines
+
+
+class OverpassSink:
+    """Write matching objects as an Overpass query.
+
+    `filename` None writes to stdout (no split). `footer` are Overpass
+    statements applied to the selected objects, e.g. `rule_filter(rule)`
+    to drop the objects fixed since the extract was made.
+    """
+
+    def __init__(self, filename=None, footer=None, batch_size=DEFAULT_BATCH_SIZE, max_ids=None):
+        self.filename = filename
+        self.footer = footer or []
+        self.batch_size = batch_size
+        self.max_ids = max_ids if filename is not None else None
+        self.buffers = {"n": [], "w": [], "r": []}
+        self.counts = {"n": 0, "w": 0, "r": 0}
+        self.total = 0
+        self.part = 0
+        self.part_ids = 0
+        self.files = []
+        self.out = None
+
+    def add(self, obj):
+        self.add_id(obj.type_str(), obj.id)
+
+    add_node = add
+    add_way = add
+    add_relation = add
+
+    def add_id(self, obj_type, obj_id):
+        if self.max_ids and self.part_ids >= self.max_ids:
+            self._flush_all()
+            self._close_part()
+        if self.out is None:
+            self._open_part()
+        buffer = self.buffers[obj_type]
+        buffer.append(obj_id)
+        self.counts[obj_type] += 1
+        self.total += 1
+        self.part_ids += 1
+        if len(buffer) >= self.batch_size:
+            self._flush(obj_type)
+
+    def _part_name(self):
+        if not self.max_ids:
+            return self.filename
+        stem, ext = os.path.splitext(self.filename)
+        return f"{stem}.{self.part:03d}{ext or '.opq'}"
+
+    def _open_part(self):
+        self.part += 1
+        self.part_ids = 0
+        if self.filename is None:
+            self.out = sys.stdout
+        else:
+            name = self._part_name()
+            self.files.append(name)
+            self.out = open(name, "w", encoding="utf-8")
+        self.out.write("[out:json];\n// Start of Overpass query\n(\n")
+
+    def _flush(self, obj_type):
+        ids = self.buffers[obj_type]
+        if ids:
+            self.out.write(f"  {TYPE_NAMES[obj_type]}(id:{','.join(map(str, ids))});\n")
+            ids.clear()
+
+    def _flush_all(self):
+        for obj_type in ("n", "w", "r"):
+            self._flush(obj_type)
+
+    def _close_part(self):
+        self.out.write(");\n")
+        if self.footer:
+            self.out.write("\n// Just reapply filter to ignore updated objects\n")
+            self.out.write("\n".join(self.footer) + "\n")
+        self.out.write("// End of Overpass query\n")
+        self.out.write(f"// Total of objects: {self.part_ids}\n")
+        self.out.write("out meta geom;\n")
+        if self.out is sys.stdout:
+            self.out.flush()
+        else:
+            self.out.close()
+        self.out = None
+
+    def close(self):
+        if self.out is None and self.part == 0:
+            self._open_part()  # empty query
+        if self.out is not None:
+            self._flush_all()
+            self._close_part()
+        if len(self.files) > 1:
+            logging.info(f"{self.filename}: {self.total:,} objects in {len(self.files)} queries")
@@ -0,0 +1,80 @@
+"""
+Multi-process execution of the challenge engine.
+
+The data blobs of the input PBF are split into consecutive ranges of
+similar size, and every range is run through the same rules in a process
+pool. Workers spool their matches into one OPL file per rule and range.
+The spools are then merged in type/id order into the real sinks, so the
+outputs are identical to a serial run whatever order workers finish in.
+"""
+
+import heapq
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import osmium
+
+from engine import ChallengeEngine, OsmFileSink
+from pbf import PbfFile
+
+
+TYPE_ORDER = {"n": 0, "w": 1, "r": 2}
+
+
+def _spool_name(spool_dir, rule_name, index):
+    return os.path.join(spool_dir, f"{rule_name}.{index:05d}.opl")
+
+
+def _process_range(rules, filename, blobs, spool_dir, index, batch=False):
+    """Worker: run `rules` over one range of blobs, spooling the matches."""
+    # no candidates: matches of measured rules are measured in the parent
+    engine = ChallengeEngine(thread_pool=osmium.io.ThreadPool(num_threads=1), batch=batch)
+    for rule in rules:
+        engine.add_rule(rule, OsmFileSink(_spool_name(spool_dir, rule.name, index)))
+    engine.apply_blobs(PbfFile(filename, blobs))
+    engine.close()
+    metrics = engine.metrics
+    return metrics.objects, metrics.bytes_read, metrics.rule_time
+
+
+def _read_spool(filename):
+    for obj in osmium.FileProcessor(filename):
+        yield (TYPE_ORDER[obj.type_str()], obj.id), obj
+
+
+def merge_spools(filenames):
+    """Yield the objects of several sorted spool files in type/id order."""
+    streams = [_read_spool(f) for f in filenames]
+    for _, obj in heapq.merge(*streams, key=itemgetter(0)):
+        yield obj
+
+
+def apply_file_parallel(engine, filename, jobs, spool_dir=None, blobs=None):
+    """Run `engine` over a PBF file, or some of its data blobs, with `jobs` worker processes."""
+    pbf_file = PbfFile(filename)
+    if blobs is not None:
+        pbf_file = PbfFile(filename, [pbf_file.header_blob] + blobs)
+    ranges = pbf_file.split(jobs)
+    logging.info(f"Processing {len(pbf_file.data_blobs):,} blobs in {len(ranges)} ranges")
+
+    with tempfile.TemporaryDirectory(prefix="spool-", dir=spool_dir) as tmp:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_process_range, engine.rules, filename,
+                                   [pbf_file.header_blob] + blobs, tmp, i, engine.batch)
+                       for i, blobs in enumerate(ranges)]
+            for future in futures:
+                objects, bytes_read, rule_time = future.result()
+                engine.metrics.objects += objects
+                engine.metrics.bytes_read += bytes_read
+                for name, spent in rule_time.items():
+                    engine.metrics.rule_time[name] += spent
+                if engine.progress is not None:
+                    engine.progress.update()
+
+        for rule in engine.rules:
+            spools = [_spool_name(tmp, rule.name, i) for i in range(len(ranges))]
+            for obj in merge_spools(spools):
+                engine.emit(rule, obj)
@@ -0,0 +1,140 @@
+"""
+Blob-level access to OSM PBF files.
+
+A PBF file is a sequence of blobs: one OSMHeader blob followed by OSMData
+blobs of about 8000 objects each. Every blob is framed by a 4 byte length
+and a small BlobHeader, so the blob boundaries can be found by reading
+those headers and seeking over the data, without decompressing anything.
+
+Any run of consecutive data blobs, prefixed with the header blob, is a
+valid PBF file of its own. This is what allows a file to be processed in
+chunks or split between several processes.
+"""
+
+import struct
+from collections import namedtuple
+
+import osmium
+
+
+# Position of a blob in the file. `size` includes the length prefix and the
+# BlobHeader, so blobs[i].offset + blobs[i].size == blobs[i + 1].offset.
+Blob = namedtuple("Blob", ["offset", "size", "type"])
+
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def parse_blob_header(buf):
+    """Return (type, datasize) from an encoded BlobHeader message."""
+    pos = 0
+    blob_type = None
+    datasize = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire} in BlobHeader")
+        if field == 1:
+            blob_type = bytes(value).decode()
+        elif field == 3:
+            datasize = value
+    return blob_type, datasize
+
+
+def iter_blobs(filename):
+    """Yield the Blob of every blob in a PBF file, in file order."""
+    with open(filename, "rb") as f:
+        offset = 0
+        while True:
+            prefix = f.read(4)
+            if not prefix:
+                return
+            if len(prefix) < 4:
+                raise ValueError(f"{filename}: truncated blob at offset {offset}")
+            header_size = struct.unpack(">I", prefix)[0]
+            blob_type, datasize = parse_blob_header(f.read(header_size))
+            size = 4 + header_size + datasize
+            yield Blob(offset, size, blob_type)
+            offset += size
+            f.seek(offset)
+
+
+class PbfFile:
+    """Blob layout of a PBF file: its header blob and its data blobs."""
+
+    def __init__(self, filename, blobs=None):
+        self.filename = filename
+        if blobs is None:
+            blobs = list(iter_blobs(filename))
+        if not blobs or blobs[0].type != "OSMHeader":
+            raise ValueError(f"{filename}: not a PBF file (no OSMHeader blob)")
+        self.header_blob = blobs[0]
+        self.data_blobs = [b for b in blobs[1:] if b.type == "OSMData"]
+        self._header = None
+
+    def header_bytes(self):
+        if self._header is None:
+            with open(self.filename, "rb") as f:
+                f.seek(self.header_blob.offset)
+                self._header = f.read(self.header_blob.size)
+        return self._header
+
+    def size(self, blobs=None):
+        return sum(b.size for b in (self.data_blobs if blobs is None else blobs))
+
+    def split(self, parts):
+        """Split the data blobs into at most `parts` consecutive ranges of similar size."""
+        total = self.size()
+        ranges = []
+        current = []
+        current_size = 0
+        for blob in self.data_blobs:
+            current.append(blob)
+            current_size += blob.size
+            if current_size * parts >= total * (len(ranges) + 1) and len(ranges) < parts - 1:
+                ranges.append(current)
+                current = []
+        if current:
+            ranges.append(current)
+        return ranges
+
+    def iter_buffers(self, blobs=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Yield (blobs, FileBuffer) pairs covering `blobs` (default: all data blobs).
+
+        Blobs adjacent in the file are grouped into chunks of about `chunk_size`
+        bytes, each prefixed with the header blob so osmium reads it as a PBF file.
+        """
+        if blobs is None:
+            blobs = self.data_blobs
+        header = self.header_bytes()
+        with open(self.filename, "rb") as f:
+            start = 0
+            while start < len(blobs):
+                end = start + 1
+                size = blobs[start].size
+                while (end < len(blobs) and size + blobs[end].size <= chunk_size
+                       and blobs[end].offset == blobs[end - 1].offset + blobs[end - 1].size):
+                    size += blobs[end].size
+                    end += 1
+                f.seek(blobs[start].offset)
+                data = f.read(blobs[end - 1].offset + blobs[end - 1].size - blobs[start].offset)
+                yield blobs[start:end], osmium.io.FileBuffer(header + data, "pbf")
+                start = end
@@ -0,0 +1,218 @@
+"""
+Stage graph of the osmium-tool challenge scripts.
+
+01-museum-no-fee.sh and 02-museum-no-website.sh both extract
+nw/tourism=museum from the full input before refining it, and every
+script wipes tmp/ when it ends, so the workflow scanned the extract once
+per script, one script after another. Here each challenge is declared as
+a chain of stages (filter, refine, export), every stage being one
+osmium-tool command:
+
+- a stage is identified by its command, its arguments and the stages it
+  reads (`Stage.key`), so identical stages declared by several challenges
+  are planned, and run, only once: the museum extraction feeds both
+  museum challenges
+- intermediate files are named after their key in the temporary
+  directory and counted by the stages still to read them; a file is
+  deleted as soon as its last reader is done instead of at the end
+- stages whose inputs are ready run concurrently, each osmium process
+  in a worker thread, the stages heading the longest chains first
+
+Outputs are the same as the scripts'.
+"""
+
+import hashlib
+import logging
+import os
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+OSMIUM = "osmium"
+
+
+class Stage:
+    """One osmium-tool command reading the input file or the output of other stages.
+
+    `inputs` are Stage objects or file names. `output` is the file of a
+    final stage; intermediate stages write to `<name>-<key>.osm` in the
+    temporary directory of the run.
+    """
+
+    def __init__(self, name, command, inputs, args=(), options=(), output=None):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.args = list(args)
+        self.options = list(options)
+        self.output = output
+        parts = [command, *self.options, *self.args, output or ""]
+        parts += [i.key if isinstance(i, Stage) else os.path.abspath(i) for i in self.inputs]
+        self.key = hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, {self.key})"
+
+    @property
+    def stages(self):
+        """Stages this one reads the output of."""
+        return [i for i in self.inputs if isinstance(i, Stage)]
+
+    def filename(self, tmp_dir):
+        return self.output or os.path.join(tmp_dir, f"{self.name}-{self.key}.osm")
+
+    def argv(self, tmp_dir):
+        inputs = [i.filename(tmp_dir) if isinstance(i, Stage) else i for i in self.inputs]
+        return [OSMIUM, self.command, *inputs, *self.options, "-O",
+                "-o", self.filename(tmp_dir), *self.args]
+
+
+def tags_filter(name, source, *expressions, options=()):
+    """`osmium tags-filter` stage: keep (or with "-i", drop) the objects matching `expressions`."""
+    return Stage(name, "tags-filter", [source], expressions, options)
+
+
+def export(name, source, conf, output):
+    """`osmium export` stage writing the final GeoJSON of a challenge."""
+    return Stage(name, "export", [source], options=["-c", conf], output=output)
+
+
+def challenge_stages(input_file, output_dir, conf_dir="conf"):
+    """Final stage of each challenge of the shell scripts, by challenge name."""
+    def out(name):
+        return os.path.join(output_dir, f"{name}.geojson")
+
+    def conf(name):
+        return os.path.join(conf_dir, f"{name}.conf")
+
+    museum = tags_filter("museum", input_file, "nw/tourism=museum", options=["-R"])
+    oneway = tags_filter("oneway", input_file, "w/oneway", options=["-t"])
+    place_of_worship = tags_filter("place_of_worship", input_file, "amenity=place_of_worship",
+                                   options=["-R"])
+    shop = tags_filter("shop-no-category", input_file, "n/shop=yes", options=["-t"])
+    return {
+        "museum-no-fee": export(
+            "museum-no-fee",
+            tags_filter("museum-no-fee", museum, "fee", options=["-i"]),
+            conf("museum"), out("museum-no-fee")),
+        "museum-no-website": export(
+            "museum-no-website",
+            tags_filter("museum-no-website", museum, "website", "contact:website", options=["-i"]),
+            conf("museum"), out("museum-no-website")),
+        "oneway-discouraged-values": export(
+            "oneway-discouraged-values",
+            tags_filter("oneway-discouraged-values", oneway, "oneway=yes", "oneway=no",
+                        "oneway=-1", "oneway=reversible", "oneway=alternating",
+                        options=["-t", "-i"]),
+            conf("oneway"), out("oneway-discouraged-values")),
+        "place_of_worship-no-religion": export(
+            "place_of_worship-no-religion",
+            tags_filter("place_of_worship-no-religion", place_of_worship, "religion",
+                        options=["-i"]),
+            conf("place-of-worship"), out("place_of_worship-no-religion")),
+        "shop-no-category": export(
+            "shop-no-category", shop, conf("shop"), out("shop-no-category")),
+    }
+
+
+def plan(targets):
+    """Distinct stages needed for `targets`, every stage after the stages it reads."""
+    ordered = {}
+
+    def visit(stage):
+        if stage.key in ordered:
+            return
+        for dependency in stage.stages:
+            visit(dependency)
+        ordered[stage.key] = stage
+
+    for stage in targets:
+        visit(stage)
+    return list(ordered.values())
+
+
+def _run_stage(stage, tmp_dir):
+    t0 = time.perf_counter()
+    argv = stage.argv(tmp_dir)
+    logging.info(f"[{stage.name}] {' '.join(argv)}")
+    subprocess.run(argv, check=True)
+    return time.perf_counter() - t0
+
+
+class Pipeline:
+    """Run the stages of several challenges, sharing identical stages."""
+
+    def __init__(self, targets, tmp_dir="tmp", jobs=None, keep=False):
+        self.stages = plan(targets)
+        self.tmp_dir = tmp_dir
+        self.jobs = jobs or os.cpu_count() or 1
+        self.keep = keep
+        # readers left for each intermediate output
+        self.readers = Counter(d.key for stage in self.stages for d in stage.stages)
+        # longest chain of stages from each stage to a final one: started first when ready
+        self.depth = {}
+        for stage in reversed(self.stages):
+            self.depth.setdefault(stage.key, 1)
+            for dependency in stage.stages:
+                self.depth[dependency.key] = max(self.depth.get(dependency.key, 1),
+                                                 self.depth[stage.key] + 1)
+
+    def describe(self):
+        declared = sum(len(stage.stages) for stage in self.stages)
+        shared = sum(1 for count in self.readers.values() if count > 1)
+        lines = [f"{len(self.stages)} stages, {shared} intermediate output(s) read "
+                 f"by several stages ({declared} reads)"]
+        for stage in self.stages:
+            inputs = ", ".join(i.name if isinstance(i, Stage) else i for i in stage.inputs)
+            readers = self.readers[stage.key]
+            lines.append(f"  {stage.name:<32} {stage.command:<12} <- {inputs}"
+                         + (f" ({readers} readers)" if readers > 1 else ""))
+        return "\n".join(lines)
+
+    def _release(self, stage):
+        """A stage is done with its inputs: delete those nobody else reads."""
+        for dependency in stage.stages:
+            self.readers[dependency.key] -= 1
+            if self.readers[dependency.key] == 0 and not self.keep:
+                filename = dependency.filename(self.tmp_dir)
+                if os.path.exists(filename):
+                    os.remove(filename)
+                logging.debug(f"Removed {filename}")
+
+    def run(self):
+        """Run every stage, as many at once as `jobs`; raise on the first failure."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        for stage in self.stages:
+            if stage.output and os.path.dirname(stage.output):
+                os.makedirs(os.path.dirname(stage.output), exist_ok=True)
+        waiting = list(self.stages)
+        done = set()
+        running = {}
+        failed = None
+        timings = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while (waiting and failed is None) or running:
+                if failed is None:
+                    ready = [s for s in waiting if all(d.key in done for d in s.stages)]
+                    ready.sort(key=lambda s: -self.depth[s.key])
+                    for stage in ready[:self.jobs - len(running)]:
+                        waiting.remove(stage)
+                        running[pool.submit(_run_stage, stage, self.tmp_dir)] = stage
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        timings[stage.name] = future.result()
+                    except (OSError, subprocess.CalledProcessError) as e:
+                        logging.error(f"[{stage.name}] failed: {e}")
+                        failed = failed or stage
+                        continue
+                    done.add(stage.key)
+                    self._release(stage)
+                    logging.info(f"[{stage.name}] done in {timings[stage.name]:.2f}s")
+        if failed is not None:
+            raise RuntimeError(f"Stage {failed.name} failed, "
+                               f"{len(waiting)} stage(s) not run")
+        return timings
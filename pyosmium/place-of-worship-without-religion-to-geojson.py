@@ -9,17 +9,32 @@ This script store place of worship without relegion in a osm file.
 6. Merge selection to new layer(Ctrl+Shift+M)
 7. save the new layer as geojson
 
+With an output ending in .geojson (or .geojsonseq, .gz/.zst compressed or
+not), MapRoulette-ready GeoJSON is written directly and the JOSM steps
+above are not needed.
+
 Stats for planet-220818.osm.pbf
 -Ways found: 36224
 -Program ended in 01:18:40.64
 
 """
+import contextlib
+import logging
 import os
 import osmium
 import sys
 import getopt
 import time
 
+from geojson import is_geojson, open_writer
+from memory import MemoryMonitor, location_index, parse_size
+from profiling import PROFILE_MODES, profile_apply
+from progress import Progress
+
+# osmium export config used when writing GeoJSON
+CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "conf",
+                    "place-of-worship.conf")
+
 
 class PlaceOfWorshipWithoutReligion(osmium.SimpleHandler):
 
@@ -28,6 +43,8 @@ class PlaceOfWorshipWithoutReligion(osmium.SimpleHandler):
         self.writer = writer  # osmium writer
         self.nbWay = 0  # counter ways
         self.nbNode = 0  # counter nodes
+        self.progress = Progress(text=lambda: "Nodes found: %i - Ways found: %i" %
+                                 (self.nbNode, self.nbWay))
 
     def isConcerned(self, obj):
         return obj.tags.get('amenity') == 'place_of_worship' and 'religion' not in obj.tags
@@ -41,9 +58,7 @@ class PlaceOfWorshipWithoutReligion(osmium.SimpleHandler):
         # all filter passed, adding the parking_space to osm file
         self.nbNode += 1  # increment counter
         self.writer.add_node(n)
-        sys.stdout.write("\rNodes found: %i - Ways found: %i" %
-                         (self.nbNode, self.nbWay))
-        sys.stdout.flush()
+        self.progress.update()
 
     # osmium way handler
     def way(self, w):
@@ -54,39 +69,58 @@ class PlaceOfWorshipWithoutReligion(osmium.SimpleHandler):
         # all filter passed, adding the parking_space to osm file
         self.nbWay += 1  # increment counter
         self.writer.add_way(w)
-        sys.stdout.write("\rNodes found: %i - Ways found: %i" %
-                         (self.nbNode, self.nbWay))
-        sys.stdout.flush()
+        self.progress.update()
 
 
 def print_help():
-    print("Usage: python %s -i <osmfile> -o <output.geojson>" % sys.argv[0])
+    print("Usage: python %s -i <osmfile> -o <output.geojson> [--profile <mode>] "
+          "[--memory-budget <size>]" % sys.argv[0])
     print("")
     print("Read the <osmfile> in input. Find place of worship without religion. Write a geojson file.")
     print("Use this geojson to create a MapRoulette challenge.")
     print("")
     print("  -i <input osm file> such as planet.osm.pbf. All file supported by osmium should work")
-    print("  -o <output filename.geojson>. A file to write the Overpass query inside")
+    print("  -o <output filename>. .osm (or any osmium format), or .geojson/.geojsonseq (optionally "
+          ".gz/.zst) for MapRoulette")
+    print("  --profile <%s>. Report where the processing time goes (see profiling.py)" %
+          "|".join(PROFILE_MODES))
+    print("  --memory-budget <size>, e.g. 6G. Pick an in-memory or file-backed node location index "
+          "and report the peak memory")
     print("", flush=True)
     exit()
 
 
-def main(input, output):
+def main(input, output, profile=None, memoryBudget=None):
     try:
         start = time.time()
         if os.path.exists(output):
             print("Delete file %s" % output)
             os.remove(output)
         print("Initialize writer", flush=True)
-        writer = osmium.SimpleWriter(output)
+        writer = open_writer(output, CONF)
         print("Initialize handler", flush=True)
         handler = PlaceOfWorshipWithoutReligion(writer)
         print("Start handler...", flush=True)
-        handler.apply_file(input, locations=False)
+        # only amenity=place_of_worship objects reach the Python callbacks
+        # GeoJSON geometries of ways need the node locations
+        locations = is_geojson(output)
+        filters = [osmium.filter.TagFilter(('amenity', 'place_of_worship'))]
+        # with a budget, node locations may go to a file-backed index and the
+        # memory is sampled for the report (see memory.py)
+        monitor = MemoryMonitor(memoryBudget) if memoryBudget else None
+        stage = monitor.stage("read") if monitor is not None else contextlib.nullcontext()
+        with location_index(input, memoryBudget if locations else None) as idx, \
+                monitor or contextlib.nullcontext(), stage:
+            if profile:
+                profile_apply(handler, input, profile, ["isConcerned"], locations, filters, idx)
+            else:
+                handler.apply_file(input, locations=locations, idx=idx, filters=filters)
         writer.close()
+        handler.progress.finish()
+        if monitor is not None:
+            monitor.log_report()
         del handler
         del writer
-        print()
         end = time.time()
         hours, rem = divmod(end-start, 3600)
         minutes, seconds = divmod(rem, 60)
@@ -97,21 +131,32 @@ def main(input, output):
 
 
 if __name__ == '__main__':
+    # the profiling and memory reports are logged
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
     nbArgs = len(sys.argv)
-    if nbArgs != 3 and nbArgs != 5:
+    if nbArgs < 3:
         print_help()
 
     # default arguments values
     input = ""
     output = "out/place-of-worship.osm"
+    profile = None
+    memoryBudget = None
 
     # parse arguments
-    opts, args = getopt.getopt(sys.argv[1:], "i:o", ["input =", "output ="])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:",
+                               ["input =", "output =", "profile=", "memory-budget="])
     for k, v in opts:
         if k == "-i":
             input = v
         if k == "-o":
             output = v
+        if k == "--profile":
+            if v not in PROFILE_MODES:
+                print_help()
+            profile = v
+        if k == "--memory-budget":
+            memoryBudget = parse_size(v)
 
     print("Args: input=%s ; output=%s" % (input, output), flush=True)
 
@@ -121,5 +166,5 @@ if __name__ == '__main__':
     if output == "":
         print_help()
 
-    main(input, output)
+    main(input, output, profile, memoryBudget)
     exit()
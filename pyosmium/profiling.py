@@ -0,0 +1,266 @@
+"""
+Profiling of the processing loop of the detectors.
+
+Detectors with the same logic can differ by an order of magnitude on the
+planet. `--profile` splits the processing time of a run into:
+
+- I/O: a raw read of the input file
+- decoding: a pass of the same reader, filters and node location index
+  without any Python callback (decompression, parsing, filtering)
+- callback dispatch: what the real pass takes on top of that baseline
+  outside the callbacks themselves (calls from C++ into Python and the
+  object proxies built for them)
+- tag checks and writer output: time spent in the tag check methods and in
+  the writer, whose calls are wrapped with counters
+- the rest of the callbacks' own time
+
+The counters cost two perf_counter calls per wrapped call, and the
+baseline passes read the input again, which is why profiling is opt-in.
+With `cprofile`, the processing loop also runs under cProfile; with
+`sample`, the stack of the loop is recorded every few milliseconds of CPU
+time, a much lower overhead than cProfile. Either way, the hottest
+functions are reported.
+
+Python signal handlers only run between bytecodes, so a sample falling
+in osmium code is counted in the next Python function called (usually a
+callback) or in the apply_file caller: the decoding baseline is what
+measures the time spent in osmium itself.
+"""
+
+import cProfile
+import io
+import logging
+import pstats
+import signal
+import time
+from collections import Counter
+
+import osmium
+
+
+PROFILE_MODES = ["counters", "cprofile", "sample"]
+
+CALLBACKS = ["node", "way", "relation", "area"]
+
+SAMPLE_INTERVAL = 0.005
+
+READ_SIZE = 8 * 1024 * 1024
+
+
+# ---------------------------------------------------------------------------
+# Counters
+# ---------------------------------------------------------------------------
+
+class CallCounters:
+    """Number of calls and time spent per label, for wrapped callables."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.time = Counter()
+
+    def timed(self, func, label):
+        calls = self.calls
+        spent = self.time
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            t0 = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                spent[label] += clock() - t0
+                calls[label] += 1
+
+        return wrapper
+
+    def wrap(self, obj, name, label):
+        """Replace the method `name` of `obj` (when it has one) with a timed version."""
+        method = getattr(obj, name, None)
+        if method is not None:
+            setattr(obj, name, self.timed(method, label))
+
+
+class TimedProxy:
+    """Time the method calls of objects which can not be patched (osmium writers)."""
+
+    def __init__(self, target, counters, label):
+        self._target = target
+        self._counters = counters
+        self._label = label
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if callable(attr):
+            attr = self._counters.timed(attr, self._label)
+            # looked up once: later calls do not go through __getattr__
+            setattr(self, name, attr)
+        return attr
+
+
+def profile_handler(handler, tag_checks=(), writer_attr="writer"):
+    """Wrap the callbacks, tag checks and writer of a SimpleHandler with counters."""
+    counters = CallCounters()
+    for name in CALLBACKS:
+        counters.wrap(handler, name, f"callback {name}")
+    for name in tag_checks:
+        counters.wrap(handler, name, "tag checks")
+    writer = getattr(handler, writer_attr, None)
+    if writer is not None:
+        setattr(handler, writer_attr, TimedProxy(writer, counters, "writer output"))
+    return counters
+
+
+# ---------------------------------------------------------------------------
+# Baselines
+# ---------------------------------------------------------------------------
+
+def read_time(filename):
+    """Seconds taken by a raw read of `filename`."""
+    t0 = time.perf_counter()
+    with open(filename, "rb") as f:
+        while f.read(READ_SIZE):
+            pass
+    return time.perf_counter() - t0
+
+
+def decode_time(filename, entities, filters=(), locations=False, idx="flex_mem"):
+    """Seconds taken by osmium to read `filename` with no Python callback."""
+    t0 = time.perf_counter()
+    handlers = list(filters)
+    if locations:
+        handlers.insert(0, osmium.NodeLocationsForWays(osmium.index.create_map(idx)))
+    reader = osmium.io.Reader(filename, entities)
+    try:
+        osmium.apply(reader, *handlers)
+    finally:
+        reader.close()
+    return time.perf_counter() - t0
+
+
+def handler_entities(handler):
+    """Entity types a SimpleHandler reads, from the callbacks it defines."""
+    entities = osmium.osm.NOTHING
+    for name, bits in (("node", osmium.osm.NODE), ("way", osmium.osm.WAY),
+                       ("relation", osmium.osm.RELATION), ("area", osmium.osm.ALL)):
+        if hasattr(handler, name):
+            entities |= bits
+    return entities
+
+
+# ---------------------------------------------------------------------------
+# Samplers
+# ---------------------------------------------------------------------------
+
+class StackSampler:
+    """Statistical profiler: record the stack of the main thread on a CPU timer.
+
+    SIGPROF is delivered every `interval` seconds of CPU time of the process;
+    its handler runs in the main thread and receives the current frame.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.own = Counter()
+        self.total = Counter()
+        self.samples = 0
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        self.samples += 1
+        self.own[_location(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            location = _location(frame.f_code)
+            if location not in seen:
+                seen.add(location)
+                self.total[location] += 1
+            frame = frame.f_back
+
+    def __enter__(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+    def report(self, top=20):
+        lines = [f"{self.samples:,} samples every {self.interval * 1000:.0f} ms of CPU time",
+                 f"{'own %':>7} {'total %':>8}  function"]
+        samples = self.samples or 1
+        for location, count in self.own.most_common(top):
+            lines.append(f"{100 * count / samples:7.1f} {100 * self.total[location] / samples:8.1f}"
+                         f"  {location}")
+        return "\n".join(lines)
+
+
+def _location(code):
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+def run_profiled(run, mode="counters", top=20):
+    """Call `run()` under the profiler of `mode`; return its duration and the profiler report."""
+    report = None
+    t0 = time.perf_counter()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        elapsed = time.perf_counter() - t0
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("tottime").print_stats(top)
+        report = out.getvalue().strip()
+    elif mode == "sample":
+        with StackSampler() as sampler:
+            run()
+        elapsed = time.perf_counter() - t0
+        report = sampler.report(top)
+    else:
+        run()
+        elapsed = time.perf_counter() - t0
+    return elapsed, report
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def breakdown(elapsed, counters, io_time, decode):
+    """Split the `elapsed` seconds of the processing loop into (part, seconds) pairs."""
+    callbacks = sum(t for label, t in counters.time.items() if label.startswith("callback "))
+    tags = counters.time["tag checks"]
+    writer = counters.time["writer output"]
+    return [
+        ("I/O", io_time),
+        ("decoding", max(decode - io_time, 0.0)),
+        ("callback dispatch", max(elapsed - decode - callbacks, 0.0)),
+        ("tag checks", tags),
+        ("writer output", writer),
+        ("other callback code", max(callbacks - tags - writer, 0.0)),
+    ]
+
+
+def log_report(elapsed, counters, io_time, decode, profiler_report=None):
+    logging.info(f"Profile of the processing loop ({elapsed:.2f}s):")
+    for part, seconds in breakdown(elapsed, counters, io_time, decode):
+        logging.info(f"  {part:<20} {seconds:10.2f}s {100 * seconds / (elapsed or 1e-9):6.1f}%")
+    for label in sorted(counters.calls):
+        calls = counters.calls[label]
+        spent = counters.time[label]
+        logging.info(f"  {label:<20} {calls:12,} calls {spent / (calls or 1) * 1e6:8.2f} µs/call")
+    if profiler_report:
+        logging.info("Hottest functions:\n" + profiler_report)
+
+
+def profile_apply(handler, filename, mode="counters", tag_checks=(), locations=False, filters=(),
+                  idx="flex_mem"):
+    """Run `handler.apply_file` with profiling and log where the time went."""
+    entities = handler_entities(handler)
+    logging.info("Profiling: timing a raw read and a pass without callbacks...")
+    io_time = read_time(filename)
+    decode = decode_time(filename, entities, filters, locations, idx)
+    counters = profile_handler(handler, tag_checks)
+    elapsed, report = run_profiled(
+        lambda: handler.apply_file(filename, locations=locations, idx=idx,
+                                   filters=list(filters)), mode)
+    log_report(elapsed, counters, io_time, decode, report)
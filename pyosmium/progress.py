@@ -0,0 +1,187 @@
+"""
+Rate-limited progress display and run metrics.
+
+Printing and flushing a progress line on every match costs a syscall per
+match. `Progress` redraws the line at most a few times per second instead.
+`Metrics` holds the counters of a run (objects, bytes read, matches and
+callback time per rule, time of the later stages, peak memory) and writes
+them as a JSON or Prometheus textfile report at the end, so runs can be
+compared month after month. With a MemoryMonitor (see memory.py), the
+report also has the peak memory of each stage.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def peak_rss():
+    """Peak resident memory in bytes of this process and its finished children."""
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Metrics:
+    """Counters collected during a run."""
+
+    def __init__(self, input_file=None, total_bytes=None):
+        self.input_file = input_file
+        self.total_bytes = total_bytes
+        self.start = time.time()
+        self.end = None
+        self.objects = 0
+        self.bytes_read = 0
+        self.matches = {}
+        self.rule_time = {}
+        self.stage_time = {}
+        self.stage_memory = {}
+
+    def add_rule(self, name):
+        self.matches.setdefault(name, 0)
+        self.rule_time.setdefault(name, 0.0)
+
+    def add_stage(self, name, seconds):
+        self.stage_time[name] = self.stage_time.get(name, 0.0) + seconds
+
+    def add_stage_memory(self, name, peak_rss_bytes, peak_traced_bytes=None):
+        """Peak memory of a stage (see memory.py), the Python allocations when traced."""
+        self.stage_memory[name] = {"peak_rss_bytes": peak_rss_bytes}
+        if peak_traced_bytes is not None:
+            self.stage_memory[name]["peak_traced_bytes"] = peak_traced_bytes
+
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def stop(self):
+        self.end = time.time()
+
+    def as_dict(self):
+        elapsed = self.elapsed() or 1e-9
+        stages = {name: {"time_s": round(t, 3)} for name, t in self.stage_time.items()}
+        for name, memory in self.stage_memory.items():
+            stages.setdefault(name, {}).update(memory)
+        return {
+            "input": self.input_file,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.start)),
+            "wall_time_s": round(self.elapsed(), 3),
+            "objects": self.objects,
+            "objects_per_s": round(self.objects / elapsed, 1),
+            "bytes_read": self.bytes_read,
+            "bytes_per_s": round(self.bytes_read / elapsed, 1),
+            "peak_rss_bytes": peak_rss(),
+            "stages": stages,
+            "rules": {
+                name: {
+                    "matches": self.matches[name],
+                    "callback_time_s": round(self.rule_time.get(name, 0.0), 3),
+                }
+                for name in self.matches
+            },
+        }
+
+    def write(self, filename):
+        """Write the report: Prometheus textfile for *.prom, JSON otherwise."""
+        tmp = filename + ".tmp"
+        with open(tmp, "w") as f:
+            if filename.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.as_dict(), f, indent=2)
+                f.write("\n")
+        os.replace(tmp, filename)
+
+    def to_prometheus(self, prefix="mr_challenges"):
+        data = self.as_dict()
+        lines = []
+
+        def metric(name, help_text, values):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in values:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        metric("wall_time_seconds", "Duration of the run.", [("", data["wall_time_s"])])
+        metric("objects", "Objects handed to the rules.", [("", data["objects"])])
+        metric("objects_per_second", "Objects handed to the rules per second.",
+               [("", data["objects_per_s"])])
+        metric("bytes_read", "Bytes of input read.", [("", data["bytes_read"])])
+        metric("bytes_per_second", "Bytes of input read per second.", [("", data["bytes_per_s"])])
+        metric("peak_rss_bytes", "Peak resident memory of the run.", [("", data["peak_rss_bytes"])])
+        metric("stage_seconds", "Time spent in a stage after the main pass.",
+               [(f'{{stage="{name}"}}', s["time_s"]) for name, s in data["stages"].items()
+                if "time_s" in s])
+        if self.stage_memory:
+            metric("stage_peak_rss_bytes", "Peak resident memory during a stage.",
+                   [(f'{{stage="{name}"}}', s["peak_rss_bytes"])
+                    for name, s in data["stages"].items() if "peak_rss_bytes" in s])
+        metric("rule_matches", "Objects matched by a rule.",
+               [(f'{{rule="{name}"}}', r["matches"]) for name, r in data["rules"].items()])
+        metric("rule_callback_seconds", "Time spent evaluating a rule.",
+               [(f'{{rule="{name}"}}', r["callback_time_s"]) for name, r in data["rules"].items()])
+        return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Progress line
+# ---------------------------------------------------------------------------
+
+def _size(nb):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nb < 1024:
+            return f"{nb:.1f} {unit}"
+        nb /= 1024
+    return f"{nb:.1f} TB"
+
+
+class Progress:
+    """Progress line redrawn at most `rate` times per second.
+
+    The line shows `metrics`, or whatever the `text` callable returns.
+    """
+
+    def __init__(self, metrics=None, rate=2.0, enabled=True, stream=None, text=None):
+        self.metrics = metrics
+        self.text = text or self._metrics_text
+        self.interval = 1.0 / rate
+        self.enabled = enabled
+        self.stream = stream or sys.stdout
+        self._next = 0.0
+
+    def update(self):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + self.interval
+        self._draw()
+
+    def finish(self):
+        """Draw the final state and end the line."""
+        if self.enabled:
+            self.stream.write("\r" + self.text() + "\n")
+            self.stream.flush()
+
+    def _draw(self):
+        self.stream.write("\r" + self.text())
+        self.stream.flush()
+
+    def _metrics_text(self):
+        m = self.metrics
+        elapsed = m.elapsed() or 1e-9
+        parts = [f"Objects: {m.objects:,} ({m.objects / elapsed:,.0f}/s)"]
+        if m.bytes_read:
+            read = f"Read: {_size(m.bytes_read)}"
+            if m.total_bytes:
+                read += f" / {_size(m.total_bytes)} ({100 * m.bytes_read / m.total_bytes:.0f}%)"
+            parts.append(read)
+        parts.extend(f"{name}: {count:,}" for name, count in m.matches.items())
+        return "  ".join(parts)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Push the challenge outputs to MapRoulette.
+
+The challenges of CHALLENGE_IDS (challenges.py) are updated concurrently
+over a shared connection pool, each request retried with a backoff:
+
+- rebuild (default): MapRoulette rebuilds each challenge from its remote
+  GeoJSON source, removing the tasks no longer in it
+- tasks: the features of <output-dir>/<rule>.geojson (or .geojsonseq,
+  compressed or not) are pushed as tasks
+  in chunks; with --delta, only the new and modified tasks written by
+  diff-challenges.py (resolved tasks are left to the next rebuild)
+- delta: from the delta.json of diff-challenges.py (--delta), each
+  challenge gets what its delta needs: a rebuild when tasks were
+  resolved (the only way to remove them), its new and modified tasks
+  otherwise, nothing when it did not change
+
+The API key is read from the MR_API_KEY environment variable.
+
+    MR_API_KEY=... python pyosmium/push-challenges.py
+    MR_API_KEY=... python pyosmium/push-challenges.py --mode tasks --delta tmp/delta
+    MR_API_KEY=... python pyosmium/push-challenges.py --mode delta --delta tmp/delta
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from challenges import CHALLENGE_IDS
+from geojson import find_output
+from maproulette import (DEFAULT_CHUNK_SIZE, DEFAULT_CONCURRENCY, DEFAULT_RETRIES, DEFAULT_URL,
+                         MapRouletteClient)
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def task_files(name, output_dir, delta_dir=None):
+    if delta_dir is None:
+        files = [find_output(output_dir, name)]
+    else:
+        files = [os.path.join(delta_dir, f"{name}.{kind}.geojson") for kind in ("new", "modified")]
+    return [f for f in files if f is not None and os.path.exists(f)]
+
+
+async def push_tasks(client, challenge_id, files, chunk_size):
+    sent = 0
+    for filename in files:
+        sent += await client.add_tasks(challenge_id, filename, chunk_size)
+    return sent
+
+
+def delta_actions(names, delta_dir):
+    """"rebuild", "tasks" or None (unchanged) for each challenge, from delta.json."""
+    with open(os.path.join(delta_dir, "delta.json")) as f:
+        summary = json.load(f)
+    actions = {}
+    for name in names:
+        counts = summary.get(name)
+        if counts is None or counts["resolved"]:
+            actions[name] = "rebuild"
+        elif counts["new"] or counts["modified"]:
+            actions[name] = "tasks"
+        else:
+            actions[name] = None
+    return actions
+
+
+async def push_challenges(names, api_key, mode="rebuild", output_dir="out", delta_dir=None,
+                          url=DEFAULT_URL, concurrency=DEFAULT_CONCURRENCY,
+                          chunk_size=DEFAULT_CHUNK_SIZE, retries=DEFAULT_RETRIES):
+    """Update the challenges of `names`, return the number of failures."""
+    if mode == "delta":
+        actions = delta_actions(names, delta_dir)
+    else:
+        actions = {name: mode for name in names}
+    async with MapRouletteClient(api_key, url, concurrency, retries) as client:
+        jobs = {}
+        for name, action in actions.items():
+            challenge_id = CHALLENGE_IDS[name]
+            if action == "rebuild":
+                jobs[name] = client.rebuild(challenge_id)
+            elif action == "tasks":
+                files = task_files(name, output_dir, delta_dir)
+                jobs[name] = push_tasks(client, challenge_id, files, chunk_size)
+            else:
+                logging.info(f"{name} ({challenge_id}): unchanged")
+        results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+        requests = client.requests
+
+    failures = 0
+    for name, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            failures += 1
+            logging.error(f"{name} ({CHALLENGE_IDS[name]}): {result}")
+        elif actions[name] == "rebuild":
+            logging.info(f"{name} ({CHALLENGE_IDS[name]}): rebuild requested")
+        else:
+            logging.info(f"{name} ({CHALLENGE_IDS[name]}): {result:,} tasks pushed")
+    logging.info(f"{requests:,} requests, {failures} challenge(s) failed")
+    return failures
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the MapRoulette challenges or push their tasks."
+    )
+    parser.add_argument("--mode", choices=["rebuild", "tasks", "delta"], default="rebuild",
+                        help="Ask MapRoulette to rebuild the challenges (default), push tasks, "
+                             "or do what the delta of each challenge needs (with --delta)")
+    parser.add_argument("-d", "--output-dir", default="out",
+                        help="Directory holding the <rule>.geojson outputs (tasks mode)")
+    parser.add_argument("--delta",
+                        help="Directory written by diff-challenges.py: push only new and "
+                             "modified tasks (tasks mode)")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of rules to push (default: all with a challenge)")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help=f"MapRoulette server (default: {DEFAULT_URL})")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Maximum concurrent requests (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Tasks per request (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries of a failed request (default: {DEFAULT_RETRIES})")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+    start = time.time()
+
+    api_key = os.environ.get("MR_API_KEY")
+    if not api_key:
+        raise ValueError("The MR_API_KEY environment variable is not set")
+    names = [r for r in args.rules.split(",") if r] or list(CHALLENGE_IDS)
+    unknown = [n for n in names if n not in CHALLENGE_IDS]
+    if unknown:
+        raise KeyError(f"No MapRoulette challenge for: {', '.join(unknown)}")
+
+    if args.mode == "delta" and not args.delta:
+        raise ValueError("--mode delta needs the --delta directory of diff-challenges.py")
+
+    logging.info(f"MapRoulette: {args.url} ({args.mode})")
+    failures = asyncio.run(push_challenges(
+        names, api_key, args.mode, args.output_dir, args.delta, args.url,
+        args.concurrency, args.chunk_size, args.retries))
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
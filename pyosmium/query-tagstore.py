@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Count and list the matches of rules against the tag store of an extract.
+
+Registered rules, or an ad-hoc rule given on the command line, are
+evaluated over the memory-mapped arrays written by build-tagstore.py,
+without reading the extract. Area and length bounds are not checked, so
+measured rules (e.g. big-parking-space) report their candidates.
+
+    python pyosmium/query-tagstore.py -s in/latest.osm.pbf
+    python pyosmium/query-tagstore.py -s in/latest.osm.pbf --tags amenity=parking \\
+        --without fee,access=private --entities w --show 10
+    python pyosmium/query-tagstore.py -s in/latest.osm.pbf -r museum-no-fee --opq tmp
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from blobindex import TYPE_CODES
+from challenges import get_rules
+from overpass import OverpassSink, rule_filter
+from rules import Rule
+from tagstore import load_store
+
+
+TYPE_OF_CODE = {code: t for t, code in TYPE_CODES.items()}
+
+
+def parse_conditions(text):
+    """`k,k=v,k=v1|v2` into a tag condition dict (None: any value)."""
+    conditions = {}
+    for item in text.split(","):
+        if not item:
+            continue
+        key, sep, values = item.partition("=")
+        conditions[key] = values.split("|") if sep else None
+    return conditions
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def query_tagstore(store_path, rules, show=0, opq_dir=None):
+    start = time.time()
+
+    store = load_store(store_path)
+    if store is None:
+        logging.error(f"No tag store for {store_path}, build it with build-tagstore.py")
+        sys.exit(1)
+    logging.info(f"Tag store: {len(store):,} objects, {len(store.tag_rows):,} tags")
+
+    for rule in rules:
+        try:
+            t0 = time.perf_counter()
+            mask = store.match(rule)
+            elapsed = time.perf_counter() - t0
+        except ValueError as e:
+            logging.error(e)
+            continue
+        rows = np.flatnonzero(mask)
+        counts = np.bincount(store.types[rows], minlength=len(TYPE_OF_CODE))
+        by_type = ", ".join(f"{TYPE_OF_CODE[code]}: {count:,}" for code, count in enumerate(counts)
+                            if TYPE_OF_CODE[code] in rule.entities)
+        logging.info(f"{rule.name}: {len(rows):,} matches ({by_type}) in {elapsed:.3f}s")
+        if rule.measured:
+            logging.warning(f"{rule.name}: area and length bounds are not checked, "
+                            f"these are the candidates")
+
+        for row in rows[:show].tolist():
+            obj = f"{TYPE_OF_CODE[int(store.types[row])]}{int(store.ids[row])}"
+            if store.lon is not None and not np.isnan(store.lon[row]):
+                obj += f" @ {store.lon[row]:.7f},{store.lat[row]:.7f}"
+            tags = " ".join(f"{k}={v}" for k, v in store.tags(row).items())
+            logging.info(f"  {obj}  {tags}")
+
+        if opq_dir:
+            os.makedirs(opq_dir, exist_ok=True)
+            sink = OverpassSink(os.path.join(opq_dir, f"{rule.name}.opq"), footer=rule_filter(rule))
+            for obj_type, obj_id in zip(store.types[rows].tolist(), store.ids[rows].tolist()):
+                sink.add_id(TYPE_OF_CODE[obj_type], obj_id)
+            sink.close()
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Evaluate rules against the tag store of an OSM file."
+    )
+    parser.add_argument("-s", "--store", required=True,
+                        help="OSM/PBF file with a <file>.tags store, or a store directory")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of registered rules (default: all, unless "
+                             "--tags is given)")
+    parser.add_argument("--tags", default="",
+                        help="Required tags of an ad-hoc rule: key, key=value or key=v1|v2, "
+                             "comma separated")
+    parser.add_argument("--without", default="",
+                        help="Forbidden tags of the ad-hoc rule, same syntax as --tags")
+    parser.add_argument("--entities", default="nwr",
+                        help="Entity types of the ad-hoc rule (default: nwr)")
+    parser.add_argument("--min-nodes", type=int, help="Minimum node count of ways (ad-hoc rule)")
+    parser.add_argument("--max-nodes", type=int, help="Maximum node count of ways (ad-hoc rule)")
+    parser.add_argument("--name", default="ad-hoc", help="Name of the ad-hoc rule")
+    parser.add_argument("--show", type=int, default=0,
+                        help="List the first N matches of each rule with their stored tags")
+    parser.add_argument("--opq", help="Directory receiving one <rule>.opq Overpass query per rule")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    rule_names = [r for r in args.rules.split(",") if r]
+    rules = get_rules(rule_names) if rule_names or not args.tags else []
+    if args.tags:
+        rules.append(Rule(args.name, args.entities, parse_conditions(args.tags),
+                          without=parse_conditions(args.without),
+                          min_nodes=args.min_nodes, max_nodes=args.max_nodes))
+    query_tagstore(args.store, rules, show=args.show, opq_dir=args.opq)
+
+
+if __name__ == "__main__":
+    main()
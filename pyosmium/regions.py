@@ -0,0 +1,190 @@
+"""
+Region lookup of challenge features with a prepared grid index.
+
+Boundaries are read from GeoJSON (Polygon/MultiPolygon features, named by
+their `name` property) or osmosis .poly files (named after the file). Each
+feature is assigned to the region containing its point (the location of a
+node, the centroid of the vertices of a way or an area), so per-country
+challenges come out of the same single scan.
+
+Lookups are cheap whatever the number and the size of the boundaries:
+
+- a grid over the boundaries' extent lists, for each cell, the regions
+  whose bounding box touches it, so only a few regions are tested;
+- the edges of each region are bucketed into horizontal bands, so the
+  point-in-polygon ray casting only looks at the edges of one band
+  (in plain Python when the band is small, NumPy otherwise).
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+
+
+# below this number of edges, a Python loop beats NumPy's call overhead
+SMALL_BAND = 64
+
+
+# ---------------------------------------------------------------------------
+# Boundary files
+# ---------------------------------------------------------------------------
+
+def _read_poly(filename):
+    """Rings of an osmosis .poly file (holes are rings too, see Region)."""
+    rings = []
+    with open(filename) as f:
+        lines = [line.strip() for line in f]
+    ring = None
+    for line in lines[1:]:
+        if not line:
+            continue
+        if ring is None:
+            if line == "END":
+                break
+            ring = []
+        elif line == "END":
+            rings.append(np.array(ring, dtype=np.float64))
+            ring = None
+        else:
+            lon, lat = line.split()[:2]
+            ring.append((float(lon), float(lat)))
+    return rings
+
+
+def _geojson_rings(geometry):
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    return [np.array(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+
+def load_regions(filenames):
+    """Regions of a list of .poly and GeoJSON files."""
+    regions = []
+    for filename in filenames:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        if filename.endswith(".poly"):
+            regions.append(Region(stem, _read_poly(filename)))
+            continue
+        with open(filename) as f:
+            data = json.load(f)
+        features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+        for i, feature in enumerate(features):
+            props = feature.get("properties") or {}
+            name = props.get("name") or (stem if len(features) == 1 else f"{stem}-{i}")
+            regions.append(Region(name, _geojson_rings(feature["geometry"])))
+    names = [r.name for r in regions]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate region names in {', '.join(filenames)}")
+    return regions
+
+
+# ---------------------------------------------------------------------------
+# Point in polygon
+# ---------------------------------------------------------------------------
+
+class Region:
+    """Named area made of rings, tested with the even-odd rule.
+
+    Inner rings (holes) and the outer rings of several polygons can all be
+    given as plain rings: a point is inside when a ray crosses an odd
+    number of edges.
+    """
+
+    def __init__(self, name, rings):
+        self.name = name
+        rings = [r if (r[0] == r[-1]).all() else np.vstack([r, r[:1]]) for r in rings if len(r) >= 3]
+        if not rings:
+            raise ValueError(f"Region {name} has no polygon")
+        x1 = np.concatenate([r[:-1, 0] for r in rings])
+        y1 = np.concatenate([r[:-1, 1] for r in rings])
+        x2 = np.concatenate([r[1:, 0] for r in rings])
+        y2 = np.concatenate([r[1:, 1] for r in rings])
+        self.bbox = (min(x1.min(), x2.min()), min(y1.min(), y2.min()),
+                     max(x1.max(), x2.max()), max(y1.max(), y2.max()))
+
+        # bucket the edges into horizontal bands of about sqrt(n) edges
+        self.nb_bands = max(1, int(math.sqrt(len(x1))))
+        ymin, ymax = self.bbox[1], self.bbox[3]
+        self.band_height = (ymax - ymin) / self.nb_bands or 1.0
+        lo = self._band(np.minimum(y1, y2))
+        hi = self._band(np.maximum(y1, y2))
+        counts = hi - lo + 1
+        edge = np.repeat(np.arange(len(x1)), counts)
+        band = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        order = np.argsort(band, kind="stable")
+        edge = edge[order]
+        self.band_start = np.searchsorted(band[order], np.arange(self.nb_bands + 1))
+        self.x1, self.y1, self.x2, self.y2 = x1[edge], y1[edge], x2[edge], y2[edge]
+        self.small = {}
+        for band in range(self.nb_bands):
+            start, end = self.band_start[band], self.band_start[band + 1]
+            if end - start <= SMALL_BAND:
+                self.small[band] = list(zip(self.x1[start:end].tolist(), self.y1[start:end].tolist(),
+                                            self.x2[start:end].tolist(), self.y2[start:end].tolist()))
+
+    def _band(self, y):
+        band = ((y - self.bbox[1]) / self.band_height).astype(np.int64)
+        return np.clip(band, 0, self.nb_bands - 1)
+
+    def contains(self, lon, lat):
+        xmin, ymin, xmax, ymax = self.bbox
+        if not (xmin <= lon <= xmax and ymin <= lat <= ymax):
+            return False
+        band = min(int((lat - ymin) / self.band_height), self.nb_bands - 1)
+        edges = self.small.get(band)
+        if edges is not None:
+            inside = False
+            for x1, y1, x2, y2 in edges:
+                if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+            return inside
+        s = slice(self.band_start[band], self.band_start[band + 1])
+        y1 = self.y1[s]
+        y2 = self.y2[s]
+        crossing = (y1 > lat) != (y2 > lat)
+        if not crossing.any():
+            return False
+        x1 = self.x1[s][crossing]
+        x2 = self.x2[s][crossing]
+        y1 = y1[crossing]
+        y2 = y2[crossing]
+        x = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        return bool(np.count_nonzero(lon < x) % 2)
+
+
+# ---------------------------------------------------------------------------
+# Grid index
+# ---------------------------------------------------------------------------
+
+class RegionIndex:
+    """Regions indexed on a grid of `cell` degrees."""
+
+    def __init__(self, regions, cell=1.0):
+        self.regions = regions
+        self.cell = cell
+        boxes = np.array([r.bbox for r in regions], dtype=np.float64)
+        self.x0 = math.floor(boxes[:, 0].min() / cell) * cell
+        self.y0 = math.floor(boxes[:, 1].min() / cell) * cell
+        self.cells = {}
+        for i, (xmin, ymin, xmax, ymax) in enumerate(boxes):
+            for cx in range(int((xmin - self.x0) // cell), int((xmax - self.x0) // cell) + 1):
+                for cy in range(int((ymin - self.y0) // cell), int((ymax - self.y0) // cell) + 1):
+                    self.cells.setdefault((cx, cy), []).append(regions[i])
+
+    @property
+    def names(self):
+        return [r.name for r in self.regions]
+
+    def lookup(self, lon, lat):
+        """Name of the first region containing the point, None if there is none."""
+        key = (int((lon - self.x0) // self.cell), int((lat - self.y0) // self.cell))
+        for region in self.cells.get(key, ()):
+            if region.contains(lon, lat):
+                return region.name
+        return None
@@ -0,0 +1,238 @@
+"""
+Declarative challenge rules.
+
+A rule states which objects are tasks for a challenge instead of coding it
+in a handler callback:
+
+    Rule("museum-no-fee", "nw", tags={"tourism": "museum"}, without={"fee": None})
+
+The required tags are compiled into osmium key/tag filters and the entity
+types into an entity mask, so objects that cannot match are dropped by
+libosmium and never reach the Python interpreter. Only the remaining
+candidates are checked for forbidden tags and node-count bounds in Python.
+"""
+
+import numpy as np
+import osmium
+from osmium.filter import KeyFilter, TagFilter
+
+
+def entity_bits(entities):
+    """Convert an osmium-tool entity string ("nwr") into osm_entity_bits."""
+    bits = osmium.osm.NOTHING
+    if "n" in entities:
+        bits |= osmium.osm.NODE
+    if "w" in entities:
+        bits |= osmium.osm.WAY
+    if "r" in entities:
+        bits |= osmium.osm.RELATION
+    return bits
+
+
+def _values(value):
+    """Normalise a tag condition: None (any value) or a frozenset of values."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return frozenset([value])
+    return frozenset(value)
+
+
+def matches_value(val, values):
+    """True when a tag value satisfies a condition (None: any value)."""
+    return val is not None and (values is None or val in values)
+
+
+def _column_matches(column, values):
+    """Vectorized matches_value over an object array of tag values."""
+    mask = np.not_equal(column, None)
+    if values is not None:
+        found = np.zeros(len(column), dtype=bool)
+        for value in values:
+            found |= column == value
+        mask &= found
+    return mask
+
+
+class Rule:
+    """A challenge detector described by its tag conditions.
+
+    `entities` uses the osmium-tool notation ("n", "w", "r" or a mix such
+    as "nw"). `tags` lists the required tags and `without` the forbidden
+    ones; both map a key to None (any value), a value or a list of values.
+    `min_nodes` and `max_nodes` bound the number of nodes of ways.
+
+    `min_area`/`max_area` (m²) and `min_length`/`max_length` (m) bound the
+    geometry of ways. They are checked in a batch once the node locations of
+    the candidates are known (see measure.py), not in `match`.
+
+    `regions` lists boundary files (GeoJSON or .poly, see regions.py): the
+    GeoJSON output is then also split into one file per region.
+    """
+
+    def __init__(self, name, entities, tags, without=None,
+                 min_nodes=None, max_nodes=None, min_area=None, max_area=None,
+                 min_length=None, max_length=None, conf=None, regions=None):
+        if not tags:
+            raise ValueError(f"Rule {name} needs at least one required tag")
+        self.min_area = min_area
+        self.max_area = max_area
+        self.min_length = min_length
+        self.max_length = max_length
+        if self.measured and entities != "w":
+            raise ValueError(f"Rule {name}: area and length bounds apply to ways only")
+        self.name = name
+        self.entities = entities
+        self.tags = {k: _values(v) for k, v in tags.items()}
+        self.without = {k: _values(v) for k, v in (without or {}).items()}
+        self.min_nodes = min_nodes
+        self.max_nodes = max_nodes
+        self.conf = conf
+        self.regions = regions
+        self.match = self._compile_match()
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.entities!r})"
+
+    def __getstate__(self):
+        # the compiled matcher is a closure: rebuild it after unpickling
+        state = self.__dict__.copy()
+        del state["match"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.match = self._compile_match()
+
+    def entity_bits(self):
+        return entity_bits(self.entities)
+
+    def definition(self):
+        """Plain, stable description of what the rule selects (see cache.py)."""
+        def conditions(tags):
+            return {k: None if v is None else sorted(v) for k, v in sorted(tags.items())}
+
+        return {
+            "name": self.name,
+            "entities": self.entities,
+            "tags": conditions(self.tags),
+            "without": conditions(self.without),
+            "nodes": [self.min_nodes, self.max_nodes],
+            "area": [self.min_area, self.max_area],
+            "length": [self.min_length, self.max_length],
+        }
+
+    @property
+    def checks_nodes(self):
+        """True when the rule bounds the number of nodes of ways."""
+        return self.min_nodes is not None or self.max_nodes is not None
+
+    @property
+    def measured(self):
+        """True when the rule has bounds on the geometry of its matches."""
+        return any(v is not None for v in (self.min_area, self.max_area,
+                                           self.min_length, self.max_length))
+
+    def check_measures(self, area, length):
+        """Boolean mask of the ways whose area/length arrays satisfy the bounds."""
+        keep = area >= 0
+        if self.min_area is not None:
+            keep &= area >= self.min_area
+        if self.max_area is not None:
+            keep &= area <= self.max_area
+        if self.min_length is not None:
+            keep &= length >= self.min_length
+        if self.max_length is not None:
+            keep &= length <= self.max_length
+        return keep
+
+    def match_columns(self, size, columns, nodes=None):
+        """Vectorized `match` over a batch of `size` objects of one type (see batch.py).
+
+        `columns` maps tag keys to object arrays of values, None where the tag
+        is missing; a key without column is missing everywhere. `nodes` holds
+        the node counts of ways. Only the rows satisfying the required tags
+        need the forbidden keys and node counts.
+        """
+        mask = np.ones(size, dtype=bool)
+        for key, values in self.tags.items():
+            if key not in columns:
+                return np.zeros(size, dtype=bool)
+            mask &= _column_matches(columns[key], values)
+        for key, values in self.without.items():
+            if key in columns:
+                mask &= ~_column_matches(columns[key], values)
+        if nodes is not None:
+            if self.min_nodes is not None:
+                mask &= nodes >= self.min_nodes
+            if self.max_nodes is not None:
+                mask &= nodes <= self.max_nodes
+        return mask
+
+    def filters(self):
+        """osmium filters selecting the candidates of this rule alone."""
+        filters = []
+        for key, values in self.tags.items():
+            if values is None:
+                filters.append(KeyFilter(key))
+            else:
+                filters.append(TagFilter(*((key, v) for v in sorted(values))))
+        return filters
+
+    def _compile_match(self):
+        """Build the matcher: one tag lookup per distinct key, as few as possible.
+
+        Every TagList lookup is a linear scan of the tags behind a call into
+        libosmium, so the conditions are merged per key and the forbidden keys
+        are only looked up when the object has tags besides the required
+        ones. Walking the tags instead is no cheaper: pyosmium builds a Tag
+        object per tag, which costs several lookups.
+        """
+        required = list(self.tags.items())
+        # forbidden values of a required key are checked on the value already read
+        banned = {key: self.without[key] for key in self.tags if key in self.without}
+        forbidden = [(k, v) for k, v in self.without.items() if k not in self.tags]
+        nb_required = len(required)
+        min_nodes = self.min_nodes
+        max_nodes = self.max_nodes
+        check_nodes = self.checks_nodes
+
+        def match(obj):
+            tags = obj.tags
+            get = tags.get
+            for key, values in required:
+                val = get(key)
+                if val is None or (values is not None and val not in values):
+                    return False
+                if key in banned:
+                    values = banned[key]
+                    if values is None or val in values:
+                        return False
+            if check_nodes and obj.type_str() == "w":
+                nb = len(obj.nodes)
+                if min_nodes is not None and nb < min_nodes:
+                    return False
+                if max_nodes is not None and nb > max_nodes:
+                    return False
+            if forbidden and len(tags) > nb_required:
+                for key, values in forbidden:
+                    val = get(key)
+                    if val is not None and (values is None or val in values):
+                        return False
+            return True
+
+        return match
+
+
+def prefilter(rules):
+    """Single osmium filter letting through the candidates of any rule.
+
+    osmium filters can only be chained (AND), so the union is built on the
+    first required tag of every rule: a TagFilter when all of them have
+    fixed values, a KeyFilter on their keys otherwise.
+    """
+    primary = [next(iter(rule.tags.items())) for rule in rules]
+    if all(values is not None for _, values in primary):
+        pairs = sorted({(key, v) for key, values in primary for v in values})
+        return TagFilter(*pairs)
+    return KeyFilter(*sorted({key for key, _ in primary}))
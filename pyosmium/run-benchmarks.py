@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Benchmark the detectors on synthetic OSM files.
+
+`run` generates deterministic synthetic PBFs (see synthetic.py), runs every
+detector script against them and records wall time, objects/s and peak
+RSS of each run in a JSON baseline. `compare` flags the detectors that
+got slower or bigger than a previous baseline. `match` times the compiled
+matcher of every rule per candidate object against one tag lookup per
+condition, the pattern of the standalone handlers. `serve` serves a file
+over HTTP at a throttled rate, standing in for Geofabrik to try the
+streaming mode of run-challenges.py (--url). Everything runs offline.
+
+    python pyosmium/run-benchmarks.py run -o bench.json
+    python pyosmium/run-benchmarks.py compare bench-old.json bench.json
+    python pyosmium/run-benchmarks.py match -i tmp/bench/synthetic-small.osm.pbf
+    python pyosmium/run-benchmarks.py serve tmp/bench/synthetic-large.osm.pbf --rate 2
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import osmium
+import osmium.version
+
+from challenges import get_rules
+from synthetic import generate
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> command, {input} and {out} (a scratch directory) are substituted
+DETECTORS = {
+    "run-challenges": [
+        "pyosmium/run-challenges.py", "-i", "{input}", "-d", "{out}", "--no-progress"],
+    "run-challenges-geojson": [
+        "pyosmium/run-challenges.py", "-i", "{input}", "-d", "{out}", "-f", "geojson",
+        "--no-progress"],
+    "museum-without-fee": [
+        "pyosmium/museum-without-fee.py", "-i", "{input}", "-o", "{out}/museum-no-fee.osm",
+        "--no-progress"],
+    "museum-without-website": [
+        "pyosmium/museum-without-website.py", "-i", "{input}", "-o", "{out}/museum-no-website.osm"],
+    "place-of-worship-without-religion": [
+        "pyosmium/place-of-worship-without-religion-to-geojson.py", "-i", "{input}",
+        "-o", "{out}/place-of-worship.osm"],
+    "discouraged-oneway-values": [
+        "pyosmium/discouraged-oneway-values.py", "{input}"],
+    "big-parking-space-to-osm": [
+        "big-parking-space-to-osm.py", "-i", "{input}", "-o", "{out}/big-parking-space.osm"],
+    "big-parking-space-to-opq": [
+        "big-parking-space-to-opq.py", "-i", "{input}", "-o", "{out}/big-parking-space.opq"],
+    "parking-surface-to-osm": [
+        "parking-surface-to-osm.py", "-i", "{input}", "-o", "{out}/parking-surface.osm"],
+}
+
+# name -> generate() arguments
+DATASETS = {
+    "small": {"nodes": 200000, "ways": 20000, "relations": 200, "density": 0.05},
+    "large": {"nodes": 2000000, "ways": 200000, "relations": 2000, "density": 0.05},
+}
+
+
+# ---------------------------------------------------------------------------
+# Run
+# ---------------------------------------------------------------------------
+
+def run_detector(command, input_file, scratch):
+    """Run a detector, return (wall time in s, peak RSS in bytes)."""
+    script, *options = command
+    args = [sys.executable, os.path.join(ROOT, script)]
+    args += [a.format(input=os.path.abspath(input_file), out=scratch) for a in options]
+    with open(os.path.join(scratch, "stdout.txt"), "w") as stdout:
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=scratch, stdout=stdout, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f"{' '.join(args)} failed, see {scratch}/stdout.txt")
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return elapsed, rss
+
+
+def run_benchmarks(output, datasets, detectors, data_dir, repeat=3):
+    os.makedirs(data_dir, exist_ok=True)
+    report = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "osmium": osmium.version.pyosmium_release,
+        "machine": platform.machine(),
+        "datasets": {},
+        "results": {},
+    }
+    for name in datasets:
+        params = DATASETS[name]
+        input_file = os.path.join(data_dir, f"synthetic-{name}.osm.pbf")
+        logging.info(f"Generating {input_file} {params}")
+        # in a worker: Linux keeps the peak RSS of the benchmark process in
+        # the detectors it forks, so it has to stay small
+        with multiprocessing.Pool(1) as pool:
+            nodes, ways, relations = pool.apply(generate, (input_file,), params)
+        objects = nodes + ways + relations
+        report["datasets"][name] = dict(params, objects=objects, bytes=os.path.getsize(input_file))
+
+        for detector in detectors:
+            runs = []
+            for _ in range(repeat):
+                with tempfile.TemporaryDirectory(prefix="bench-") as scratch:
+                    runs.append(run_detector(DETECTORS[detector], input_file, scratch))
+            wall = min(r[0] for r in runs)
+            rss = max(r[1] for r in runs)
+            key = f"{detector}@{name}"
+            report["results"][key] = {
+                "wall_time_s": round(wall, 3),
+                "objects_per_s": round(objects / wall, 1),
+                "peak_rss_bytes": rss,
+            }
+            logging.info(f"{key}: {wall:.2f}s, {objects / wall:,.0f} objects/s, "
+                         f"{rss / 1024 ** 2:,.0f} MB")
+
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    logging.info(f"Baseline written to {output}")
+
+
+# ---------------------------------------------------------------------------
+# Compare
+# ---------------------------------------------------------------------------
+
+def compare(baseline_file, current_file, tolerance=0.15):
+    """Log the changes between two baselines, return the number of regressions."""
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+    with open(current_file) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        for metric, worse_when_higher in (("wall_time_s", True), ("peak_rss_bytes", True),
+                                          ("objects_per_s", False)):
+            old = baseline[key][metric]
+            new = current[key][metric]
+            change = (new - old) / old if old else 0.0
+            regressed = change > tolerance if worse_when_higher else change < -tolerance
+            if regressed:
+                regressions += 1
+                logging.warning(f"{key} {metric}: {old:,} -> {new:,} ({change:+.0%})")
+            else:
+                logging.info(f"{key} {metric}: {old:,} -> {new:,} ({change:+.0%})")
+    for key in sorted(set(baseline) ^ set(current)):
+        logging.info(f"{key}: only in {'baseline' if key in baseline else 'current run'}")
+    logging.info(f"{regressions} regression(s) above {tolerance:.0%}")
+    return regressions
+
+
+# ---------------------------------------------------------------------------
+# Match
+# ---------------------------------------------------------------------------
+
+def lookup_match(rule):
+    """Matcher doing one TagList lookup per condition, as the handlers do."""
+    def match(obj):
+        tags = obj.tags
+        for key, values in rule.tags.items():
+            if key not in tags or (values is not None and tags.get(key) not in values):
+                return False
+        for key, values in rule.without.items():
+            if key in tags and (values is None or tags.get(key) in values):
+                return False
+        if obj.type_str() == "w":
+            if rule.min_nodes is not None and len(obj.nodes) < rule.min_nodes:
+                return False
+            if rule.max_nodes is not None and len(obj.nodes) > rule.max_nodes:
+                return False
+        return True
+
+    return match
+
+
+def match_benchmark(input_file, rule_names=None, repeat=10):
+    """Log the cost per candidate of both matchers of every rule, in ns."""
+    clock = time.perf_counter
+    for rule in get_rules(rule_names):
+        reference = lookup_match(rule)
+        compiled = rule.match
+        candidates = 0
+        found = 0
+        spent = [0.0, 0.0]
+        processor = osmium.FileProcessor(input_file, rule.entity_bits())
+        for f in rule.filters():
+            processor.with_filter(f)
+        for obj in processor:
+            # objects only live during the iteration: time them on the spot
+            t0 = clock()
+            for _ in range(repeat):
+                expected = reference(obj)
+            t1 = clock()
+            for _ in range(repeat):
+                result = compiled(obj)
+            t2 = clock()
+            if result != expected:
+                raise AssertionError(f"{rule.name}: matchers disagree on {obj.type_str()}{obj.id}")
+            spent[0] += t1 - t0
+            spent[1] += t2 - t1
+            candidates += 1
+            found += result
+        if not candidates:
+            logging.info(f"{rule.name}: no candidates")
+            continue
+        per_object = [1e9 * t / (candidates * repeat) for t in spent]
+        logging.info(f"{rule.name}: {candidates:,} candidates, {found:,} matches, "
+                     f"{per_object[0]:,.0f} ns -> {per_object[1]:,.0f} ns per object "
+                     f"({per_object[0] / per_object[1]:.2f}x)")
+
+
+# ---------------------------------------------------------------------------
+# Serve
+# ---------------------------------------------------------------------------
+
+def serve(filename, port=8000, rate=None):
+    """Serve `filename` over HTTP with range support, at `rate` MB/s per connection."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def send_file_headers(self):
+            """Status and headers of the requested range, with Geofabrik's validators."""
+            stat = os.stat(filename)
+            size = stat.st_size
+            start, end = 0, size - 1
+            m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+            if m:
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            self.send_response(206 if m else 200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            if m:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("ETag", f'"{size:x}-{stat.st_mtime_ns:x}"')
+            self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+            self.end_headers()
+            return start, end
+
+        def do_HEAD(self):
+            self.send_file_headers()
+
+        def do_GET(self):
+            start, end = self.send_file_headers()
+            with open(filename, "rb") as f:
+                f.seek(start)
+                left = end - start + 1
+                while left:
+                    data = f.read(min(64 * 1024, left))
+                    self.wfile.write(data)
+                    left -= len(data)
+                    if rate:
+                        time.sleep(len(data) / (rate * 1024 ** 2))
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    logging.info(f"Serving {filename} on http://127.0.0.1:{port}/{os.path.basename(filename)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the detectors on synthetic OSM files."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the benchmarks and write a JSON baseline")
+    run.add_argument("-o", "--output", default="bench.json", help="Baseline file to write")
+    run.add_argument("--datasets", default="small",
+                     help=f"Comma separated datasets among {', '.join(DATASETS)} (default: small)")
+    run.add_argument("--detectors", default="",
+                     help="Comma separated detectors to run (default: all)")
+    run.add_argument("--data-dir", default="tmp/bench",
+                     help="Directory receiving the synthetic files")
+    run.add_argument("--repeat", type=int, default=3,
+                     help="Runs per detector, the fastest one is kept (default: 3)")
+
+    cmp = sub.add_parser("compare", help="Compare a run with a baseline, fail on regressions")
+    cmp.add_argument("baseline", help="Reference baseline file")
+    cmp.add_argument("current", help="Baseline file of the run to check")
+    cmp.add_argument("--tolerance", type=float, default=0.15,
+                     help="Relative change tolerated before flagging a regression (default: 0.15)")
+
+    match = sub.add_parser("match", help="Time the rule matchers per candidate object")
+    match.add_argument("-i", "--input", required=True, help="Input OSM file")
+    match.add_argument("-r", "--rules", default="",
+                       help="Comma separated list of rules to time (default: all)")
+    match.add_argument("--repeat", type=int, default=10,
+                       help="Calls per object and matcher (default: 10)")
+
+    srv = sub.add_parser("serve", help="Serve a file over HTTP at a throttled rate")
+    srv.add_argument("file", help="File to serve")
+    srv.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    srv.add_argument("--rate", type=float,
+                     help="Bandwidth per connection in MB/s (default: unlimited)")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    if args.command == "compare":
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
+    if args.command == "serve":
+        serve(args.file, args.port, args.rate)
+        return
+    if args.command == "match":
+        match_benchmark(args.input, [r for r in args.rules.split(",") if r], args.repeat)
+        return
+
+    datasets = [d for d in args.datasets.split(",") if d]
+    detectors = [d for d in args.detectors.split(",") if d] or list(DETECTORS)
+    unknown = [d for d in datasets if d not in DATASETS] + [d for d in detectors if d not in DETECTORS]
+    if unknown:
+        raise KeyError(f"Unknown dataset(s) or detector(s): {', '.join(unknown)}")
+    run_benchmarks(args.output, datasets, detectors, args.data_dir, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
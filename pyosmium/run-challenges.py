@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Run every MapRoulette challenge over a single read of the input file.
+
+Each rule registered in challenges.py gets its own output file
+<output-dir>/<rule>.osm, equivalent to what the standalone detectors write,
+or <output-dir>/<rule>.geojson written directly with the rule's conf/*.conf
+(no temporary .osm file and no osmium export step; .geojsonseq for one
+feature per line, optionally compressed with --compress), or
+<output-dir>/<rule>.opq Overpass queries selecting the matches by id in
+batches (see overpass.py). Rules with area/length bounds are measured in
+one batch at the end, once the node locations of their candidates are
+resolved (see measure.py). Matching multipolygon relations become GeoJSON
+areas (see areas.py).
+
+Reading a Europe extract once instead of once per challenge is where most
+of the monthly runtime goes. When the input has a blob index (see
+index-pbf.py), the node section is skipped if no rule looks at nodes, and
+only the blobs holding the member ways and candidate nodes are read again.
+The other modes:
+
+- --batch evaluates the rules over chunks of candidates as NumPy columns
+  (see batch.py)
+- --checkpoint spools the matches and saves the read position at regular
+  intervals, so that a killed run continues with --resume where it left
+  off (see checkpoint.py)
+- --cache restores the outputs of rules already computed on the same
+  input with the same definition, configuration and code (see cache.py)
+- --url downloads the input in parallel range requests and processes its
+  blobs as they arrive, while saving it to the --input file for the passes
+  that need it whole (see stream.py)
+- --state records the matches in a SQLite file, from which
+  update-challenges.py applies change files (see state.py)
+- --jobs splits the PBF at blob boundaries and processes it in several
+  processes (see parallel.py)
+- --regions (or a rule's own boundaries) also splits the GeoJSON outputs
+  into <output-dir>/<rule>/<region>.geojson (see regions.py)
+- --memory-budget samples and reports the memory of every stage, spills
+  the candidate buffers to disk under memory pressure, and lets
+  --location-index auto pick an in-memory or file-backed index from the
+  input size (see memory.py)
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import time
+
+import osmium
+
+from areas import RelationAreas
+from blobindex import IndexBuilder, first_type, load_index
+from cache import ResultCache, code_digest, fingerprint, rule_key, url_fingerprint
+from challenges import get_rules
+from checkpoint import DEFAULT_INTERVAL, apply_blobs_checkpointed, remove_checkpoint
+from engine import ChallengeEngine, OsmFileSink, TeeSink
+from geojson import GeoJsonSink, is_geojson
+from locations import CandidateLocations
+from memory import MemoryMonitor, choose_location_index, parse_size, total_memory
+from overpass import OverpassSink, rule_filter
+from parallel import apply_file_parallel
+from pbf import PbfFile
+from progress import Metrics, Progress, peak_rss
+from regions import RegionIndex, load_regions
+from state import StateStore
+from stream import HttpRangeReader, http_headers, iter_stream_buffers
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def log_duration(start):
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+def cache_keys(rules, input_digest, extension, area_method, region_files):
+    code = code_digest()
+    options = {"format": extension, "area_method": area_method}
+    keys = {}
+    for rule in rules:
+        regions = (rule.regions or region_files) if is_geojson(f".{extension}") else None
+        keys[rule.name] = rule_key(rule, input_digest, options, regions, code)
+    return keys
+
+
+def run_challenges(input_file, output_dir, rule_names=None, jobs=1, state_file=None,
+                   show_progress=True, metrics_file=None, output_format="osm",
+                   location_index="candidates", area_method="numpy", region_files=None,
+                   cache_dir=None, url=None, checkpoint_dir=None,
+                   checkpoint_interval=DEFAULT_INTERVAL, resume=False, batch=False,
+                   compress=None, memory_budget=None, trace_malloc=False):
+    start = time.time()
+
+    rules = get_rules(rule_names)
+    geojson = is_geojson(f".{output_format}")
+    if compress and not geojson:
+        raise ValueError("Only GeoJSON outputs can be compressed")
+    extension = output_format + (f".{compress}" if compress else "")
+    if cache_dir and state_file:
+        raise ValueError("A result cache can not be combined with a state file")
+    if url and (jobs > 1 or not input_file.endswith(".pbf")):
+        raise ValueError("Streaming from a URL needs a .pbf input file and a single job")
+    if checkpoint_dir and (url or jobs > 1 or not input_file.endswith(".pbf")):
+        raise ValueError("Checkpoints need an existing .pbf input file and a single job")
+    if resume and not checkpoint_dir:
+        raise ValueError("--resume needs a checkpoint directory")
+    os.makedirs(output_dir, exist_ok=True)
+
+    cache = ResultCache(cache_dir) if cache_dir else None
+    input_digest = None
+    if cache is not None:
+        # a streamed input is fingerprinted from its HTTP headers, before downloading it
+        input_digest = url_fingerprint(url, http_headers(url)) if url else fingerprint(input_file)
+        if input_digest is None:
+            logging.warning(f"{url} has no ETag or Last-Modified header, the cache can not be "
+                            f"looked up before the download")
+    if input_digest is not None:
+        keys = cache_keys(rules, input_digest, extension, area_method, region_files)
+        cached = [rule for rule in rules if keys[rule.name] in cache]
+        for rule in cached:
+            cache.restore(keys[rule.name], output_dir)
+        rules = [rule for rule in rules if rule not in cached]
+        if not rules:
+            logging.info("All outputs restored from cache, nothing to compute")
+            log_duration(start)
+            return
+
+    measured = any(rule.measured for rule in rules)
+    full_index = location_index if geojson and location_index != "candidates" else None
+    if full_index == "auto":
+        full_index = choose_location_index(input_file, memory_budget or total_memory())
+    monitor = MemoryMonitor(memory_budget, trace_malloc) if memory_budget or trace_malloc else None
+    # second pass resolving the nodes of matching ways only, for GeoJSON
+    # geometries, relation areas and the rules measuring their matches
+    candidates = CandidateLocations(monitor) if geojson or measured else None
+    sink_locations = candidates if geojson and not full_index else None
+    areas = RelationAreas(candidates) if geojson else None
+    if full_index and jobs > 1:
+        raise ValueError("A full node location index can not be combined with --jobs")
+    if full_index and checkpoint_dir:
+        raise ValueError("A full node location index can not be combined with checkpoints")
+    if not geojson and (region_files or any(rule.regions for rule in rules)):
+        raise ValueError("Regions need the GeoJSON output format")
+
+    store = StateStore(state_file) if state_file else None
+    is_pbf = input_file.endswith(".pbf")
+
+    download = None
+    if url:
+        logging.info(f"Streaming {url} to {input_file}")
+        os.makedirs(os.path.dirname(input_file) or ".", exist_ok=True)
+        download = HttpRangeReader(url, copy=input_file)
+    metrics = Metrics(input_file, download.size if download else os.path.getsize(input_file))
+    # per-rule timing is only collected when someone looks at it
+    progress = Progress(metrics, enabled=show_progress) if show_progress or metrics_file else None
+    engine = ChallengeEngine(metrics=metrics, progress=progress, locations=full_index,
+                             candidates=candidates, area_method=area_method, batch=batch)
+    indexes = {}
+    for rule in rules:
+        output = os.path.join(output_dir, f"{rule.name}.{extension}")
+        logging.info(f"Rule {rule.name} -> {output}")
+        if geojson:
+            files = tuple(rule.regions or region_files or ())
+            if files and files not in indexes:
+                indexes[files] = RegionIndex(load_regions(files))
+                logging.info(f"Regions: {', '.join(indexes[files].names)}")
+            sink = GeoJsonSink(output, rule.conf, sink_locations, areas,
+                               regions=indexes.get(files),
+                               region_dir=os.path.join(output_dir, rule.name))
+        elif output_format == "opq":
+            sink = OverpassSink(output, footer=rule_filter(rule))
+        else:
+            sink = OsmFileSink(output)
+        if store is not None:
+            sink = TeeSink(sink, store.sink(rule.name))
+        engine.add_rule(rule, sink)
+
+    index = load_index(input_file) if is_pbf and not url else None
+    blobs = None
+    if index is not None:
+        blobs = index.blobs_from(first_type(engine.entities()))
+        metrics.total_bytes = index.pbf_file.size(blobs)
+        logging.info(f"Blob index: reading {len(blobs):,} of "
+                     f"{len(index.pbf_file.data_blobs):,} blobs")
+
+    if monitor is not None:
+        monitor.start()
+    stage = monitor.stage if monitor is not None else lambda name: contextlib.nullcontext()
+
+    logging.info("Processing input file...")
+    with stage("read"):
+        if download is not None:
+            # the next passes read the local copy, complete and indexed once the stream ends
+            builder = IndexBuilder()
+            with download:
+                engine.apply_stream(iter_stream_buffers(download, on_blob=builder.add))
+            index = builder.save(input_file)
+        elif checkpoint_dir:
+            apply_blobs_checkpointed(engine, index.pbf_file if index else PbfFile(input_file),
+                                     input_file, checkpoint_dir, blobs, checkpoint_interval, resume)
+        elif jobs > 1:
+            apply_file_parallel(engine, input_file, jobs, blobs=blobs)
+        elif is_pbf:
+            # read blob by blob to know how far in the file we are
+            engine.apply_blobs(index.pbf_file if index else PbfFile(input_file), blobs)
+        else:
+            engine.apply_file(input_file)
+    if areas is not None:
+        logging.info("Reading members of matching relations...")
+        with stage("areas"):
+            areas.collect_ways(input_file, index=index)
+    if candidates is not None:
+        logging.info("Resolving candidate node locations...")
+        t0 = time.time()
+        with stage("locations"):
+            candidates.resolve(input_file, index=index)
+        metrics.add_stage("locations", time.time() - t0)
+    if areas is not None:
+        with stage("areas"):
+            areas.assemble()
+        metrics.add_stage("areas", areas.elapsed)
+    if measured:
+        t0 = time.time()
+        with stage("measures"):
+            engine.apply_measures()
+        metrics.add_stage("measures", time.time() - t0)
+    with stage("output"):
+        engine.close()
+    if monitor is not None:
+        monitor.stop()
+        monitor.record(metrics)
+    if checkpoint_dir:
+        remove_checkpoint(checkpoint_dir)
+    metrics.stop()
+    if progress is not None:
+        progress.finish()
+
+    if cache is not None:
+        if download is not None:
+            # the headers of the download itself, in case the file was replaced in between
+            input_digest = url_fingerprint(url, download.headers) or fingerprint(input_file)
+        keys = cache_keys(rules, input_digest, extension, area_method, region_files)
+        for rule in rules:
+            cache.put(keys[rule.name], output_dir, [f"{rule.name}.{extension}", rule.name])
+        logging.info(f"Outputs of {len(rules)} rule(s) stored in cache {cache_dir}")
+
+    if store is not None:
+        with osmium.io.Reader(input_file, osmium.osm.NOTHING) as reader:
+            header = reader.header()
+        for key in ("osmosis_replication_timestamp", "osmosis_replication_sequence_number"):
+            store.set_meta(key, header.get(key, ""))
+        # node locations of the measured rules' changed ways, for update-challenges.py
+        store.set_meta("input_file", os.path.abspath(input_file))
+        store.close()
+        logging.info(f"State saved in {state_file}")
+
+    for name, count in engine.matches.items():
+        logging.info(f"{name}: {count:,} objects found")
+    logging.info(f"Peak memory: {peak_rss() / 1024 ** 2:,.0f} MB")
+    if monitor is not None:
+        monitor.log_report()
+    log_duration(start)
+
+    if metrics_file:
+        metrics.write(metrics_file)
+        logging.info(f"Metrics written to {metrics_file}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run all MapRoulette challenges over a single read of an OSM file."
+    )
+    parser.add_argument("-i", "--input", required=True, help="Input OSM/PBF file")
+    parser.add_argument("-d", "--output-dir", default="tmp",
+                        help="Directory receiving one output file per rule")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of rules to run (default: all)")
+    parser.add_argument("-f", "--format", choices=["osm", "geojson", "geojsonseq", "opq"],
+                        default="osm",
+                        help="Output format (default: osm), geojsonseq writing one feature "
+                             "per line")
+    parser.add_argument("--compress", choices=["gz", "zst"],
+                        help="Compress the GeoJSON outputs while writing them (zst needs the "
+                             "zstandard package)")
+    parser.add_argument("--location-index", default="candidates",
+                        help="How GeoJSON geometries get node locations: 'candidates' (second "
+                             "pass over the nodes of matching ways, default), an osmium index "
+                             "type such as flex_mem or sparse_file_array,<file>, or auto to "
+                             "choose one from the input size and the memory budget")
+    parser.add_argument("--memory-budget", type=parse_size,
+                        help="Memory the run should fit in, e.g. 6G: the memory of every stage "
+                             "is reported, and candidate buffers are spilled to disk when "
+                             "getting close to it")
+    parser.add_argument("--trace-malloc", action="store_true",
+                        help="Also report the peak memory allocated by Python in every stage "
+                             "(tracemalloc, slows the run down)")
+    parser.add_argument("--area-method", choices=["numpy", "shapely"], default="numpy",
+                        help="How areas of measured rules are computed (shapely needs Shapely 2)")
+    parser.add_argument("--regions", nargs="+",
+                        help="Boundary files (GeoJSON or .poly) splitting the GeoJSON outputs into "
+                             "<output-dir>/<rule>/<region>.geojson")
+    parser.add_argument("--batch", action="store_true",
+                        help="Evaluate the rules over chunks of candidates as NumPy columns, "
+                             "faster when most candidates do not match")
+    parser.add_argument("--cache",
+                        help="Directory caching the outputs of each rule, keyed on the input file, "
+                             "the rule and its configuration")
+    parser.add_argument("--url",
+                        help="Download the input from this URL to the --input file while "
+                             "processing it, instead of reading an existing file")
+    parser.add_argument("--checkpoint",
+                        help="Directory where the matches are spooled and the read position "
+                             "saved at regular intervals (PBF input only)")
+    parser.add_argument("--checkpoint-interval", type=int, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between checkpoints (default: {DEFAULT_INTERVAL})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the last checkpoint of a killed run")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes (PBF input only, default: 1)")
+    parser.add_argument("-s", "--state",
+                        help="SQLite state file recording the matches, for update-challenges.py")
+    parser.add_argument("--metrics",
+                        help="Write a run report: Prometheus textfile for *.prom, JSON otherwise")
+    parser.add_argument("--no-progress", action="store_true",
+                        help="Disable progress display")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"Input:      {args.input}")
+    logging.info(f"Output dir: {args.output_dir}")
+
+    rule_names = [r for r in args.rules.split(",") if r]
+    run_challenges(args.input, args.output_dir, rule_names, jobs=args.jobs,
+                   state_file=args.state, show_progress=not args.no_progress,
+                   metrics_file=args.metrics, output_format=args.format,
+                   location_index=args.location_index, area_method=args.area_method,
+                   region_files=args.regions, cache_dir=args.cache, url=args.url,
+                   checkpoint_dir=args.checkpoint, checkpoint_interval=args.checkpoint_interval,
+                   resume=args.resume, batch=args.batch, compress=args.compress,
+                   memory_budget=args.memory_budget, trace_malloc=args.trace_malloc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Run the osmium-tool challenge scripts as one graph of stages.
+
+Equivalent to running 01-*.sh to 05-*.sh one after another, except that
+stages shared by several challenges (the museum extraction) run once,
+intermediate files are deleted as soon as no stage needs them, and
+independent stages run concurrently (see pipeline.py).
+
+    python pyosmium/run-pipeline.py -i in/latest.osm.pbf -d out
+    python pyosmium/run-pipeline.py -i in/latest.osm.pbf -d out -r museum-no-fee,museum-no-website -j 2
+    python pyosmium/run-pipeline.py -i in/latest.osm.pbf --dry-run
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from pipeline import Pipeline, challenge_stages
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def run_pipeline(input_file, output_dir, names=None, tmp_dir="tmp", conf_dir="conf",
+                 jobs=None, keep=False, dry_run=False):
+    start = time.time()
+
+    stages = challenge_stages(input_file, output_dir, conf_dir)
+    unknown = [n for n in names or () if n not in stages]
+    if unknown:
+        raise KeyError(f"Unknown challenge(s): {', '.join(unknown)}")
+    pipeline = Pipeline([stages[n] for n in names or stages], tmp_dir, jobs, keep)
+    logging.info(pipeline.describe())
+    if dry_run:
+        return
+
+    try:
+        pipeline.run()
+    except RuntimeError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the osmium-tool challenge scripts as a graph of shared stages."
+    )
+    parser.add_argument("-i", "--input", default="in/latest.osm.pbf", help="Input OSM/PBF file")
+    parser.add_argument("-d", "--output-dir", default="out",
+                        help="Directory receiving one GeoJSON file per challenge")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of challenges to run (default: all)")
+    parser.add_argument("-t", "--tmp-dir", default="tmp",
+                        help="Directory of the intermediate files (default: tmp)")
+    parser.add_argument("-c", "--conf-dir", default="conf",
+                        help="Directory of the osmium export configurations (default: conf)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of stages run at once (default: number of CPUs)")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the intermediate files")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only list the stages that would run")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"Input:      {args.input}")
+    logging.info(f"Output dir: {args.output_dir}")
+
+    names = [r for r in args.rules.split(",") if r]
+    run_pipeline(args.input, args.output_dir, names, args.tmp_dir, args.conf_dir,
+                 args.jobs, args.keep, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
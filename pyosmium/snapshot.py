@@ -0,0 +1,79 @@
+"""
+Detached copies of osmium objects.
+
+Objects handed out by osmium are only valid until the next object is read.
+A Snapshot keeps what the sinks need (id, version, tags, node refs,
+members, location) so that a match can be held back, e.g. until its
+geometry has been measured, and written later. It quacks like an osmium
+object for the sinks and osmium.SimpleWriter.
+"""
+
+from osmium.osm import Location, NodeRef, Tag
+
+
+def _location(loc):
+    return Location(loc.lon, loc.lat) if loc.valid() else Location()
+
+
+class TagSnapshot:
+    """Read-only tag list with the osmium TagList interface."""
+
+    __slots__ = ("_tags",)
+
+    def __init__(self, tags):
+        self._tags = {t.k: t.v for t in tags}
+
+    def get(self, key, default=None):
+        return self._tags.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._tags
+
+    def __getitem__(self, key):
+        return self._tags[key]
+
+    def __iter__(self):
+        return (Tag(k, v) for k, v in self._tags.items())
+
+    def __len__(self):
+        return len(self._tags)
+
+
+class Snapshot:
+    """Copy of a node, way or relation outliving the osmium buffer."""
+
+    def __init__(self, obj):
+        self._type = obj.type_str()
+        self.id = obj.id
+        self.version = obj.version
+        self.changeset = obj.changeset
+        self.uid = obj.uid
+        self.user = obj.user
+        self.timestamp = obj.timestamp
+        self.visible = obj.visible
+        self.deleted = obj.deleted
+        self.tags = TagSnapshot(obj.tags)
+        if self._type == "n":
+            self.location = _location(obj.location)
+        elif self._type == "w":
+            self.nodes = [NodeRef(_location(n.location), n.ref) for n in obj.nodes]
+        else:
+            self.members = [(m.type, m.ref, m.role) for m in obj.members]
+
+    def type_str(self):
+        return self._type
+
+    def is_node(self):
+        return self._type == "n"
+
+    def is_way(self):
+        return self._type == "w"
+
+    def is_relation(self):
+        return self._type == "r"
+
+    def is_closed(self):
+        return len(self.nodes) > 1 and self.nodes[0].ref == self.nodes[-1].ref
+
+    def __repr__(self):
+        return f"Snapshot({self._type}{self.id})"
@@ -0,0 +1,233 @@
+"""
+Persistent per-rule state for incremental challenge updates.
+
+A full run of the engine can record every matching object in a SQLite
+state store. Afterwards, OSM change files (.osc, as produced by
+pyosmium-get-changes or osmium derive-changes) are applied to the store:
+each changed object is re-evaluated against every rule and added, updated
+or dropped. Outputs are then regenerated from the store, without reading
+the full extract again. Only the changed ways matching a rule with
+area/length bounds need node locations from an extract, read for their
+nodes alone (see locations.py).
+"""
+
+import json
+import logging
+import os
+import sqlite3
+
+import osmium
+from osmium.osm import mutable
+
+import measure
+from locations import CandidateLocations
+from rules import entity_bits
+from snapshot import Snapshot
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    rule TEXT NOT NULL,
+    type TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (rule, type, id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+TYPE_ORDER = "CASE type WHEN 'n' THEN 0 WHEN 'w' THEN 1 ELSE 2 END"
+
+
+# ---------------------------------------------------------------------------
+# Object (de)serialisation
+# ---------------------------------------------------------------------------
+
+def serialize(obj):
+    """Copy what is needed to write an object back out into a JSON string."""
+    data = {"tags": {t.k: t.v for t in obj.tags}}
+    obj_type = obj.type_str()
+    if obj_type == "n":
+        if obj.location.valid():
+            data["loc"] = [obj.location.lon, obj.location.lat]
+    elif obj_type == "w":
+        data["nodes"] = [n.ref for n in obj.nodes]
+    else:
+        data["members"] = [[m.type, m.ref, m.role] for m in obj.members]
+    return json.dumps(data, separators=(",", ":"))
+
+
+def deserialize(obj_type, obj_id, version, text):
+    """Build a mutable osmium object from a serialized state entry."""
+    data = json.loads(text)
+    if obj_type == "n":
+        return mutable.Node(id=obj_id, version=version, tags=data["tags"],
+                            location=data.get("loc"))
+    if obj_type == "w":
+        return mutable.Way(id=obj_id, version=version, tags=data["tags"], nodes=data["nodes"])
+    return mutable.Relation(id=obj_id, version=version, tags=data["tags"],
+                            members=[tuple(m) for m in data["members"]])
+
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+
+class StateStore:
+    """SQLite store of the objects matched by each rule."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def clear(self, rule_name):
+        self.db.execute("DELETE FROM matches WHERE rule = ?", (rule_name,))
+
+    def upsert(self, rule_name, obj):
+        self.db.execute("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?)",
+                        (rule_name, obj.type_str(), obj.id, obj.version, serialize(obj)))
+
+    def remove(self, rule_name, obj_type, obj_id):
+        cur = self.db.execute("DELETE FROM matches WHERE rule = ? AND type = ? AND id = ?",
+                              (rule_name, obj_type, obj_id))
+        return cur.rowcount > 0
+
+    def version(self, rule_name, obj_type, obj_id):
+        row = self.db.execute("SELECT version FROM matches WHERE rule = ? AND type = ? AND id = ?",
+                              (rule_name, obj_type, obj_id)).fetchone()
+        return None if row is None else row[0]
+
+    def count(self, rule_name):
+        return self.db.execute("SELECT COUNT(*) FROM matches WHERE rule = ?",
+                               (rule_name,)).fetchone()[0]
+
+    def objects(self, rule_name):
+        """Yield the stored objects of a rule as mutable objects, in type/id order."""
+        rows = self.db.execute(f"SELECT type, id, version, data FROM matches WHERE rule = ? "
+                               f"ORDER BY {TYPE_ORDER}, id", (rule_name,))
+        for obj_type, obj_id, version, data in rows:
+            yield deserialize(obj_type, obj_id, version, data)
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def sink(self, rule_name):
+        """Engine sink recording the matches of `rule_name` (previous state is dropped)."""
+        self.clear(rule_name)
+        return StateSink(self, rule_name)
+
+
+class StateSink:
+    """Engine sink writing the matches of one rule into a StateStore."""
+
+    def __init__(self, store, rule_name):
+        self.store = store
+        self.rule_name = rule_name
+
+    def add(self, obj):
+        self.store.upsert(self.rule_name, obj)
+
+    def close(self):
+        self.store.db.commit()
+
+
+# ---------------------------------------------------------------------------
+# Incremental update
+# ---------------------------------------------------------------------------
+
+def apply_changes(store, rules, change_file, input_file=None):
+    """Apply an OSM change file to the store.
+
+    The changed ways matching a rule with area/length bounds are measured
+    before being stored: their node locations are read from `input_file`
+    (the extract the state was built from, or a more recent one) and from
+    the nodes of the change file, which take precedence.
+
+    Returns {rule name: {"added": n, "updated": n, "removed": n}}.
+    """
+    measured = [rule.name for rule in rules if rule.measured]
+    if measured and input_file is None:
+        raise ValueError(f"Rule(s) {', '.join(measured)} measure their matches: "
+                         f"an input file with the node locations is needed")
+    stats = {rule.name: {"added": 0, "updated": 0, "removed": 0} for rule in rules}
+    bits = osmium.osm.NOTHING
+    for rule in rules:
+        bits |= entity_bits(rule.entities)
+    candidates = CandidateLocations() if measured else None
+    # rule name -> way id -> (snapshot, start, end, stored version)
+    pending = {name: {} for name in measured}
+
+    for obj in osmium.FileProcessor(change_file, bits):
+        obj_type = obj.type_str()
+        for rule in rules:
+            if obj_type not in rule.entities:
+                continue
+            counters = stats[rule.name]
+            current = store.version(rule.name, obj_type, obj.id)
+            if current is not None and current > obj.version:
+                continue  # older version than the one already stored
+            if not obj.deleted and rule.match(obj):
+                if rule.measured:
+                    start, end = candidates.add_way(obj)
+                    pending[rule.name][obj.id] = (Snapshot(obj), start, end, current)
+                    continue
+                store.upsert(rule.name, obj)
+                counters["updated" if current is not None else "added"] += 1
+            else:
+                if rule.measured:
+                    pending[rule.name].pop(obj.id, None)
+                if current is not None:
+                    store.remove(rule.name, obj_type, obj.id)
+                    counters["removed"] += 1
+
+    if any(pending.values()):
+        candidates.resolve(input_file)
+        candidates.overlay(change_file)
+        for rule in rules:
+            if rule.name in pending:
+                _apply_measures(store, rule, candidates, pending[rule.name].values(),
+                                stats[rule.name])
+
+    store.db.commit()
+    return stats
+
+
+def _apply_measures(store, rule, candidates, pending, counters):
+    """Store the measured changed ways within the bounds of `rule`, drop the others."""
+    pending = list(pending)
+    if not pending:
+        return
+    keep = measure.within_bounds(rule, candidates, [(s, e) for _, s, e, _ in pending])
+    for (snapshot, _, _, current), ok in zip(pending, keep):
+        if ok:
+            store.upsert(rule.name, snapshot)
+            counters["updated" if current is not None else "added"] += 1
+        elif current is not None:
+            store.remove(rule.name, "w", snapshot.id)
+            counters["removed"] += 1
+
+
+def export(store, rule_name, filename):
+    """Write the stored matches of a rule into an OSM file."""
+    if os.path.exists(filename):
+        logging.info(f"Deleting existing file: {filename}")
+        os.remove(filename)
+    writer = osmium.SimpleWriter(filename)
+    try:
+        for obj in store.objects(rule_name):
+            writer.add(obj)
+    finally:
+        writer.close()
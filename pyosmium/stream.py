@@ -0,0 +1,239 @@
+"""
+Process a PBF file while it is being downloaded.
+
+`HttpRangeReader` downloads a file as consecutive segments fetched over
+several connections with HTTP range requests (as aria2c does), but hands
+them out in file order, so a reader can start on the first blobs while
+the rest is still on its way. Everything read is also written to a local
+copy, which is complete once the stream ends: passes that need the whole
+file (node locations, relation members, state) run on it afterwards.
+
+`iter_stream_buffers` cuts that stream at blob boundaries into chunks of
+whole blobs prefixed with the header blob, in the same FileBuffer form
+as PbfFile.iter_buffers (see pbf.py), and can index the blobs on the way.
+"""
+
+import logging
+import queue
+import struct
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import osmium
+
+from pbf import Blob, parse_blob_header
+
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+DEFAULT_CONNECTIONS = 4
+
+# smaller than for local files, so that processing starts early
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+
+RETRIES = 3
+
+# bytes read from a connection at a time
+READ_SIZE = 256 * 1024
+
+
+class _Segment:
+    """Byte range downloaded by a worker, readable while it arrives."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.chunks = queue.Queue()
+
+
+class HttpRangeReader:
+    """Sequential file-like reader of a URL downloaded in parallel segments.
+
+    Up to `connections` segments of `segment_size` bytes are fetched ahead
+    of the reader, which bounds the memory used; the segment being read is
+    consumed as it arrives. Servers without range support are read with a
+    single plain request. With `copy`, everything read is also written to
+    that file.
+    """
+
+    def __init__(self, url, copy=None, connections=DEFAULT_CONNECTIONS,
+                 segment_size=DEFAULT_SEGMENT_SIZE, timeout=60):
+        self.url = url
+        self.timeout = timeout
+        self.segment_size = segment_size
+        self.copy = open(copy, "wb") if copy else None
+        self.position = 0
+        self.buffer = b""
+        self.offset = 0
+        self.response = None
+        self.closed = False
+        # HTTP headers of the file (ETag, Last-Modified), to fingerprint it (see cache.py)
+        self.headers = {}
+        self.size = self._probe()
+        self.pool = None
+        self.pending = deque()
+        self.next_start = 0
+        if self.size is not None:
+            self.pool = ThreadPoolExecutor(max_workers=connections)
+            for _ in range(connections):
+                self._schedule()
+        else:
+            logging.info(f"{url} does not support range requests, reading it in one request")
+            self.response = urllib.request.urlopen(url, timeout=timeout)
+            self.headers = self.response.headers
+
+    def _probe(self):
+        """Total size when the server honours range requests, else None."""
+        request = urllib.request.Request(self.url, headers={"Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            self.headers = response.headers
+            content_range = response.headers.get("Content-Range")
+            if response.status != 206 or not content_range:
+                return None
+            return int(content_range.rsplit("/", 1)[1])
+
+    def _fetch(self, segment):
+        """Worker: download a segment into its queue, resuming after errors.
+
+        The reader blocks on the queue, so whatever happens the worker ends
+        it: with None once the segment is complete, with an exception if not.
+        """
+        received = segment.start
+        attempt = 0
+        error = None
+        try:
+            while received < segment.end and not self.closed:
+                try:
+                    headers = {"Range": f"bytes={received}-{segment.end - 1}"}
+                    request = urllib.request.Request(self.url, headers=headers)
+                    with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                        while received < segment.end and not self.closed:
+                            chunk = response.read(min(READ_SIZE, segment.end - received))
+                            if not chunk:
+                                raise IOError(f"connection closed at byte {received}")
+                            segment.chunks.put(chunk)
+                            received += len(chunk)
+                except Exception as e:
+                    # IncompleteRead and other HTTPExceptions are not OSErrors
+                    attempt += 1
+                    if attempt == RETRIES:
+                        error = e
+                        return
+                    logging.warning(f"Segment {segment.start}-{segment.end} of {self.url} failed "
+                                    f"({e!r}), resuming at byte {received}")
+                    time.sleep(2 ** attempt)
+        finally:
+            if error is None and received < segment.end and not self.closed:
+                error = IOError(f"Segment {segment.start}-{segment.end} of {self.url} stopped "
+                                f"at byte {received}")
+            segment.chunks.put(error)
+
+    def _schedule(self):
+        if self.next_start < self.size:
+            segment = _Segment(self.next_start, min(self.next_start + self.segment_size, self.size))
+            self.pool.submit(self._fetch, segment)
+            self.pending.append(segment)
+            self.next_start = segment.end
+
+    def _next_chunk(self):
+        if self.response is not None:
+            return self.response.read(READ_SIZE)
+        while self.pending:
+            chunk = self.pending[0].chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk is not None:
+                return chunk
+            self.pending.popleft()
+            self._schedule()
+        return b""
+
+    def read(self, size):
+        """Read `size` bytes, fewer only at the end of the file."""
+        parts = []
+        while size > 0:
+            if self.offset == len(self.buffer):
+                self.buffer = self._next_chunk()
+                self.offset = 0
+                if not self.buffer:
+                    break
+                if self.copy is not None:
+                    self.copy.write(self.buffer)
+            part = self.buffer[self.offset:self.offset + size]
+            self.offset += len(part)
+            size -= len(part)
+            parts.append(part)
+        data = b"".join(parts)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        if self.response is not None:
+            self.response.close()
+        if self.copy is not None:
+            self.copy.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_stream_blobs(stream):
+    """Yield the Blob and raw bytes of the blobs of a sequential PBF stream."""
+    while True:
+        offset = stream.position
+        prefix = stream.read(4)
+        if not prefix:
+            return
+        if len(prefix) < 4:
+            raise ValueError(f"Truncated PBF stream at offset {offset}")
+        header = stream.read(struct.unpack(">I", prefix)[0])
+        blob_type, datasize = parse_blob_header(header)
+        data = stream.read(datasize)
+        if len(data) < datasize:
+            raise ValueError(f"Truncated PBF stream at offset {stream.position}")
+        raw = prefix + header + data
+        yield Blob(offset, len(raw), blob_type), raw
+
+
+def iter_stream_buffers(stream, chunk_size=STREAM_CHUNK_SIZE, on_blob=None):
+    """Yield (bytes, FileBuffer) chunks of whole data blobs of a PBF stream.
+
+    `on_blob(blob, raw)` is called for every blob, e.g. IndexBuilder.add to
+    index the file while it is downloaded (see blobindex.py).
+    """
+    header = None
+    chunk = []
+    size = 0
+    for blob, raw in iter_stream_blobs(stream):
+        if on_blob is not None:
+            on_blob(blob, raw)
+        if blob.type == "OSMHeader":
+            header = raw
+            continue
+        if blob.type != "OSMData":
+            continue
+        if header is None:
+            raise ValueError("Not a PBF stream (no OSMHeader blob)")
+        if chunk and size + len(raw) > chunk_size:
+            yield size, osmium.io.FileBuffer(header + b"".join(chunk), "pbf")
+            chunk = []
+            size = 0
+        chunk.append(raw)
+        size += len(raw)
+    if chunk:
+        yield size, osmium.io.FileBuffer(header + b"".join(chunk), "pbf")
+
+
+def http_headers(url, timeout=60):
+    """Headers of a HEAD request to `url`, e.g. to fingerprint it before downloading it."""
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.headers
@@ -0,0 +1,120 @@
+"""
+Deterministic synthetic OSM files for benchmarks.
+
+`generate` writes a PBF with a given number of nodes, ways and multipolygon
+relations. A share of them (`density`) carries the tags the challenges
+look for, half of them matching and half of them near misses (a museum
+with a fee, a oneway=yes...), the rest carries unrelated tags. Ways are
+small rings or lines of their own nodes, with realistic sizes, so that
+area and length bounds and geometries behave as on real data. The same
+parameters and seed always give the same file.
+"""
+
+import math
+import os
+import random
+
+import osmium
+from osmium.osm import mutable
+
+
+POI_TAGS = [
+    # (matching, near miss)
+    ({"tourism": "museum"}, {"tourism": "museum", "fee": "no", "website": "https://example.org"}),
+    ({"amenity": "place_of_worship"}, {"amenity": "place_of_worship", "religion": "christian"}),
+    ({"shop": "yes"}, {"shop": "bakery"}),
+]
+
+WAY_TAGS = [
+    ({"highway": "residential", "oneway": "1"}, {"highway": "residential", "oneway": "yes"}),
+    ({"amenity": "parking_space"}, {"amenity": "parking_space", "capacity": "1"}),
+    ({"amenity": "parking"}, {"amenity": "parking", "access": "private"}),
+    ({"tourism": "museum", "building": "yes"}, {"tourism": "museum", "fee": "yes", "building": "yes"}),
+    ({"amenity": "place_of_worship", "building": "church"},
+     {"amenity": "place_of_worship", "religion": "christian", "building": "church"}),
+]
+
+RELATION_TAGS = [
+    ({"amenity": "place_of_worship"}, {"amenity": "place_of_worship", "religion": "muslim"}),
+    ({"amenity": "parking"}, {"amenity": "parking", "parking": "surface"}),
+]
+
+OTHER_TAGS = [{"highway": "footway"}, {"building": "yes"}, {"natural": "tree"},
+              {"amenity": "bench"}, {"landuse": "grass"}]
+
+# extent of the generated data (lon/lat)
+BBOX = (5.0, 45.0, 6.0, 46.0)
+
+METRES_PER_DEGREE = 111320.0
+
+
+def _tags(rnd, tagsets, density):
+    if rnd.random() >= density:
+        return dict(rnd.choice(OTHER_TAGS)) if rnd.random() < 0.3 else {}
+    matching, near_miss = rnd.choice(tagsets)
+    return dict(matching if rnd.random() < 0.5 else near_miss)
+
+
+def _ring(center, radius, nb):
+    lon0, lat0 = center
+    scale = 1.0 / (METRES_PER_DEGREE * math.cos(math.radians(lat0)))
+    points = []
+    for i in range(nb):
+        angle = 2 * math.pi * i / nb
+        points.append((lon0 + radius * math.cos(angle) * scale,
+                       lat0 + radius * math.sin(angle) / METRES_PER_DEGREE))
+    return points
+
+
+def generate(filename, nodes=100000, ways=10000, relations=100, density=0.05, seed=42):
+    """Write a synthetic OSM file, return the number of nodes, ways and relations written."""
+    rnd = random.Random(seed)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    def location():
+        return (round(rnd.uniform(BBOX[0], BBOX[2]), 7), round(rnd.uniform(BBOX[1], BBOX[3]), 7))
+
+    # ways and relation outers first, to know how many nodes they use
+    way_specs = []
+    for i in range(ways + relations):
+        # outers of the multipolygons are always closed
+        closed = rnd.random() < 0.7 or i >= ways
+        nb = rnd.randint(4, 16) if closed else rnd.randint(2, 12)
+        radius = rnd.choice([3.0, 8.0, 15.0, 40.0, 120.0])
+        way_specs.append((_ring(location(), radius, nb), closed))
+    way_nodes = sum(len(points) for points, _ in way_specs)
+    pois = max(0, nodes - way_nodes)
+
+    writer = osmium.SimpleWriter(filename)
+    try:
+        node_id = 0
+        refs = []
+        for points, closed in way_specs:
+            ids = []
+            for lon, lat in points:
+                node_id += 1
+                writer.add_node(mutable.Node(id=node_id, version=1,
+                                             location=(round(lon, 7), round(lat, 7))))
+                ids.append(node_id)
+            refs.append(ids + ids[:1] if closed else ids)
+        for _ in range(pois):
+            node_id += 1
+            writer.add_node(mutable.Node(id=node_id, version=1, location=location(),
+                                         tags=_tags(rnd, POI_TAGS, density)))
+
+        for way_id, nds in enumerate(refs[:ways], 1):
+            writer.add_way(mutable.Way(id=way_id, version=1, nodes=nds,
+                                       tags=_tags(rnd, WAY_TAGS, density)))
+        # untagged outer ways of the multipolygons
+        for i, nds in enumerate(refs[ways:]):
+            writer.add_way(mutable.Way(id=ways + i + 1, version=1, nodes=nds, tags={}))
+
+        for i in range(relations):
+            tags = _tags(rnd, RELATION_TAGS, max(density, 0.5))
+            tags["type"] = "multipolygon"
+            writer.add_relation(mutable.Relation(id=i + 1, version=1,
+                                                 members=[("w", ways + i + 1, "outer")], tags=tags))
+    finally:
+        writer.close()
+    return node_id, ways + relations, relations
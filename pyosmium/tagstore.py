@@ -0,0 +1,264 @@
+"""
+Columnar store of the tags of interesting objects, for trying rules out.
+
+Every new challenge idea used to cost a full scan of the extract. A tag
+store is built once per extract (see build-tagstore.py): it keeps every
+object carrying one of the selection keys (by default the keys required
+by the registered rules), with the values of the stored keys (the
+selection keys plus the forbidden keys of the rules, or any other) as
+interned codes:
+
+- types, ids and node counts (ways) of the objects, in file order
+- one row per stored tag: the object it belongs to, its key and value codes
+- optionally the centroid of every object (node location, mean of the
+  node locations of ways, resolved with CandidateLocations)
+
+Each array is a .npy file of a directory, next to the extract by default
+(<input>.tags), and is memory-mapped when the store is opened: a rule is
+evaluated with a few vectorized scans of the tag rows (TagStore.match), in
+seconds where a scan of the extract takes hours. Area and length bounds
+need geometries and are not checked.
+"""
+
+import json
+import logging
+import os
+import shutil
+from array import array
+
+import numpy as np
+import osmium
+from osmium.filter import KeyFilter
+
+from blobindex import TYPE_CODES
+from challenges import RULES
+from locations import CandidateLocations
+
+# arrays of a store, each in <name>.npy
+ARRAYS = ["types", "ids", "nodes", "tag_rows", "tag_keys", "tag_values"]
+
+CENTROIDS = ["lon", "lat"]
+
+META_FILE = "meta.json"
+
+VALUES_FILE = "values.json"
+
+
+def sidecar(filename):
+    return filename + ".tags"
+
+
+def default_keys(rules=RULES):
+    """(selection keys, other stored keys) covering every registered rule."""
+    selection = sorted({key for rule in rules for key in rule.tags})
+    stored = sorted({key for rule in rules for key in rule.without} - set(selection))
+    return selection, stored
+
+
+class TagStore:
+    """Objects carrying a selection key, with their stored tags as code arrays."""
+
+    def __init__(self, arrays, keys, values, selection, meta=None):
+        self.types = arrays["types"]
+        self.ids = arrays["ids"]
+        self.nodes = arrays["nodes"]
+        self.tag_rows = arrays["tag_rows"]
+        self.tag_keys = arrays["tag_keys"]
+        self.tag_values = arrays["tag_values"]
+        self.lon = arrays.get("lon")
+        self.lat = arrays.get("lat")
+        self.keys = keys
+        self.values = values
+        self.selection = selection
+        self.meta = meta or {}
+        self.key_codes = {k: i for i, k in enumerate(keys)}
+        self._value_codes = None
+        self._key_tags = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    # -- building ------------------------------------------------------------
+
+    @classmethod
+    def build(cls, input_file, selection, stored=(), centroids=False, metrics=None, progress=None):
+        """Read `input_file` once and keep the objects carrying one of the `selection` keys."""
+        keys = list(selection) + [k for k in stored if k not in selection]
+        key_codes = list(enumerate(keys))
+        value_codes = {}
+        types = array("b")
+        ids = array("q")
+        nodes = array("i")
+        tag_rows = array("q")
+        tag_keys = array("h")
+        tag_values = array("i")
+        locations = CandidateLocations() if centroids else None
+        lon = array("d")
+        lat = array("d")
+        slices = []
+
+        processor = osmium.FileProcessor(input_file, osmium.osm.NODE | osmium.osm.WAY
+                                         | osmium.osm.RELATION)
+        processor.with_filter(KeyFilter(*selection))
+        for obj in processor:
+            row = len(ids)
+            obj_type = obj.type_str()
+            types.append(TYPE_CODES[obj_type])
+            ids.append(obj.id)
+            get = obj.tags.get
+            for code, key in key_codes:
+                val = get(key)
+                if val is not None:
+                    tag_rows.append(row)
+                    tag_keys.append(code)
+                    tag_values.append(value_codes.setdefault(val, len(value_codes)))
+            if obj_type == "w":
+                nodes.append(len(obj.nodes))
+                if locations is not None:
+                    slices.append((row, *locations.add_way(obj)))
+            else:
+                nodes.append(0)
+            if locations is not None:
+                loc = obj.location if obj_type == "n" else None
+                lon.append(loc.lon if loc is not None and loc.valid() else np.nan)
+                lat.append(loc.lat if loc is not None and loc.valid() else np.nan)
+            if metrics is not None:
+                metrics.objects += 1
+            if progress is not None:
+                progress.update()
+
+        arrays = {
+            "types": np.frombuffer(types, dtype=np.int8),
+            "ids": np.frombuffer(ids, dtype=np.int64),
+            "nodes": np.frombuffer(nodes, dtype=np.int32),
+            "tag_rows": np.frombuffer(tag_rows, dtype=np.int64),
+            "tag_keys": np.frombuffer(tag_keys, dtype=np.int16),
+            "tag_values": np.frombuffer(tag_values, dtype=np.int32),
+        }
+        if locations is not None:
+            arrays["lon"] = np.frombuffer(lon, dtype=np.float64).copy()
+            arrays["lat"] = np.frombuffer(lat, dtype=np.float64).copy()
+            if slices:
+                logging.info("Resolving the node locations of the ways...")
+                locations.resolve(input_file)
+                _way_centroids(arrays, locations, slices)
+        values = sorted(value_codes, key=value_codes.get)
+        return cls(arrays, keys, values, list(selection))
+
+    def save(self, directory, source=None):
+        """Write the store into `directory`, replacing the previous one."""
+        tmp = directory + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        names = ARRAYS + (CENTROIDS if self.lon is not None else [])
+        for name in names:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        meta = {"keys": self.keys, "selection": self.selection, "objects": len(self),
+                "tags": len(self.tag_rows), "centroids": self.lon is not None}
+        if source is not None:
+            stat = os.stat(source)
+            meta["source"] = {"file": os.path.abspath(source), "size": stat.st_size,
+                              "mtime_ns": stat.st_mtime_ns}
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        with open(os.path.join(tmp, VALUES_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+        self.meta = meta
+
+    @classmethod
+    def load(cls, directory):
+        """Open a store, its arrays memory-mapped."""
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, VALUES_FILE), encoding="utf-8") as f:
+            values = json.load(f)
+        names = ARRAYS + (CENTROIDS if meta["centroids"] else [])
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                  for name in names}
+        source = meta.get("source")
+        if source and os.path.exists(source["file"]):
+            stat = os.stat(source["file"])
+            if [stat.st_size, stat.st_mtime_ns] != [source["size"], source["mtime_ns"]]:
+                logging.warning(f"{source['file']} changed since the tag store {directory} "
+                                f"was built")
+        return cls(arrays, meta["keys"], values, meta["selection"], meta)
+
+    # -- queries -------------------------------------------------------------
+
+    def check(self, rule):
+        """Raise ValueError when the store can not answer `rule`."""
+        if not any(key in self.selection for key in rule.tags):
+            raise ValueError(f"Rule {rule.name}: none of its required keys "
+                             f"({', '.join(rule.tags)}) selects objects of the tag store")
+        missing = [k for k in list(rule.tags) + list(rule.without) if k not in self.key_codes]
+        if missing:
+            raise ValueError(f"Rule {rule.name}: key(s) not in the tag store: {', '.join(missing)}")
+
+    def _tags_of(self, key):
+        """Positions of the tag rows of `key`."""
+        if key not in self._key_tags:
+            self._key_tags[key] = np.flatnonzero(self.tag_keys == self.key_codes[key])
+        return self._key_tags[key]
+
+    def has(self, key, values=None):
+        """Mask of the objects with `key`, set to one of `values` unless None."""
+        tags = self._tags_of(key)
+        if values is not None:
+            if self._value_codes is None:
+                self._value_codes = {v: i for i, v in enumerate(self.values)}
+            codes = [self._value_codes[v] for v in values if v in self._value_codes]
+            tags = tags[np.isin(self.tag_values[tags], codes)]
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.tag_rows[tags]] = True
+        return mask
+
+    def match(self, rule):
+        """Mask of the objects matching `rule`, area and length bounds aside."""
+        self.check(rule)
+        mask = np.isin(self.types, [TYPE_CODES[t] for t in rule.entities])
+        for key, values in rule.tags.items():
+            mask &= self.has(key, values)
+        for key, values in rule.without.items():
+            mask &= ~self.has(key, values)
+        if rule.checks_nodes:
+            ways = self.types == TYPE_CODES["w"]
+            if rule.min_nodes is not None:
+                mask &= ~ways | (self.nodes >= rule.min_nodes)
+            if rule.max_nodes is not None:
+                mask &= ~ways | (self.nodes <= rule.max_nodes)
+        return mask
+
+    def tags(self, row):
+        """Stored tags of the object at `row`, as a dict."""
+        start, end = np.searchsorted(self.tag_rows, [row, row + 1])
+        return {self.keys[k]: self.values[v]
+                for k, v in zip(self.tag_keys[start:end].tolist(),
+                                self.tag_values[start:end].tolist())}
+
+
+def _way_centroids(arrays, locations, slices):
+    """Set the centroid of the ways recorded by `locations` to the mean of their nodes."""
+    rows = np.array([row for row, _, _ in slices], dtype=np.int64)
+    lon, lat, offsets, valid = locations.ragged([(start, end) for _, start, end in slices])
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+    nonempty = counts > 0
+    keep = valid & nonempty
+    sum_lon = np.add.reduceat(lon, starts[nonempty]) if nonempty.any() else np.zeros(0)
+    sum_lat = np.add.reduceat(lat, starts[nonempty]) if nonempty.any() else np.zeros(0)
+    mean_lon = np.full(len(slices), np.nan)
+    mean_lat = np.full(len(slices), np.nan)
+    mean_lon[nonempty] = sum_lon / counts[nonempty]
+    mean_lat[nonempty] = sum_lat / counts[nonempty]
+    arrays["lon"][rows[keep]] = mean_lon[keep]
+    arrays["lat"][rows[keep]] = mean_lat[keep]
+
+
+def load_store(filename):
+    """Tag store of an extract (its <input>.tags sidecar) or of a store directory, None if missing."""
+    for directory in (filename, sidecar(filename)):
+        if os.path.isfile(os.path.join(directory, META_FILE)):
+            return TagStore.load(directory)
+    return None
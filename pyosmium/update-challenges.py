@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Update challenge outputs from OSM change files instead of a full rescan.
+
+1. Once, run run-challenges.py with --state to record every match
+2. Fetch the changes since the extract, e.g. with
+   pyosmium-get-changes -O in/latest.osm.pbf -o tmp/changes.osc.gz
+3. Run this script: the changed objects are re-evaluated against every
+   rule, the state is updated and the outputs are written again
+
+Rules with area/length bounds (big-parking-space) measure their changed
+ways: the locations of their nodes are read from the change files and
+from the extract the state was built from (or the one given with -i).
+
+The outputs are OSM files (<rule>.osm) only: the state does not keep the
+node locations of ways, which GeoJSON geometries need, so this mode can not
+feed the GeoJSON challenges pushed by the workflow (.github/workflows/main.yml).
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from challenges import get_rules
+from state import StateStore, apply_changes, export
+
+
+# ---------------------------------------------------------------------------
+# Main logic
+# ---------------------------------------------------------------------------
+
+def update_challenges(state_file, change_files, output_dir, rule_names=None, input_file=None):
+    start = time.time()
+
+    if not os.path.exists(state_file):
+        raise FileNotFoundError(f"State file {state_file} not found, run run-challenges.py --state first")
+
+    os.makedirs(output_dir, exist_ok=True)
+    rules = get_rules(rule_names)
+    store = StateStore(state_file)
+    input_file = input_file or store.get_meta("input_file")
+    if any(rule.measured for rule in rules) and not (input_file and os.path.exists(input_file)):
+        store.close()
+        raise FileNotFoundError(f"Input file {input_file} not found, the measured rules need "
+                                f"the node locations of an extract (-i)")
+
+    try:
+        for change_file in change_files:
+            logging.info(f"Applying {change_file}")
+            stats = apply_changes(store, rules, change_file, input_file)
+            for name, counters in stats.items():
+                logging.info(f"{name}: +{counters['added']:,} ~{counters['updated']:,} "
+                             f"-{counters['removed']:,}")
+
+        for rule in rules:
+            output = os.path.join(output_dir, f"{rule.name}.osm")
+            export(store, rule.name, output)
+            logging.info(f"{rule.name}: {store.count(rule.name):,} objects -> {output}")
+    finally:
+        store.close()
+
+    duration = time.time() - start
+    h, rem = divmod(duration, 3600)
+    m, s = divmod(rem, 60)
+    logging.info(f"Program ended in {int(h):02d}:{int(m):02d}:{s:05.2f}")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Apply OSM change files to the challenge state and rewrite the outputs "
+                    "as OSM files (no GeoJSON: not usable by the MapRoulette workflow)."
+    )
+    parser.add_argument("-s", "--state", required=True, help="SQLite state file")
+    parser.add_argument("-c", "--changes", required=True, nargs="+",
+                        help="OSM change files (.osc, .osc.gz), oldest first")
+    parser.add_argument("-d", "--output-dir", default="tmp",
+                        help="Directory receiving one <rule>.osm file per rule")
+    parser.add_argument("-r", "--rules", default="",
+                        help="Comma separated list of rules to update (default: all)")
+    parser.add_argument("-i", "--input",
+                        help="OSM/PBF file with the node locations of the measured rules' changed "
+                             "ways (default: the input of the run that created the state)")
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    args = parse_args()
+
+    logging.info(f"State:      {args.state}")
+    logging.info(f"Output dir: {args.output_dir}")
+
+    rule_names = [r for r in args.rules.split(",") if r]
+    update_challenges(args.state, args.changes, args.output_dir, rule_names, args.input)
+
+
+if __name__ == "__main__":
+    main()
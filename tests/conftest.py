@@ -0,0 +1,34 @@
+"""
+Shared fixtures: a small synthetic extract (see pyosmium/synthetic.py) and a
+runner for the command line scripts.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYOSMIUM = os.path.join(ROOT, "pyosmium")
+
+# the modules are imported by bare name, as the scripts do
+sys.path.insert(0, PYOSMIUM)
+
+import synthetic  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def extract(tmp_path_factory):
+    """Synthetic PBF of a few blobs, with matches and near misses for every rule."""
+    filename = str(tmp_path_factory.mktemp("extract") / "synthetic.osm.pbf")
+    synthetic.generate(filename, nodes=40000, ways=3000, relations=30, density=0.3)
+    return filename
+
+
+def run_script(script, *args):
+    """Run a script of pyosmium/ and return its completed process, failing on errors."""
+    process = subprocess.run([sys.executable, os.path.join(PYOSMIUM, script), *args],
+                             capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    return process
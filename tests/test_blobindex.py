@@ -0,0 +1,107 @@
+"""Blob index: first objects of the blobs, lookups and empty blobs."""
+
+import shutil
+
+import osmium
+import pytest
+
+from blobindex import BlobIndex, IndexBuilder, UnsupportedBlob, _Stream, load_index
+from pbf import Blob, PbfFile, iter_blobs
+
+
+@pytest.fixture
+def indexed(extract, tmp_path):
+    """Copy of the synthetic extract with its blob index."""
+    filename = str(tmp_path / "indexed.osm.pbf")
+    shutil.copy(extract, filename)
+    index = BlobIndex.build(PbfFile(filename))
+    index.save()
+    return filename, index
+
+
+def blob_objects(pbf_file, blob):
+    """(type, id) of the objects of a blob, in file order."""
+    _, buf = next(pbf_file.iter_buffers([blob]))
+    return [(obj.type_str(), obj.id) for obj in osmium.FileProcessor(buf)]
+
+
+def test_first_objects(indexed):
+    _, index = indexed
+    assert len(index.pbf_file.data_blobs) > 3
+    assert index.sorted
+    for blob, obj_type, first_id in zip(index.pbf_file.data_blobs, index.types, index.first_ids):
+        assert blob_objects(index.pbf_file, blob)[0] == (obj_type, first_id)
+
+
+def test_blobs_from_and_for(indexed):
+    _, index = indexed
+    pbf_file = index.pbf_file
+    objects = {blob.offset: blob_objects(pbf_file, blob) for blob in pbf_file.data_blobs}
+
+    # from the blob before the first way blob, which may end with ways
+    ways_from = index.blobs_from("w")
+    assert any(t == "w" for blob in ways_from[:2] for t, _ in objects[blob.offset])
+    assert len(ways_from) < len(pbf_file.data_blobs)
+    skipped = pbf_file.data_blobs[:len(pbf_file.data_blobs) - len(ways_from)]
+    assert all(t == "n" for blob in skipped for t, _ in objects[blob.offset])
+
+    node_ids = [1, 2, 9000, 39999]
+    found = [obj for blob in index.blobs_for("n", node_ids) for obj in objects[blob.offset]]
+    assert all(("n", i) in found for i in node_ids)
+    assert len(index.blobs_for("n", [1, 2])) == 1
+
+
+def test_load(indexed):
+    filename, index = indexed
+    loaded = load_index(filename)
+    assert loaded.types == index.types
+    assert loaded.first_ids == index.first_ids
+    assert [b.offset for b in loaded.pbf_file.data_blobs] == [b.offset for b in index.pbf_file.data_blobs]
+    # the sidecar is ignored once the input changes
+    with open(filename, "ab") as f:
+        f.write(b"\0")
+    assert load_index(filename) is None
+
+
+def test_index_builder(indexed):
+    filename, index = indexed
+    builder = IndexBuilder()
+    with open(filename, "rb") as f:
+        for blob in iter_blobs(filename):
+            f.seek(blob.offset)
+            builder.add(blob, f.read(blob.size))
+    built = builder.save(filename)
+    assert built.types == index.types and built.first_ids == index.first_ids
+
+
+def test_empty_blobs_are_left_out(extract):
+    blobs = [Blob(0, 10, "OSMHeader")] + [Blob(10 * i, 10, "OSMData") for i in range(1, 7)]
+    index = BlobIndex(PbfFile(extract, blobs), [None, "n", None, "n", "w", None],
+                      [0, 1, 0, 100, 5, 0])
+    assert index.sorted
+
+    def offsets(found):
+        return [blob.offset for blob in found]
+
+    assert offsets(index.blobs_from("n")) == [10, 20, 30, 40, 50, 60]
+    assert offsets(index.blobs_from("w")) == [40, 50, 60]
+    assert offsets(index.blobs_for("n", [1, 50, 150])) == [20, 40]
+    assert offsets(index.blobs_for("w", [5, 7])) == [50]
+    assert offsets(index.blobs_for("r", [1])) == [50]
+
+
+def test_empty_blobs_saved(indexed):
+    filename, index = indexed
+    types = list(index.types)
+    first_ids = list(index.first_ids)
+    types[1], first_ids[1] = None, 0
+    BlobIndex(index.pbf_file, types, first_ids).save()
+    loaded = load_index(filename)
+    assert loaded.types[1] is None
+    assert loaded.sorted
+
+
+def test_other_compressions_are_not_read_partially():
+    # Blob with an empty lzma_data field (4)
+    with pytest.raises(UnsupportedBlob):
+        _Stream(b"\x22\x00")
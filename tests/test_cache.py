@@ -0,0 +1,69 @@
+"""Result cache keys, storage, and a run-challenges.py run restored from the cache."""
+
+import filecmp
+import os
+
+from cache import ResultCache, fingerprint, rule_key, url_fingerprint
+from challenges import get_rules
+from conftest import run_script
+from rules import Rule
+
+
+def test_url_fingerprint():
+    url = "https://example.org/extract.osm.pbf"
+    assert url_fingerprint(url, {}) is None
+    first = url_fingerprint(url, {"ETag": '"1"'})
+    assert first == url_fingerprint(url, {"ETag": '"1"', "Content-Length": "5"})
+    assert first != url_fingerprint(url, {"ETag": '"2"'})
+    assert first != url_fingerprint(url + "?v", {"ETag": '"1"'})
+    assert url_fingerprint(url, {"Last-Modified": "Mon, 05 Oct 2026 20:00:00 GMT"}) is not None
+
+
+def test_fingerprint(extract, tmp_path):
+    assert fingerprint(extract) == fingerprint(extract)
+    copy = tmp_path / "changed.osm.pbf"
+    with open(extract, "rb") as f:
+        data = bytearray(f.read())
+    data[-1] ^= 0xff
+    copy.write_bytes(bytes(data))
+    assert fingerprint(str(copy)) != fingerprint(extract)
+
+
+def test_rule_key():
+    rule = get_rules(["museum-no-fee"])[0]
+    key = rule_key(rule, "input", {"format": "osm"}, code="code")
+    assert key == rule_key(rule, "input", {"format": "osm"}, code="code")
+    assert key != rule_key(rule, "other input", {"format": "osm"}, code="code")
+    assert key != rule_key(rule, "input", {"format": "geojson"}, code="code")
+    assert key != rule_key(rule, "input", {"format": "osm"}, code="other code")
+    changed = Rule(rule.name, rule.entities, {"tourism": "museum"}, without={"fee": "yes"},
+                   conf=rule.conf)
+    assert key != rule_key(changed, "input", {"format": "osm"}, code="code")
+
+
+def test_put_and_restore(tmp_path):
+    output_dir = tmp_path / "out"
+    (output_dir / "rule" / "region").mkdir(parents=True)
+    (output_dir / "rule.geojson").write_text("features")
+    (output_dir / "rule" / "region" / "part.geojson").write_text("part")
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert "k" * 64 not in cache
+    cache.put("k" * 64, str(output_dir), ["rule.geojson", "rule", "missing.geojson"])
+    assert "k" * 64 in cache
+
+    restored = tmp_path / "restored"
+    restored.mkdir()
+    assert cache.restore("k" * 64, str(restored)) == ["rule.geojson", "rule"]
+    assert (restored / "rule.geojson").read_text() == "features"
+    assert (restored / "rule" / "region" / "part.geojson").read_text() == "part"
+
+
+def test_run_restored_from_cache(extract, tmp_path):
+    args = ["-i", extract, "-f", "geojson", "--cache", str(tmp_path / "cache"), "--no-progress"]
+    run_script("run-challenges.py", "-d", str(tmp_path / "first"), *args)
+    second = run_script("run-challenges.py", "-d", str(tmp_path / "second"), *args)
+    assert "All outputs restored from cache" in second.stderr
+    names = sorted(os.listdir(tmp_path / "first"))
+    assert sorted(os.listdir(tmp_path / "second")) == names
+    for name in names:
+        assert filecmp.cmp(tmp_path / "first" / name, tmp_path / "second" / name, shallow=False)
@@ -0,0 +1,84 @@
+"""Keys of the GeoJSON features compared by delta.py, and the delta they lead to."""
+
+import json
+
+import pytest
+
+from delta import FeatureSet, _feature_key, diff, read_features, write_delta
+
+
+def feature(osm_type, osm_id, geometry="Point", **tags):
+    coordinates = {"Point": [1.0, 2.0], "LineString": [[1.0, 2.0], [3.0, 4.0]],
+                   "MultiPolygon": [[[[1.0, 2.0], [3.0, 4.0], [1.0, 4.0], [1.0, 2.0]]]]}[geometry]
+    properties = {"@type": osm_type, "@id": osm_id, **tags}
+    return json.dumps({"type": "Feature", "geometry": {"type": geometry, "coordinates": coordinates},
+                       "properties": properties}, separators=(",", ":"))
+
+
+def write_collection(filename, features):
+    with open(filename, "w") as f:
+        f.write('{"type":"FeatureCollection","features":[\n')
+        f.write(",\n".join(features) + "\n]}\n")
+
+
+def test_keys_tell_types_ids_and_areas_apart():
+    keys = [_feature_key(feature("node", 7)),
+            _feature_key(feature("way", 7, "LineString")),
+            _feature_key(feature("way", 7, "MultiPolygon")),
+            _feature_key(feature("relation", 7, "MultiPolygon"))]
+    assert len(set(keys)) == 4
+    # sorted by type, then id, then area
+    assert keys == sorted(keys)
+    assert _feature_key(feature("node", 6)) < keys[0] < _feature_key(feature("node", 8))
+
+
+def test_keys_of_large_ids():
+    big = 13_000_000_000
+    assert _feature_key(feature("node", big)) < _feature_key(feature("way", 1, "LineString"))
+    assert _feature_key(feature("way", big, "LineString")) < _feature_key(feature("relation", 1))
+
+
+def test_features_need_type_and_id():
+    with pytest.raises(ValueError):
+        _feature_key('{"type":"Feature","geometry":{"type":"Point","coordinates":[0,0]},'
+                     '"properties":{"name":"x"}}')
+    with pytest.raises(ValueError):
+        FeatureSet([feature("node", 1), feature("node", 1, name="again")])
+
+
+def test_diff():
+    old = FeatureSet([feature("node", 1), feature("node", 2), feature("way", 3, "LineString")])
+    new = FeatureSet([feature("way", 3, "MultiPolygon"), feature("node", 2, name="changed"),
+                      feature("node", 1), feature("relation", 3, "MultiPolygon")])
+    added, resolved, modified = diff(old, new)
+    assert [new.features[i] for i in added] == [feature("way", 3, "MultiPolygon"),
+                                                feature("relation", 3, "MultiPolygon")]
+    assert [old.features[i] for i in resolved] == [feature("way", 3, "LineString")]
+    assert [new.features[i] for i in modified] == [feature("node", 2, name="changed")]
+
+
+def test_diff_with_empty_sides():
+    features = FeatureSet([feature("node", 1), feature("way", 1, "LineString")])
+    added, resolved, modified = diff(FeatureSet([]), features)
+    assert list(added) == [0, 1] and not len(resolved) and not len(modified)
+    added, resolved, modified = diff(features, FeatureSet([]))
+    assert not len(added) and list(resolved) == [0, 1] and not len(modified)
+
+
+def test_write_delta(tmp_path):
+    old_file = str(tmp_path / "old.geojson")
+    new_file = str(tmp_path / "new.geojson")
+    write_collection(old_file, [feature("node", 1), feature("node", 2)])
+    write_collection(new_file, [feature("node", 2, fee="yes"), feature("node", 3)])
+    counts = write_delta(old_file, new_file, str(tmp_path), "museum")
+    assert counts == {"previous": 2, "current": 2, "new": 1, "resolved": 1, "modified": 1}
+    assert read_features(str(tmp_path / "museum.new.geojson")) == [feature("node", 3)]
+    assert read_features(str(tmp_path / "museum.resolved.geojson")) == [feature("node", 1)]
+    assert read_features(str(tmp_path / "museum.modified.geojson")) == [feature("node", 2, fee="yes")]
+
+
+def test_missing_previous_output(tmp_path):
+    new_file = str(tmp_path / "new.geojson")
+    write_collection(new_file, [feature("node", 1)])
+    counts = write_delta(str(tmp_path / "missing.geojson"), new_file, str(tmp_path), "shop")
+    assert counts["new"] == 1 and counts["previous"] == 0
@@ -0,0 +1,34 @@
+"""The reading modes of run-challenges.py write the same outputs as a serial run."""
+
+import filecmp
+import os
+
+import pytest
+
+from conftest import run_script
+
+
+def run_challenges(input_file, output_dir, output_format, *options):
+    run_script("run-challenges.py", "-i", input_file, "-d", str(output_dir),
+               "-f", output_format, "--no-progress", *options)
+    return sorted(os.listdir(output_dir))
+
+
+@pytest.mark.parametrize("output_format", ["osm", "geojson"])
+@pytest.mark.parametrize("options", [["-j", "2"], ["--batch"], ["--checkpoint", "{tmp}/checkpoint"]],
+                         ids=["jobs", "batch", "checkpoint"])
+def test_same_outputs_as_serial(extract, tmp_path, output_format, options):
+    serial = run_challenges(extract, tmp_path / "serial", output_format)
+    options = [o.format(tmp=tmp_path) for o in options]
+    other = run_challenges(extract, tmp_path / "other", output_format, *options)
+    assert other == serial
+    for name in serial:
+        assert filecmp.cmp(tmp_path / "serial" / name, tmp_path / "other" / name, shallow=False), name
+    assert not os.path.exists(tmp_path / "checkpoint")
+
+
+def test_serial_outputs_have_matches(extract, tmp_path):
+    run_challenges(extract, tmp_path, "geojson")
+    for name in os.listdir(tmp_path):
+        with open(tmp_path / name) as f:
+            assert '"type":"Feature"' in f.read(), name
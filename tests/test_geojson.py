@@ -0,0 +1,96 @@
+"""GeoJSON outputs: collections and sequences, compressed or not, read back by delta.py."""
+
+import gzip
+import importlib.util
+import json
+
+import pytest
+
+from delta import iter_features
+from geojson import FeatureFile, open_input, open_output
+
+
+SUFFIXES = [".geojson", ".geojsonseq", ".geojson.gz", ".geojsonseq.gz",
+            ".geojson.zst", ".geojsonseq.zst"]
+
+HAS_ZSTANDARD = importlib.util.find_spec("zstandard") is not None
+
+
+def features(nb):
+    return [json.dumps({"type": "Feature",
+                        "geometry": {"type": "Point", "coordinates": [5.0 + i / 1000, 45.5]},
+                        "properties": {"@type": "node", "@id": i, "name": f"Église n°{i}"}},
+                       ensure_ascii=False, separators=(",", ":"))
+            for i in range(1, nb + 1)]
+
+
+def needs_compression(suffix):
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+
+
+@pytest.mark.parametrize("suffix", SUFFIXES)
+def test_feature_file_round_trip(tmp_path, suffix):
+    needs_compression(suffix)
+    filename = str(tmp_path / f"out{suffix}")
+    written = features(2000)
+    out = FeatureFile(filename)
+    for feature in written:
+        out.write_feature(feature)
+    out.close()
+    assert out.features == len(written)
+    assert list(iter_features(filename)) == written
+
+    with open_input(filename) as f:
+        lines = f.read().splitlines()
+    if ".geojsonseq" in suffix:
+        assert lines == written
+    else:
+        assert json.loads("\n".join(lines))["features"] == [json.loads(f) for f in written]
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+    if suffix.endswith(".gz"):
+        assert magic[:2] == b"\x1f\x8b"
+    elif suffix.endswith(".zst"):
+        assert magic == b"\x28\xb5\x2f\xfd"
+
+
+@pytest.mark.parametrize("suffix", [".geojsonseq", ".geojsonseq.gz", ".geojsonseq.zst"])
+def test_record_separators(tmp_path, suffix):
+    needs_compression(suffix)
+    filename = str(tmp_path / f"rfc8142{suffix}")
+    written = features(3)
+    with open_output(filename) as f:
+        # RFC 8142: a record separator before each feature, not necessarily compact
+        f.write("\x1e" + written[0] + "\n")
+        f.write("\x1e" + json.dumps(json.loads(written[1]), ensure_ascii=False, indent=None) + "\n")
+        f.write("\n")
+        f.write(written[2] + "\n")
+    assert list(iter_features(filename)) == written
+
+
+def test_collection_parsed_whole(tmp_path):
+    filename = str(tmp_path / "pretty.geojson.gz")
+    written = features(3)
+    with gzip.open(filename, "wt", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "features": [json.loads(f) for f in written]},
+                  f, ensure_ascii=False, indent=2)
+    assert list(iter_features(filename)) == written
+
+
+def test_existing_output_is_replaced(tmp_path):
+    filename = str(tmp_path / "out.geojsonseq.gz")
+    for nb in (5, 2):
+        out = FeatureFile(filename)
+        for feature in features(nb):
+            out.write_feature(feature)
+        out.close()
+    assert list(iter_features(filename)) == features(2)
+
+
+@pytest.mark.skipif(HAS_ZSTANDARD, reason="zstandard is installed")
+def test_zst_needs_zstandard(tmp_path):
+    with pytest.raises(ValueError, match="zstandard"):
+        open_output(str(tmp_path / "out.geojsonseq.zst"))
+    with pytest.raises(ValueError, match="zstandard"):
+        open_input(str(tmp_path / "out.geojsonseq.zst"))
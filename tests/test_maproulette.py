@@ -0,0 +1,111 @@
+"""MapRoulette client against a local aiohttp server: retries and chunked task pushes."""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from maproulette import MapRouletteClient, MapRouletteError
+
+
+def write_features(filename, count):
+    features = [json.dumps({"type": "Feature", "geometry": {"type": "Point", "coordinates": [0, 0]},
+                            "properties": {"@type": "node", "@id": i}}, separators=(",", ":"))
+                for i in range(1, count + 1)]
+    with open(filename, "w") as f:
+        f.write('{"type":"FeatureCollection","features":[\n' + ",\n".join(features) + "\n]}\n")
+
+
+def push(filename, answer, concurrency=1, chunk_size=10, timeout=5):
+    """Push the tasks of `filename` to a server answering the n-th request with `answer(n)`.
+
+    Return the ids of the tasks of every request received, in order, and the
+    result of add_tasks or the MapRouletteError raised.
+    """
+    received = []
+
+    async def handler(request):
+        features = json.loads(await request.read())["features"]
+        received.append([f["properties"]["@id"] for f in features])
+        return await answer(len(received)) or web.Response(text="{}")
+
+    async def main():
+        app = web.Application()
+        app.router.add_route("PUT", "/api/v2/challenge/{id}/addTasks", handler)
+        async with TestServer(app) as server:
+            async with MapRouletteClient("key", url=str(server.make_url("/")),
+                                         concurrency=concurrency, backoff=0.01,
+                                         timeout=timeout) as client:
+                try:
+                    return await client.add_tasks(1, filename, chunk_size)
+                except MapRouletteError as e:
+                    return e
+
+    return received, asyncio.run(main())
+
+
+@pytest.fixture
+def tasks(tmp_path):
+    filename = str(tmp_path / "tasks.geojson")
+    write_features(filename, 35)
+    return filename
+
+
+def test_chunks(tasks):
+    async def answer(number):
+        return None
+
+    received, sent = push(tasks, answer, concurrency=3)
+    assert sent == 35
+    assert sorted(len(ids) for ids in received) == [5, 10, 10, 10]
+    assert sorted(i for ids in received for i in ids) == list(range(1, 36))
+
+
+def test_refused_chunks_are_retried(tasks):
+    async def answer(number):
+        if number % 2:
+            return web.Response(status=503, text="busy", headers={"Retry-After": "0"})
+        return None
+
+    received, sent = push(tasks, answer)
+    assert sent == 35
+    assert len(received) == 8
+    assert received[::2] == received[1::2]
+    assert sorted(i for ids in received[1::2] for i in ids) == list(range(1, 36))
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_chunk_answered_with_server_error_is_not_sent_again(tasks, status):
+    async def answer(number):
+        # the chunk may have been stored before the error
+        return web.Response(status=status, text="error")
+
+    received, result = push(tasks, answer)
+    assert isinstance(result, MapRouletteError)
+    assert received == [list(range(1, 11))]
+
+
+def test_timed_out_chunk_is_not_sent_again(tasks):
+    async def answer(number):
+        if number == 2:
+            # applied by the server, but the answer comes too late
+            await asyncio.sleep(1)
+        return None
+
+    received, result = push(tasks, answer, timeout=0.5)
+    assert isinstance(result, MapRouletteError)
+    # the second chunk once, and no chunk read after it
+    assert received == [list(range(1, 11)), list(range(11, 21))]
+
+
+def test_failed_chunk_stops_the_push(tasks):
+    async def answer(number):
+        if number == 2:
+            return web.Response(status=400, text="bad")
+        return None
+
+    received, result = push(tasks, answer)
+    assert isinstance(result, MapRouletteError)
+    assert received == [list(range(1, 11)), list(range(11, 21))]
@@ -0,0 +1,81 @@
+"""Geodesic lengths and areas of the flat coordinate buffers, against known values."""
+
+import importlib.util
+import math
+
+import numpy as np
+import pytest
+
+from measure import EARTH_RADIUS, areas, lengths
+
+
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+HAS_SHAPELY = importlib.util.find_spec("shapely") is not None
+
+METHODS = ["numpy", pytest.param("shapely", marks=pytest.mark.skipif(
+    not HAS_SHAPELY, reason="shapely is not installed"))]
+
+
+def buffers(*ways):
+    """Flat lon, lat and offsets arrays of ways given as lists of (lon, lat)."""
+    points = [p for way in ways for p in way]
+    offsets = np.cumsum([0] + [len(way) for way in ways])
+    return (np.array([lon for lon, _ in points]), np.array([lat for _, lat in points]), offsets)
+
+
+def square(lon, lat, side):
+    """Closed ring of about `side` metres sides, from its south-west corner."""
+    dlat = side / METRES_PER_DEGREE
+    dlon = dlat / math.cos(math.radians(lat + dlat / 2))
+    return [(lon, lat), (lon + dlon, lat), (lon + dlon, lat + dlat), (lon, lat + dlat), (lon, lat)]
+
+
+def box_area(ring):
+    """Exact area of a ring along meridians and parallels on the sphere."""
+    (lon1, lat1), _, (lon2, lat2) = ring[:3]
+    return (EARTH_RADIUS ** 2 * math.radians(lon2 - lon1)
+            * (math.sin(math.radians(lat2)) - math.sin(math.radians(lat1))))
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_areas(method):
+    ring = square(5.0, 45.0, 100.0)
+    open_ring = ring[:-1]
+    reversed_ring = square(-70.0, -45.0, 100.0)[::-1]
+    lon, lat, offsets = buffers(ring, open_ring, reversed_ring, square(5.0, 60.0, 2000.0))
+    found = areas(lon, lat, offsets, method)
+    assert found[0] == pytest.approx(box_area(ring), rel=1e-4)
+    assert found[0] == pytest.approx(10000.0, rel=1e-3)
+    # not closed
+    assert found[1] == 0.0
+    # clockwise, in the southern hemisphere
+    assert found[2] == pytest.approx(10000.0, rel=1e-3)
+    assert found[3] == pytest.approx(4e6, rel=1e-3)
+
+
+def test_area_methods_agree():
+    rings = [square(lon, lat, side) for lon, lat, side in
+             [(5.0, 45.0, 100.0), (-120.0, 30.0, 10.0), (150.0, -70.0, 5000.0)]]
+    lon, lat, offsets = buffers(*rings)
+    expected = [box_area(ring) for ring in rings]
+    assert areas(lon, lat, offsets, "numpy") == pytest.approx(expected, rel=1e-4)
+    if HAS_SHAPELY:
+        assert areas(lon, lat, offsets, "shapely") == pytest.approx(expected, rel=1e-4)
+
+
+def test_lengths():
+    # 1° along the equator, then 1° along the meridian
+    corner = [(1.0, 0.0), (0.0, 0.0), (0.0, 1.0)]
+    lon, lat, offsets = buffers(corner, [(5.0, 45.0)], square(5.0, 45.0, 100.0))
+    found = lengths(lon, lat, offsets)
+    assert found[0] == pytest.approx(2 * METRES_PER_DEGREE, rel=1e-9)
+    assert found[1] == 0.0
+    assert found[2] == pytest.approx(400.0, rel=1e-3)
+
+
+def test_empty_buffers():
+    offsets = np.zeros(3, dtype=np.int64)
+    empty = np.zeros(0)
+    assert list(lengths(empty, empty, offsets)) == [0.0, 0.0]
+    assert list(areas(empty, empty, offsets)) == [0.0, 0.0]
@@ -0,0 +1,80 @@
+"""Overpass QL written for the rules: quoted tag filters and batched id statements."""
+
+import re
+
+import pytest
+
+from challenges import RULES
+from overpass import OverpassSink, rule_filter
+from rules import Rule
+
+
+STRING = r'"(?:[^"\\]|\\.)*"'
+
+# one tag filter: ["k"], [!"k"], ["k"="v"], ["k"!="v"] or ["k"~"regex"]
+TAG_FILTER = re.compile(rf'\[(?:!{STRING}|{STRING}(?:(?:=|!=|~){STRING})?)\]')
+
+GEOMETRY_FILTER = re.compile(r"\(if: length\(\) [<>]= \d+(?:\.\d+)?(?: && length\(\) [<>]= \d+(?:\.\d+)?)*\)")
+
+
+def check_syntax(lines, rule):
+    """Assert `lines` is one set filter per entity type, grouped in a union when several."""
+    if len(rule.entities) > 1:
+        assert lines[0] == "(" and lines[-1] == ");"
+        lines = [line[2:] for line in lines[1:-1]]
+    statements = "\n".join(lines).split(";")
+    assert statements[-1] == ""
+    for entity, statement in zip(rule.entities, statements):
+        head, *filters = statement.strip("\n").split("\n")
+        assert head == {"n": "node._", "w": "way._", "r": "relation._"}[entity]
+        for line in filters:
+            line = line.strip()
+            rest = GEOMETRY_FILTER.sub("", TAG_FILTER.sub("", line))
+            assert rest == "", f"{rule.name}: invalid filter {line!r}"
+    assert len(statements) == len(rule.entities) + 1
+
+
+@pytest.mark.parametrize("rule", RULES, ids=lambda rule: rule.name)
+def test_rule_filter_syntax(rule):
+    check_syntax(rule_filter(rule), rule)
+
+
+def test_keys_and_values_are_quoted():
+    rule = Rule("quoted", "n", tags={"contact:website": None, "name": 'say "hi"'},
+                without={"addr:street": None, "note": "a\\b"})
+    lines = rule_filter(rule)
+    check_syntax(lines, rule)
+    assert lines == ["node._",
+                     '  ["contact:website"]',
+                     '  ["name"="say \\"hi\\""]',
+                     '  [!"addr:street"]',
+                     '  ["note"!="a\\\\b"];']
+
+
+def test_value_lists_become_anchored_regexes():
+    rule = Rule("values", "w", tags={"highway": ["primary", "a.b|c"]})
+    lines = rule_filter(rule)
+    check_syntax(lines, rule)
+    assert lines[1] == '  ["highway"~"^(a\\\\.b\\\\|c|primary)$"];'
+
+
+def test_geometry_bounds():
+    assert rule_filter(Rule("area", "w", tags={"building": None}, min_area=500))[-1] == \
+        "  (if: length() >= 79.2);"
+    lines = rule_filter(Rule("length", "w", tags={"highway": None}, min_length=10, max_length=20))
+    assert lines[-1] == "  (if: length() >= 10 && length() <= 20);"
+
+
+def test_sink_batches_and_splits(tmp_path):
+    output = str(tmp_path / "query.opq")
+    sink = OverpassSink(output, footer=["way._;"], batch_size=2, max_ids=3)
+    for way_id in range(1, 6):
+        sink.add_id("w", way_id)
+    sink.close()
+    assert sink.files == [str(tmp_path / "query.001.opq"), str(tmp_path / "query.002.opq")]
+    with open(sink.files[0]) as f:
+        text = f.read()
+    assert "  way(id:1,2);\n  way(id:3);\n);\n" in text
+    assert "way._;\n" in text and "// Total of objects: 3\n" in text
+    with open(sink.files[1]) as f:
+        assert "  way(id:4,5);\n" in f.read()
@@ -0,0 +1,108 @@
+"""Stage graph: shared stages planned once, early deletes, failures stopping the dependents."""
+
+import json
+import os
+import sys
+
+import pytest
+
+import pipeline
+from pipeline import Pipeline, challenge_stages, export, plan, tags_filter
+
+
+# stands in for osmium: copies its input to -o, logs its call and the temporary files it saw
+FAKE_OSMIUM = """#!{python}
+import json, os, shutil, sys
+
+command, *rest = sys.argv[1:]
+inputs = []
+while rest and not rest[0].startswith("-"):
+    inputs.append(rest.pop(0))
+output = rest[rest.index("-o") + 1]
+with open({log!r}, "a") as f:
+    f.write(json.dumps({{"command": command, "inputs": inputs, "output": output,
+                        "tmp": sorted(os.listdir({tmp!r}))}}) + "\\n")
+if "FAIL" in rest:
+    sys.exit(1)
+shutil.copy(inputs[0], output)
+"""
+
+
+@pytest.fixture
+def osmium(tmp_path, monkeypatch):
+    """Calls of the fake osmium, in order."""
+    log = tmp_path / "calls.jsonl"
+    script = tmp_path / "osmium"
+    script.write_text(FAKE_OSMIUM.format(python=sys.executable, log=str(log),
+                                         tmp=str(tmp_path / "tmp")))
+    script.chmod(0o755)
+    monkeypatch.setattr(pipeline, "OSMIUM", str(script))
+
+    def calls():
+        if not log.exists():
+            return []
+        return [json.loads(line) for line in log.read_text().splitlines()]
+
+    return calls
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    filename = tmp_path / "input.osm"
+    filename.write_text("<osm/>\n")
+    return str(filename)
+
+
+def test_plan_shares_the_museum_stage(input_file, tmp_path):
+    stages = challenge_stages(input_file, str(tmp_path / "out"))
+    museums = [stages["museum-no-fee"], stages["museum-no-website"]]
+    planned = plan(museums)
+    # one museum extraction, then a filter and an export per challenge
+    assert len(planned) == 5
+    assert [s.name for s in planned].count("museum") == 1
+    assert len(plan(stages.values())) == 13
+    # dependencies first
+    seen = set()
+    for stage in planned:
+        assert all(d.key in seen for d in stage.stages)
+        seen.add(stage.key)
+    readers = Pipeline(museums, tmp_dir=str(tmp_path / "tmp")).readers
+    assert readers[planned[0].key] == 2
+
+
+def test_run(osmium, input_file, tmp_path):
+    out = tmp_path / "out"
+    stages = challenge_stages(input_file, str(out), conf_dir=str(tmp_path))
+    tmp_dir = str(tmp_path / "tmp")
+    timings = Pipeline(stages.values(), tmp_dir=tmp_dir, jobs=1).run()
+    calls = osmium()
+    assert len(calls) == 13
+    assert set(timings) == {s.name for s in plan(stages.values())}
+    assert sorted(os.listdir(out)) == sorted(f"{name}.geojson" for name in stages)
+    assert os.listdir(tmp_dir) == []
+
+    # every intermediate is there for its readers, and gone once the last one is done
+    deleted_early = 0
+    for call in calls:
+        if os.path.dirname(call["output"]) != tmp_dir:
+            continue
+        name = os.path.basename(call["output"])
+        readers = [j for j, c in enumerate(calls) if call["output"] in c["inputs"]]
+        assert readers and all(name in calls[j]["tmp"] for j in readers)
+        later = calls[max(readers) + 1:]
+        assert all(name not in c["tmp"] for c in later)
+        deleted_early += bool(later)
+    assert deleted_early > 3
+
+
+def test_failed_stage_stops_its_dependents(osmium, input_file, tmp_path):
+    out = tmp_path / "out"
+    broken = export("broken", tags_filter("broken", input_file, "FAIL"), "broken.conf",
+                    str(out / "broken.geojson"))
+    other = challenge_stages(input_file, str(out))["shop-no-category"]
+    # the shop filter runs first, then the broken filter (the longer chain) fails
+    with pytest.raises(RuntimeError, match=r"Stage broken failed, 2 stage\(s\) not run"):
+        Pipeline([other, broken], tmp_dir=str(tmp_path / "tmp"), jobs=1).run()
+    assert [c["command"] for c in osmium()] == ["tags-filter", "tags-filter"]
+    assert not os.path.exists(other.output)
+    assert not os.path.exists(broken.output)
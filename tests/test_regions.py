@@ -0,0 +1,161 @@
+"""Regions: .poly parsing, point in polygon, grid lookups and outputs split by region."""
+
+import json
+
+import numpy as np
+import pytest
+
+import regions
+import synthetic
+from conftest import run_script
+from delta import iter_features
+from regions import Region, RegionIndex, load_regions
+
+
+def write_poly(filename, rings):
+    """osmosis .poly file of (ring, hole) pairs, holes marked with "!"."""
+    lines = ["test"]
+    for i, (ring, hole) in enumerate(rings, 1):
+        lines.append(f"!{i}" if hole else str(i))
+        lines += [f"   {lon:E}   {lat:E}" for lon, lat in ring]
+        lines.append("END")
+    lines.append("END")
+    filename.write_text("\n".join(lines) + "\n")
+    return str(filename)
+
+
+def square(xmin, ymin, xmax, ymax):
+    return np.array([(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)],
+                    dtype=np.float64)
+
+
+def even_odd(rings, lon, lat):
+    """Reference ray casting over every edge of every ring."""
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+def test_poly_holes_and_rings(tmp_path):
+    filename = write_poly(tmp_path / "island.poly", [
+        (square(0, 0, 10, 10), False),
+        (square(4, 4, 6, 6), True),
+        # a second polygon, its ring not closed in the file
+        (square(20, 0, 30, 10)[:-1], False),
+    ])
+    [region] = load_regions([filename])
+    assert region.name == "island"
+    assert region.bbox == (0, 0, 30, 10)
+    assert region.contains(2, 2)
+    assert not region.contains(5, 5)
+    assert region.contains(25, 5)
+    assert not region.contains(15, 5)
+    assert not region.contains(-1, 5)
+
+
+def test_duplicate_names(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = write_poly(tmp_path / "a" / "same.poly", [(square(0, 0, 1, 1), False)])
+    second = write_poly(tmp_path / "b" / "same.poly", [(square(2, 0, 3, 1), False)])
+    with pytest.raises(ValueError, match="Duplicate region names"):
+        load_regions([first, second])
+
+    collection = tmp_path / "regions.geojson"
+    polygon = {"type": "Polygon", "coordinates": [square(0, 0, 1, 1).tolist()]}
+    collection.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": polygon, "properties": {"name": "same"}},
+        {"type": "Feature", "geometry": polygon, "properties": {"name": "other"}}]}))
+    assert [r.name for r in load_regions([str(collection)])] == ["same", "other"]
+    with pytest.raises(ValueError, match="Duplicate region names"):
+        load_regions([str(collection), first])
+
+
+@pytest.mark.parametrize("small_band", [regions.SMALL_BAND, 0], ids=["python", "numpy"])
+def test_points_on_band_boundaries(monkeypatch, small_band):
+    monkeypatch.setattr(regions, "SMALL_BAND", small_band)
+    # a comb: many edges, vertices on the band boundaries
+    ring = [(0.0, 0.0), (10.0, 0.0)]
+    for i in range(10, 0, -1):
+        ring += [(float(i), 10.0), (i - 0.5, 2.0)]
+    ring = np.array(ring + [(0.0, 0.0)])
+    hole = square(1.2, 0.5, 8.8, 1.5)
+    region = Region("comb", [ring, hole])
+    assert region.nb_bands > 1
+    ymin = region.bbox[1]
+    lats = [ymin + band * region.band_height for band in range(region.nb_bands + 1)]
+    lats += [0.5, 1.5, 2.0, 10.0, 4.25]
+    for lat in lats:
+        for lon in [x / 4 for x in range(-2, 43)]:
+            assert region.contains(lon, lat) == even_odd([ring, hole], lon, lat), (lon, lat)
+
+
+def test_shared_boundaries_belong_to_one_region():
+    west = Region("west", [square(-1, -1, 0, 1)])
+    east = Region("east", [square(0, -1, 1, 1)])
+    index = RegionIndex([west, east], cell=0.5)
+    for lat in [-1, -0.5, 0, 0.5]:
+        assert index.lookup(0, lat) == "east"
+        assert index.lookup(-1, lat) == "west"
+        # half-open: the far edges are in no region
+        assert index.lookup(1, lat) is None
+    assert index.lookup(0.5, 1) is None
+
+
+@pytest.mark.parametrize("cell", [1.0, 0.5, 0.3])
+def test_grid_cell_edges(cell):
+    # bounding boxes on and off the cell edges, in negative coordinates too
+    boxes = [Region("a", [square(-2, -2, -1, -1)]),
+             Region("b", [square(-1, -1, 1.5, 0)]),
+             Region("c", [np.array([(1.5, 0), (3, 0), (3, 2.7), (1.5, 0)])]),
+             Region("d", [square(0.2, 1.1, 1.0, 2.0)])]
+    index = RegionIndex(boxes, cell)
+    steps = [i / 10 for i in range(-25, 36)]
+    for lon in steps:
+        for lat in steps:
+            expected = next((r.name for r in boxes if r.contains(lon, lat)), None)
+            assert index.lookup(lon, lat) == expected, (lon, lat)
+
+
+def longitudes(coords):
+    """Longitudes of the nested coordinate lists of a GeoJSON geometry."""
+    if not isinstance(coords[0], list):
+        return [coords[0]]
+    return [lon for part in coords for lon in longitudes(part)]
+
+
+def test_outputs_split_by_region(extract, tmp_path):
+    xmin, ymin, xmax, ymax = synthetic.BBOX
+    middle = (xmin + xmax) / 2
+    west = write_poly(tmp_path / "west.poly",
+                      [(square(xmin - 1, ymin - 1, middle, ymax + 1), False)])
+    east = write_poly(tmp_path / "east.poly",
+                      [(square(middle, ymin - 1, xmax + 1, ymax + 1), False)])
+    output_dir = tmp_path / "out"
+    run_script("run-challenges.py", "-i", extract, "-d", str(output_dir), "-f", "geojson",
+               "--regions", west, east, "--no-progress")
+
+    rules = [p.stem for p in output_dir.glob("*.geojson")]
+    assert len(rules) > 5
+    split = 0
+    for rule in rules:
+        features = list(iter_features(str(output_dir / f"{rule}.geojson")))
+        parts = {}
+        for name in ["west", "east"]:
+            filename = output_dir / rule / f"{name}.geojson"
+            parts[name] = list(iter_features(str(filename))) if filename.exists() else []
+        # every feature in exactly one region
+        assert sorted(parts["west"] + parts["east"]) == sorted(features), rule
+        assert not set(parts["west"]) & set(parts["east"]), rule
+        # features on one side of the split are in that side's region
+        for feature in features:
+            lons = longitudes(json.loads(feature)["geometry"]["coordinates"])
+            if max(lons) < middle:
+                assert feature in parts["west"], rule
+            elif min(lons) >= middle:
+                assert feature in parts["east"], rule
+        split += bool(parts["west"]) and bool(parts["east"])
+    assert split > 3
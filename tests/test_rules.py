@@ -0,0 +1,65 @@
+"""Rule.match, Rule.match_columns and TagStore.match select the same objects."""
+
+import numpy as np
+import osmium
+import pytest
+
+from blobindex import TYPE_CODES
+from challenges import RULES
+from rules import Rule
+from tagstore import TagStore
+
+
+EXTRA_RULES = [
+    Rule("bounded-nodes", "w", tags={"amenity": ["parking", "parking_space"]},
+         without={"access": "private"}, min_nodes=5, max_nodes=12),
+    Rule("value-list", "nwr", tags={"amenity": ["place_of_worship", "parking"]},
+         without={"religion": ["christian"], "parking": None}),
+]
+
+
+def read_objects(input_file, rule):
+    """(type, id, tags, node count) of the objects of the rule's entity types."""
+    objects = []
+    for obj in osmium.FileProcessor(input_file, rule.entity_bits()):
+        nodes = len(obj.nodes) if obj.type_str() == "w" else 0
+        objects.append((obj.type_str(), obj.id, dict(obj.tags), nodes, rule.match(obj)))
+    return objects
+
+
+def columns_of(objects, keys):
+    columns = {}
+    for key in keys:
+        column = np.full(len(objects), None, dtype=object)
+        column[:] = [tags.get(key) for _, _, tags, _, _ in objects]
+        columns[key] = column
+    return columns
+
+
+@pytest.mark.parametrize("rule", RULES + EXTRA_RULES, ids=lambda rule: rule.name)
+def test_match_columns_and_tag_store_agree_with_match(extract, rule):
+    objects = read_objects(extract, rule)
+    expected = {(t, i) for t, i, _, _, matched in objects if matched}
+    assert expected, "the synthetic extract should hold matches of every rule"
+
+    found = set()
+    for obj_type in "nwr":
+        part = [o for o in objects if o[0] == obj_type]
+        if not part:
+            continue
+        keys = set(rule.tags) | set(rule.without)
+        nodes = np.array([o[3] for o in part], dtype=np.int64) if obj_type == "w" else None
+        mask = rule.match_columns(len(part), columns_of(part, keys), nodes)
+        found |= {(t, i) for (t, i, _, _, _), ok in zip(part, mask.tolist()) if ok}
+    assert found == expected
+
+    store = TagStore.build(extract, sorted(rule.tags), sorted(set(rule.without) - set(rule.tags)))
+    names = {code: t for t, code in TYPE_CODES.items()}
+    rows = np.flatnonzero(store.match(rule))
+    assert {(names[int(store.types[r])], int(store.ids[r])) for r in rows} == expected
+
+
+def test_match_columns_without_required_column():
+    rule = Rule("museum", "n", tags={"tourism": "museum"})
+    columns = {"fee": np.array(["yes", None], dtype=object)}
+    assert not rule.match_columns(2, columns).any()
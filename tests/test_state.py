@@ -0,0 +1,136 @@
+"""Incremental updates: a change file applied to the state of a run-challenges.py run."""
+
+import re
+
+import osmium
+import pytest
+
+import synthetic
+from conftest import run_script
+from state import StateStore
+
+
+RULE_NAMES = ["museum-no-fee", "museum-no-website", "oneway-discouraged-values",
+              "big-parking-space"]
+
+NEW_ID = 1_000_000_000
+
+
+def stored(state_file, rule_name):
+    store = StateStore(state_file)
+    try:
+        rows = store.db.execute("SELECT type, id, version FROM matches WHERE rule = ?", (rule_name,))
+        return set(rows.fetchall())
+    finally:
+        store.close()
+
+
+def exported(filename):
+    """{(type, id): (version, tags)} of an OSM file."""
+    return {(obj.type_str(), obj.id): (obj.version, dict(obj.tags))
+            for obj in osmium.FileProcessor(filename)}
+
+
+def node(obj_id, version, lon, lat, **tags):
+    tags = "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+    return f'<node id="{obj_id}" version="{version}" lat="{lat:.7f}" lon="{lon:.7f}">{tags}</node>'
+
+
+def way(obj_id, version, refs, **tags):
+    nds = "".join(f'<nd ref="{ref}"/>' for ref in refs)
+    tags = "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+    return f'<way id="{obj_id}" version="{version}">{nds}{tags}</way>'
+
+
+def ring(first_id, center, radius, nb=8):
+    """New nodes of a closed ring, and the node refs of its way."""
+    points = synthetic._ring(center, radius, nb)
+    nodes = [node(first_id + i, 1, lon, lat) for i, (lon, lat) in enumerate(points)]
+    return nodes, [first_id + i for i in range(nb)] + [first_id]
+
+
+@pytest.fixture
+def state(extract, tmp_path):
+    """State and .osm outputs of a full run over the synthetic extract."""
+    state_file = str(tmp_path / "state.sqlite")
+    run_script("run-challenges.py", "-i", extract, "-d", str(tmp_path / "full"), "-s", state_file,
+               "-r", ",".join(RULE_NAMES), "--no-progress")
+    return state_file
+
+
+def test_apply_change_file(extract, state, tmp_path):
+    both = sorted({i for t, i, _ in stored(state, "museum-no-fee") if t == "n"}
+                  & {i for t, i, _ in stored(state, "museum-no-website") if t == "n"})
+    renamed, with_fee = both[:2]
+    deleted = min(i for _, i, _ in stored(state, "oneway-discouraged-values"))
+    shrunk = min(i for _, i, _ in stored(state, "big-parking-space"))
+    locations = {obj.id: (obj.location.lon, obj.location.lat)
+                 for obj in osmium.FileProcessor(extract, osmium.osm.NODE)
+                 if obj.id in (renamed, with_fee)}
+
+    small_nodes, small_refs = ring(NEW_ID + 100, (5.5, 45.5), 3.0)
+    big_nodes, big_refs = ring(NEW_ID + 200, (5.6, 45.6), 40.0)
+    lon, lat = locations[renamed]
+    change_file = tmp_path / "changes.osc"
+    change_file.write_text("\n".join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<osmChange version="0.6" generator="test">',
+        "<create>",
+        node(NEW_ID, 1, 5.2, 45.2, tourism="museum"),
+        *small_nodes, *big_nodes,
+        way(NEW_ID, 1, big_refs, amenity="parking_space"),
+        "</create>",
+        "<modify>",
+        node(renamed, 3, lon, lat, tourism="museum", name="Renamed"),
+        # older than the version above: ignored
+        node(renamed, 2, lon, lat, tourism="museum", fee="yes", website="https://example.org"),
+        node(with_fee, 2, *locations[with_fee], tourism="museum", fee="yes"),
+        # same tags, a ring of about 28 m²
+        way(shrunk, 2, small_refs, amenity="parking_space"),
+        "</modify>",
+        "<delete>",
+        way(deleted, 2, []),
+        "</delete>",
+        "</osmChange>",
+    ]) + "\n")
+
+    output_dir = tmp_path / "updated"
+    process = run_script("update-challenges.py", "-s", state, "-c", str(change_file),
+                         "-d", str(output_dir), "-r", ",".join(RULE_NAMES))
+    counts = dict(re.findall(r"\] ([\w-]+): (\+\d+ ~\d+ -\d+)", process.stderr))
+    assert counts == {
+        "museum-no-fee": "+1 ~1 -1",
+        "museum-no-website": "+1 ~2 -0",
+        "oneway-discouraged-values": "+0 ~0 -1",
+        "big-parking-space": "+1 ~0 -1",
+    }
+
+    for name in RULE_NAMES:
+        before = exported(str(tmp_path / "full" / f"{name}.osm"))
+        after = exported(str(output_dir / f"{name}.osm"))
+        if name == "museum-no-fee":
+            assert after.keys() == (before.keys() | {("n", NEW_ID)}) - {("n", with_fee)}
+        elif name == "museum-no-website":
+            assert after.keys() == before.keys() | {("n", NEW_ID)}
+            assert after[("n", with_fee)] == (2, {"tourism": "museum", "fee": "yes"})
+        elif name == "oneway-discouraged-values":
+            assert after.keys() == before.keys() - {("w", deleted)}
+        else:
+            assert after.keys() == (before.keys() | {("w", NEW_ID)}) - {("w", shrunk)}
+        if name.startswith("museum"):
+            assert after[("n", renamed)] == (3, {"tourism": "museum", "name": "Renamed"})
+            assert after[("n", NEW_ID)] == (1, {"tourism": "museum"})
+    assert ("w", NEW_ID, 1) in stored(state, "big-parking-space")
+
+
+def test_measured_rules_need_an_input(extract, state, tmp_path):
+    store = StateStore(state)
+    store.set_meta("input_file", str(tmp_path / "missing.osm.pbf"))
+    store.close()
+    change_file = tmp_path / "empty.osc"
+    change_file.write_text('<osmChange version="0.6"></osmChange>\n')
+    with pytest.raises(AssertionError, match="FileNotFoundError"):
+        run_script("update-challenges.py", "-s", state, "-c", str(change_file),
+                   "-d", str(tmp_path / "out"), "-r", "big-parking-space")
+    run_script("update-challenges.py", "-s", state, "-c", str(change_file),
+               "-d", str(tmp_path / "out"), "-r", "big-parking-space", "-i", extract)
@@ -0,0 +1,146 @@
+"""HttpRangeReader over a fake server: segments in order, resumed downloads and failures."""
+
+import http.client
+import io
+import re
+
+import osmium
+import pytest
+
+import stream
+from blobindex import IndexBuilder, load_index
+from stream import HttpRangeReader, iter_stream_buffers
+
+
+URL = "http://example.org/extract.osm.pbf"
+
+
+class Response(io.BytesIO):
+    def __init__(self, data, status=200, headers=None):
+        super().__init__(data)
+        self.status = status
+        self.headers = headers or {}
+
+
+class FakeServer:
+    """urlopen serving `data`, with range support unless `ranges` is False.
+
+    `fail(request number, start)` returns an exception to raise, or a number
+    of bytes after which the connection is closed, or None.
+    """
+
+    def __init__(self, data, ranges=True, fail=None):
+        self.data = data
+        self.ranges = ranges
+        self.fail = fail
+        self.requests = 0
+
+    def urlopen(self, request, timeout=None):
+        headers = {"ETag": '"v1"'}
+        range_header = request.headers.get("Range") if hasattr(request, "headers") else None
+        if not self.ranges or range_header is None:
+            return Response(self.data, 200, headers)
+        start, end = map(int, re.fullmatch(r"bytes=(\d+)-(\d+)", range_header).groups())
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(self.data)}"
+        if range_header == "bytes=0-0":
+            return Response(self.data[:1], 206, headers)
+        self.requests += 1
+        failure = self.fail(self.requests, start) if self.fail else None
+        if isinstance(failure, Exception):
+            raise failure
+        data = self.data[start:end + 1]
+        if failure is not None:
+            data = data[:failure]
+        return Response(data, 206, headers)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    monkeypatch.setattr(stream.time, "sleep", lambda seconds: None)
+
+    def serve(data, **options):
+        server = FakeServer(data, **options)
+        monkeypatch.setattr(stream.urllib.request, "urlopen", server.urlopen)
+        return server
+
+    return serve
+
+
+def read_all(reader, size=1000):
+    parts = []
+    while True:
+        part = reader.read(size)
+        if not part:
+            return b"".join(parts)
+        parts.append(part)
+
+
+DATA = bytes(range(256)) * 40
+
+
+def test_segments_in_order(serve, tmp_path):
+    serve(DATA)
+    copy = tmp_path / "copy.bin"
+    with HttpRangeReader(URL, copy=str(copy), connections=3, segment_size=700) as reader:
+        assert reader.size == len(DATA)
+        assert reader.headers["ETag"] == '"v1"'
+        assert read_all(reader, 333) == DATA
+    assert copy.read_bytes() == DATA
+
+
+def test_without_range_support(serve):
+    serve(DATA, ranges=False)
+    with HttpRangeReader(URL, segment_size=700) as reader:
+        assert reader.size is None
+        assert read_all(reader) == DATA
+
+
+def test_resumes_failed_segments(serve):
+    # every segment fails twice before being served: IncompleteRead and
+    # ValueError are not OSErrors, closed connections are resumed where they stopped
+    attempts = {}
+
+    def fail(number, start):
+        segment = start // 1000
+        attempts[segment] = attempts.get(segment, 0) + 1
+        failures = [100, ValueError("bad chunk")] if segment % 2 else \
+            [http.client.IncompleteRead(b""), 100]
+        return failures[attempts[segment] - 1] if attempts[segment] <= 2 else None
+
+    server = serve(DATA, fail=fail)
+    with HttpRangeReader(URL, connections=2, segment_size=1000) as reader:
+        assert read_all(reader) == DATA
+    assert server.requests == 3 * (len(DATA) // 1000 + 1)
+
+
+@pytest.mark.parametrize("failure", [http.client.IncompleteRead(b""), ValueError("bad chunk"),
+                                     ConnectionResetError()],
+                         ids=["incomplete-read", "value-error", "os-error"])
+def test_failed_segment_raises(serve, failure):
+    serve(DATA, fail=lambda number, start: failure if start >= 2000 else None)
+    with HttpRangeReader(URL, connections=2, segment_size=1000) as reader:
+        assert reader.read(2000) == DATA[:2000]
+        with pytest.raises(type(failure)):
+            reader.read(1000)
+
+
+def test_connection_closed_for_good_raises(serve):
+    serve(DATA, fail=lambda number, start: 0 if start >= 1000 else None)
+    with HttpRangeReader(URL, connections=2, segment_size=1000) as reader:
+        with pytest.raises(IOError):
+            read_all(reader)
+
+
+def test_stream_buffers_and_index(serve, extract, tmp_path):
+    with open(extract, "rb") as f:
+        data = f.read()
+    serve(data)
+    copy = str(tmp_path / "streamed.osm.pbf")
+    builder = IndexBuilder()
+    count = 0
+    with HttpRangeReader(URL, copy=copy, segment_size=64 * 1024) as reader:
+        for _, buf in iter_stream_buffers(reader, chunk_size=128 * 1024, on_blob=builder.add):
+            count += sum(1 for _ in osmium.FileProcessor(buf))
+    builder.save(copy)
+    assert count == sum(1 for _ in osmium.FileProcessor(extract))
+    assert load_index(copy) is not None